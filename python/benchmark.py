@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+#################################################################
+# FILE:  benchmark.py
+#
+# DESCRIPTION:    This script benchmarks the cleanup scripts offline against the fake Control Hub
+#                 in fake_control_hub.py. It has two modes:
+#
+#                 - Workers: runs get-old-jobs.py once for each requested number of workers,
+#                   reports the wall time of each run, and confirms that every run wrote exactly
+#                   the same output file.
+#
+#                 - Suite: for each requested number of synthetic Jobs, runs get-old-jobs.py,
+#                   export-old-jobs.py and delete-old-jobs.py end to end, each in its own process,
+#                   and reports the wall time, the Control Hub calls per Job, the peak RSS and the
+#                   throughput of each script, so regressions in the hot loops can be measured.
+#                   It then runs cleanup-old-jobs.py, which does all three in a single pass, on a
+#                   fresh set of the same synthetic Jobs for comparison.
+#                   The fake Control Hub is configured with the FAKE_SCH_* environment variables,
+#                   for example the latency, the error rate, the history size and the template mix.
+#
+# ARGS:           - workers - One or more worker counts to benchmark, for example: 1 8 32
+#
+# OPTIONS:        --suite        - Run the suite instead of comparing worker counts.
+#
+#                 --jobs N,N,... - The numbers of synthetic Jobs to run the suite with.
+#                                  Defaults to 1000,10000,100000.
+#
+#                 --workers N    - The --workers option passed to each script in the suite. Defaults to 8.
+#
+# USAGE:          $ python3 benchmark.py <workers> [<workers> ...]
+#                 $ python3 benchmark.py --suite [--jobs N,N,...] [--workers N]
+#
+# USAGE EXAMPLE:  $ FAKE_SCH_JOBS=2000 FAKE_SCH_LATENCY_MS=20 python3 benchmark.py 1 8 32
+#                 $ FAKE_SCH_LATENCY_MS=5 FAKE_SCH_HISTORY_RUNS=20 python3 benchmark.py --suite --jobs 1000,10000
+#
+#################################################################
+
+import os, sys, io, json, time, runpy, resource, tempfile, contextlib, filecmp, subprocess
+import fake_control_hub
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# A fixed threshold that is well after the synthetic history generated by the fake Control Hub
+LAST_RUN_THRESHOLD = '2025-06-30'
+
+# The numbers of synthetic Jobs the suite is run with by default
+DEFAULT_SUITE_JOBS = '1000,10000,100000'
+
+# Method to run one of the cleanup scripts in-process against the fake Control Hub.
+# The script's own output is suppressed. Returns the wall time of the run in seconds
+def run_script(script_name, args):
+    saved_argv = sys.argv
+    sys.argv = [script_name] + args
+    start = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            runpy.run_path(os.path.join(SCRIPT_DIR, script_name), run_name='__main__')
+    finally:
+        sys.argv = saved_argv
+    return time.perf_counter() - start
+
+# Method that runs a script in-process and writes its wall time, exit status, Control Hub call
+# counts and peak RSS to the_stats_file as JSON. Used in the child process started by run_script_in_child()
+def run_child(the_stats_file, the_script_name, the_args):
+    fake_control_hub.install()
+    exit_status = 0
+    error = None
+    start = time.perf_counter()
+    try:
+        run_script(the_script_name, the_args)
+    except SystemExit as ex:
+        exit_status = ex.code if isinstance(ex.code, int) else 1
+    except Exception as ex:
+        exit_status = 1
+        error = str(ex)
+    seconds = time.perf_counter() - start
+    call_counts = {}
+    for control_hub in fake_control_hub.FakeControlHub.instances:
+        for operation, count in control_hub.call_counts.items():
+            call_counts[operation] = call_counts.get(operation, 0) + count
+    with open(the_stats_file, 'w') as f:
+        json.dump({'seconds': seconds,
+                   'exit_status': exit_status,
+                   'error': error,
+                   'call_counts': call_counts,
+                   'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}, f)
+
+# Method that runs a script in a child process with the_number_of_jobs synthetic Jobs, so that its
+# peak RSS is measured on its own. Returns the stats written by run_child()
+def run_script_in_child(the_script_name, the_args, the_number_of_jobs, the_temp_dir):
+    stats_file = os.path.join(the_temp_dir, 'stats.json')
+    env = dict(os.environ, FAKE_SCH_JOBS=str(the_number_of_jobs))
+    subprocess.run([sys.executable, os.path.abspath(__file__), '--child', stats_file, the_script_name] + the_args,
+                   env=env, stdout=subprocess.DEVNULL, check=True)
+    with open(stats_file, 'r') as f:
+        return json.load(f)
+
+# Method that returns the number of lines in a file
+def count_lines(the_file):
+    with open(the_file, 'r') as f:
+        return sum(1 for _ in f)
+
+# Method that prints a line of the suite report
+def print_report_line(the_script_name, the_jobs, the_stats):
+    calls = sum(the_stats['call_counts'].values())
+    seconds = the_stats['seconds']
+    status = '' if the_stats['exit_status'] == 0 else f"  failed: {the_stats['error'] or 'exit status ' + str(the_stats['exit_status'])}"
+    print(f"{the_script_name:<20} jobs: {the_jobs:>7}  wall time: {seconds:8.2f} s  calls/job: {calls / max(the_jobs, 1):6.2f}  "
+          f"peak RSS: {the_stats['peak_rss_kb'] / 1024:7.1f} MB  throughput: {the_jobs / seconds:8.0f} jobs/s{status}")
+
+# Method that runs the suite: get-old-jobs.py, export-old-jobs.py and delete-old-jobs.py end to end,
+# and then cleanup-old-jobs.py, for each number of synthetic Jobs in the_jobs_counts
+def run_suite(the_jobs_counts, the_workers):
+    for number_of_jobs in the_jobs_counts:
+        print(f"Jobs: {number_of_jobs}")
+        with tempfile.TemporaryDirectory() as temp_dir:
+            old_jobs_file = os.path.join(temp_dir, 'old_jobs.json')
+            stats = run_script_in_child('get-old-jobs.py', [LAST_RUN_THRESHOLD, old_jobs_file, '--workers', the_workers], number_of_jobs, temp_dir)
+            print_report_line('get-old-jobs.py', number_of_jobs, stats)
+
+            # Export and delete the old Jobs found, unless the search failed
+            if stats['exit_status'] == 0:
+                old_jobs = count_lines(old_jobs_file)
+                stats = run_script_in_child('export-old-jobs.py', [old_jobs_file, os.path.join(temp_dir, 'export'), '--workers', the_workers], number_of_jobs, temp_dir)
+                print_report_line('export-old-jobs.py', old_jobs, stats)
+                stats = run_script_in_child('delete-old-jobs.py', [old_jobs_file, '--workers', the_workers], number_of_jobs, temp_dir)
+                print_report_line('delete-old-jobs.py', old_jobs, stats)
+                stats = run_script_in_child('cleanup-old-jobs.py', [LAST_RUN_THRESHOLD, os.path.join(temp_dir, 'cleanup'), '--workers', the_workers], number_of_jobs, temp_dir)
+                print_report_line('cleanup-old-jobs.py', old_jobs, stats)
+        print("---------------------------------")
+
+# Method that compares the wall time and the output of get-old-jobs.py for each number of workers
+def run_workers_comparison(the_workers_counts):
+    fake_control_hub.install()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        baseline_output_file = None
+        baseline_seconds = None
+        for workers in the_workers_counts:
+            output_file = os.path.join(temp_dir, f"old_jobs_{workers}.json")
+            seconds = run_script('get-old-jobs.py', [LAST_RUN_THRESHOLD, output_file, '--workers', workers])
+            if baseline_output_file is None:
+                baseline_output_file = output_file
+                baseline_seconds = seconds
+            same_output = filecmp.cmp(baseline_output_file, output_file, shallow=False)
+            print(f"workers: {workers:>4}  wall time: {seconds:8.2f} s  speedup: {baseline_seconds / seconds:6.2f}x  same output: {same_output}")
+    print("---------------------------------")
+
+#####################################
+# Main Program
+#####################################
+
+if __name__ == '__main__':
+
+    # The child process of the suite runs one script and exits
+    if len(sys.argv) >= 4 and sys.argv[1] == '--child':
+        run_child(sys.argv[2], sys.argv[3], sys.argv[4:])
+        sys.exit(0)
+
+    suite = '--suite' in sys.argv
+    if suite:
+        sys.argv.remove('--suite')
+    jobs_option = DEFAULT_SUITE_JOBS
+    workers_option = '8'
+    for name in ('--jobs', '--workers'):
+        if name in sys.argv and suite:
+            index = sys.argv.index(name)
+            if index + 1 >= len(sys.argv):
+                print(f"Error: The option '{name}' requires a value")
+                sys.exit(1)
+            if name == '--jobs':
+                jobs_option = sys.argv[index + 1]
+            else:
+                workers_option = sys.argv[index + 1]
+            del sys.argv[index:index + 2]
+
+    if (suite and len(sys.argv) != 1) or (not suite and len(sys.argv) < 2):
+        print('Error: Wrong number of arguments')
+        print('Usage: $ python3 benchmark.py <workers> [<workers> ...]')
+        print('Usage: $ python3 benchmark.py --suite [--jobs N,N,...] [--workers N]')
+        print('Usage Example: $ FAKE_SCH_JOBS=2000 FAKE_SCH_LATENCY_MS=20 python3 benchmark.py 1 8 32')
+        sys.exit(1)
+
+    print("---------------------------------")
+    if suite:
+        print(f"Latency: {os.getenv('FAKE_SCH_LATENCY_MS', '0')} ms  Error rate: {os.getenv('FAKE_SCH_ERROR_RATE', '0')}  "
+              f"History runs: {os.getenv('FAKE_SCH_HISTORY_RUNS', '1')}  Template rate: {os.getenv('FAKE_SCH_TEMPLATE_RATE', '0.05')}  "
+              f"Workers: {workers_option}")
+        print("---------------------------------")
+        run_suite([int(jobs) for jobs in jobs_option.split(',')], workers_option)
+    else:
+        print(f"Jobs: {os.getenv('FAKE_SCH_JOBS', '1000')}  Latency: {os.getenv('FAKE_SCH_LATENCY_MS', '0')} ms")
+        print("---------------------------------")
+        run_workers_comparison(sys.argv[1:])
+    print('Done')
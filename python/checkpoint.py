@@ -0,0 +1,121 @@
+#################################################################
+# FILE:  checkpoint.py
+#
+# DESCRIPTION:    An append-only JSONL checkpoint journal shared by the cleanup scripts. Each
+#                 line records a Job ID that was processed and the outcome, so that a run that
+#                 was interrupted can be resumed with --resume without redoing the Jobs that
+#                 were already processed.
+#
+#                 When resuming, only the outcome of each Job ID is kept in memory, along with the
+#                 fields that a script asks to keep for particular outcomes, rather than every record.
+#                 Otherwise no Job ID can have been processed before, so only the number of records
+#                 with each outcome is kept.
+#
+#################################################################
+
+import os, sys, json, threading
+
+# The number of records written between calls to fsync
+FSYNC_INTERVAL = 100
+
+
+# An append-only checkpoint journal. If the_resume is True, the records of a previous run are
+# loaded from the_path and new records are appended; otherwise the journal is started afresh, and
+# the outcomes of the Job IDs are not kept in memory since get_outcome() could never return one.
+# the_kept_fields maps outcomes to the names of the fields of their records that are kept in memory,
+# for get_fields(); the other fields are only written to the file. The distinct values of the
+# last_run_threshold field are kept in last_run_thresholds
+class CheckpointJournal:
+    def __init__(self, the_path, the_resume, the_kept_fields=None):
+        self.path = the_path
+        self.last_run_thresholds = set()
+        self._keeps_outcomes = the_resume
+        self._kept_fields = the_kept_fields or {}
+        self._outcomes = {}
+        self._fields = {}
+        self._outcome_counts = {}
+        if the_resume and os.path.isfile(the_path):
+            with open(the_path, 'r') as f:
+                for line in f:
+                    # A line that was only partly written when the previous run died is ignored
+                    try:
+                        record = json.loads(line)
+                        self._keep(record.pop('job_id'), record.pop('outcome'), record)
+                    except (json.JSONDecodeError, KeyError, TypeError, AttributeError):
+                        pass
+        self._file = open(the_path, 'a' if the_resume else 'w')
+
+        # Start a new line if the previous run died in the middle of writing one
+        if self._file.tell() > 0:
+            with open(the_path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    self._file.write('\n')
+        self._lock = threading.Lock()
+        self._unsynced_count = 0
+
+    # Method that keeps the outcome of the_job_id in memory, with the fields to keep for that outcome
+    def _keep(self, the_job_id, the_outcome, the_fields):
+        the_outcome = sys.intern(the_outcome)
+        if 'last_run_threshold' in the_fields:
+            self.last_run_thresholds.add(the_fields['last_run_threshold'])
+        if not self._keeps_outcomes:
+            self._outcome_counts[the_outcome] = self._outcome_counts.get(the_outcome, 0) + 1
+            return
+        previous_outcome = self._outcomes.get(the_job_id)
+        if previous_outcome is not None:
+            self._outcome_counts[previous_outcome] -= 1
+        self._outcomes[the_job_id] = the_outcome
+        self._outcome_counts[the_outcome] = self._outcome_counts.get(the_outcome, 0) + 1
+        kept_fields = {name: the_fields[name] for name in self._kept_fields.get(the_outcome, ()) if name in the_fields}
+        if kept_fields:
+            self._fields[the_job_id] = kept_fields
+        else:
+            self._fields.pop(the_job_id, None)
+
+    # Method that returns the number of Job IDs recorded, or of records if not resuming
+    def __len__(self):
+        return sum(self._outcome_counts.values())
+
+    # Method that returns the recorded outcome of the_job_id, or None if it was not processed
+    def get_outcome(self, the_job_id):
+        return self._outcomes.get(the_job_id)
+
+    # Method that returns the kept fields of the record of the_job_id, an empty dict if there are none
+    def get_fields(self, the_job_id):
+        return self._fields.get(the_job_id, {})
+
+    # Method that yields tuples of the Job ID and the kept fields of each record that has any
+    def iter_fields(self):
+        return iter(list(self._fields.items()))
+
+    # Method that returns True if the_job_id was processed with an outcome other than one of
+    # the_retry_outcomes, i.e. it does not need to be processed again
+    def is_done(self, the_job_id, the_retry_outcomes=('error',)):
+        outcome = self.get_outcome(the_job_id)
+        return outcome is not None and outcome not in the_retry_outcomes
+
+    # Method that records the outcome of processing the_job_id, along with any other fields.
+    # The record is flushed to disk before the method returns
+    def record(self, the_job_id, the_outcome, **fields):
+        record = dict(job_id=the_job_id, outcome=the_outcome, **fields)
+        line = json.dumps(record) + '\n'
+        with self._lock:
+            self._keep(the_job_id, the_outcome, fields)
+            self._file.write(line)
+            self._file.flush()
+            self._unsynced_count += 1
+            if self._unsynced_count >= FSYNC_INTERVAL:
+                os.fsync(self._file.fileno())
+                self._unsynced_count = 0
+
+    # Method that returns the number of Job IDs with each outcome, or of records if not resuming
+    def count_outcomes(self):
+        with self._lock:
+            return {outcome: count for outcome, count in self._outcome_counts.items() if count > 0}
+
+    def close(self):
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
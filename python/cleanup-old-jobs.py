@@ -0,0 +1,456 @@
+#!/usr/bin/env python3
+#################################################################
+# FILE:  cleanup-old-jobs.py
+#
+# DESCRIPTION:    This script combines get-old-jobs.py, export-old-jobs.py and delete-old-jobs.py into
+#                 a single pass. Each INACTIVE Job instance that has not been run since the
+#                 last_run_threshold is exported to the export directory and then deleted, as soon
+#                 as it is found. The Job object found by the search is reused for the export and
+#                 the delete, so the Jobs are not looked up again by ID.
+#
+#                 The same safeguards apply as with the separate scripts: a Job is only deleted if
+#                 its export was written successfully, and the latest run of the Job is fetched
+#                 again just before it is deleted: the Job must still have status INACTIVE and a
+#                 last run before the last_run_threshold. Job Template Instances can't be
+#                 exported, so they are deleted without an export, as delete-old-jobs.py does.
+#
+#                 Use the separate scripts instead if the list of old Jobs needs to be reviewed
+#                 before any Jobs are deleted.
+#
+# ARGS:           - last_run_threshold - The threshold date to mark Jobs as needing to be cleaned up if the Job's
+#                   last run was before that date.
+#
+#                 - export_dir - The directory to write the exported Jobs instances to.
+#                                The directory will be created if it does not exist.
+#                                If the directory does exist, it must be empty, unless --resume
+#                                is specified
+#
+# OPTIONS:        --workers N - The number of Jobs to check, and the number of batches to export and
+#                               delete, concurrently. Defaults to 1.
+#                               With --workers auto, the number of Control Hub requests in flight is adjusted as
+#                               the run goes: raised while Control Hub's latency stays flat, and cut back on throttling,
+#                               timeouts or rising latency, between 1 and 64, starting from 4.
+#
+#                 --rate R    - The maximum number of Control Hub requests per second, across all
+#                               workers. Defaults to no limit.
+#
+#                 --retries N - The number of times a Control Hub request that fails with a transient
+#                               error is retried, with exponential backoff. Defaults to 3.
+#
+#                 --batch-size N - The number of old Jobs to export and delete with each Control Hub
+#                               request. With more than one Job per batch, each batch is written to an
+#                               archive, jobs-00001.zip, jobs-00002.zip and so on, listed in the manifest
+#                               file manifest.jsonl, like export-old-jobs.py --archive-size. Defaults to
+#                               50. With 1, each Job is written to its own zip file, named as
+#                               export-old-jobs.py names them: Jobs of the same name get a numbered suffix,
+#                               and in an organization of more than 10,000 Jobs the files are spread across
+#                               the hashed subdirectories 00 to ff. Note that with 1 the script makes about
+#                               as many Control Hub requests as the three separate scripts, since each Job
+#                               is then exported and deleted with a request of its own. The candidate Jobs
+#                               are read 1,000 at a time, and a batch does not span two pages of candidates.
+#
+#                 --resume    - Resume a run that was interrupted. The outcome of each Job is recorded in
+#                               the checkpoint journal <export_dir>/.cleanup-checkpoint.jsonl, and Jobs
+#                               already recorded there are not processed again, unless their outcome
+#                               was a transient error.
+#
+#                 --report FILE - Write a report of the run to FILE at exit, in the Prometheus textfile
+#                               format if FILE ends with .prom, or in JSON otherwise.
+#
+# USAGE:          $ python3 cleanup-old-jobs.py <last_run_threshold> <export_dir> [--workers N|auto] [--rate R] [--retries N] [--batch-size N] [--resume] [--report FILE]
+#
+# USAGE EXAMPLE:  $ python3 cleanup-old-jobs.py 2024-06-30 /Users/mark/jobs-export --workers 8
+#
+# PREREQUISITES:
+#
+#  - Python 3.9+
+#
+# - StreamSets Platform SDK for Python v6.6+
+#   See: https://docs.streamsets.com/platform-sdk/latest/welcome/installation.html
+#
+# - StreamSets Platform API Credentials for a user with Organization Administrator role
+#
+# - Before running the script, export the environment variables CRED_ID and CRED_TOKEN
+#  with the StreamSets Platform API Credentials, like this:
+#
+#    $ export CRED_ID="40af8..."
+#    $ export CRED_TOKEN="eyJ0..."
+#
+#################################################################
+
+import os, sys, threading
+from datetime import date, datetime, timedelta
+from streamsets.sdk import ControlHub
+from checkpoint import CheckpointJournal
+from concurrency import ControlHubCaller, AdaptiveConcurrency, ADAPTIVE_MAX_CONCURRENCY, map_in_order, is_transient_error
+from job_history import LatestRunFetcher
+from job_lookup import get_candidate_jobs, get_job_count, get_outcome
+from job_delete import delete_jobs
+from instrumentation import metrics
+from job_export import write_file_atomically, remove_partial_files, get_last_archive_number, write_archive, uses_subdirectories, ExportPathPlanner, MANIFEST_FILE_NAME, ARCHIVE_FILE_NAME, SUBDIRECTORY_THRESHOLD
+
+# The name of the checkpoint journal written to the export_dir
+CHECKPOINT_FILE_NAME = '.cleanup-checkpoint.jsonl'
+
+# The outcomes of the check of a Job's latest run that mean the Job is not cleaned up
+PRUNED_OUTCOMES = ('never-run', 'not-inactive', 'recent')
+
+# Method to convert millis to datetime string
+def millis_to_datetime_string(millis):
+    seconds = millis / 1000.0
+    dt = datetime.fromtimestamp(seconds)
+    dt_string = dt.strftime('%Y-%m-%d %H:%M:%S')
+    return dt_string
+
+# Method that validates that the last_run_threshold command line parameter is a valid date
+def last_run_threshold_parameter_is_a_date(last_run_threshold_str):
+    try:
+        # This line will throw an exception if the date string is not valid
+        datetime.strptime(last_run_threshold_str, "%Y-%m-%d")
+        return True
+    except ValueError:
+        print(f"Error: The last_run_threshold parameter \'{last_run_threshold_str}\' is not a valid date in yyyy-mm-dd format.")
+    return False
+
+# Method that validates that the last_run_threshold command line parameter is at
+# least one day behind the current date.
+def last_run_threshold_parameter_is_at_least_one_day_old(last_run_threshold_str):
+    the_last_run_threshold = datetime.strptime(last_run_threshold_str, "%Y-%m-%d")
+    if the_last_run_threshold.date() <= date.today() - timedelta(days=1):
+        return True
+    else:
+        print(f"Error: The last_run_threshold parameter \'{last_run_threshold_str}\' is not at least one day earlier than the current date.")
+    return False
+
+# Method to convert datetime string to millis
+def convert_datetime_string_to_millis(datetime_string):
+    try:
+        dt = datetime.strptime(datetime_string, "%Y-%m-%d")
+        millis = int(dt.timestamp() * 1000)
+        return millis
+    except Exception as e:
+        print(f"Error: Error converting \'{datetime_string}\' to millis: \'{e}\'.")
+    return None
+
+# Method that validates that the directory specified in the export_dir command line parameter either
+# does not exist or exists but is an empty dir. If the directory does not exist it will be created.
+# When resuming, the directory may hold the Jobs exported by the interrupted run.
+# Returns True if the directory is OK or False if not.
+def validate_export_dir_parameter(the_export_dir, the_resume):
+    if os.path.isdir(the_export_dir):
+        if the_resume:
+            if not os.path.isfile(os.path.join(the_export_dir, CHECKPOINT_FILE_NAME)):
+                print(f"Error: Export directory \'{the_export_dir}\' does not have a checkpoint file to resume from.")
+                return False
+        elif os.listdir(the_export_dir):
+            print(f"Error: Export directory \'{the_export_dir}\' already exists but is not empty. ")
+            print("Please specify a new or empty directory for Job export")
+            return False
+    else:
+        try:
+            os.makedirs(the_export_dir, exist_ok=True)
+        except Exception as ex:
+            print(f"Exception when trying to create directory \'{the_export_dir}\': {ex}")
+            return False
+    return True
+
+# Method that removes an optional '--name value' command line option from sys.argv.
+# Returns the option's value, or the_default if the option was not specified
+def pop_option(the_name, the_default=None):
+    if the_name not in sys.argv:
+        return the_default
+    index = sys.argv.index(the_name)
+    if index + 1 >= len(sys.argv):
+        print(f"Error: The option \'{the_name}\' requires a value")
+        sys.exit(1)
+    value = sys.argv[index + 1]
+    del sys.argv[index:index + 2]
+    return value
+
+# Method that removes an optional '--name' command line flag from sys.argv.
+# Returns True if the flag was specified
+def pop_flag(the_name):
+    if the_name not in sys.argv:
+        return False
+    sys.argv.remove(the_name)
+    return True
+
+# Method that validates a numeric command line option. Returns the value converted with
+# the_type, or None if it is not a number of at least the_minimum
+def validate_number_option(the_name, the_value, the_type, the_minimum):
+    try:
+        value = the_type(the_value)
+        if value >= the_minimum:
+            return value
+    except ValueError:
+        pass
+    print(f"Error: The {the_name} option \'{the_value}\' is not a number of at least {the_minimum}.")
+    return None
+
+# Method that filters out Job Templates, in case Control Hub did not exclude them, and the Jobs
+# that were already processed by the interrupted run when resuming
+def job_instances(the_jobs):
+    for the_job in the_jobs:
+        if the_job.job_template:
+            continue
+        if journal.is_done(the_job.job_id):
+            continue
+        yield the_job
+
+# Method that fetches the latest run of a Job. Returns a tuple of the Job and the outcome of
+# checking it, which is 'error' if the latest run could not be fetched. The outcome of Jobs that
+# are not cleaned up is recorded in the checkpoint journal
+def check_job(the_job):
+    try:
+        latest_run = latest_run_fetcher.get(the_job)
+    except Exception as ex:
+        print(f"Error getting status for Job \'{the_job.job_name}\': \'{ex}\'")
+        journal.record(the_job.job_id, 'error', last_run_threshold=last_run_threshold)
+        return the_job, 'error'
+    outcome = get_outcome(latest_run, last_run_threshold_millis)
+    if outcome == 'old':
+        print(f"Job: \'{the_job.job_name}\' Last Run Date: {millis_to_datetime_string(latest_run.finish_time)}")
+    else:
+        journal.record(the_job.job_id, outcome, last_run_threshold=last_run_threshold)
+    return the_job, outcome
+
+# Method that groups the old Jobs into numbered batches of batch_size Jobs. Yields tuples of the
+# batch number and a list of Jobs. The zip file of each Job exported on its own
+# is planned here, in the order the Jobs were found, so the file names do not depend on the order
+# in which the exports complete
+def old_job_batches(the_checked_jobs):
+    batch = []
+    for job, outcome in the_checked_jobs:
+        if outcome == 'old':
+            if export_path_planner is not None and job.template_job_id is None:
+                export_path_planner.plan(job.job_id, job.job_name)
+            batch.append(job)
+            if len(batch) >= batch_size:
+                yield next_batch_number(), batch
+                batch = []
+    if batch:
+        yield next_batch_number(), batch
+
+# Method that returns the next archive number
+def next_batch_number():
+    global archive_number
+    archive_number += 1
+    return archive_number
+
+# Method that exports the exportable Jobs of a batch with one Control Hub request and writes them
+# to the export_dir. Returns None if the export was written, or the exception if it failed
+def export_batch(the_jobs, the_batch_number):
+    try:
+        data = caller.call(lambda: metrics.call('sch.export_jobs', sch.export_jobs, the_jobs))
+        if batch_size == 1:
+            export_file_name = export_path_planner.plan(the_jobs[0].job_id, the_jobs[0].job_name)
+            export_path_planner.create_directory(export_file_name)
+            print(f"Exporting Job \'{the_jobs[0].job_name}\' into the file \'{export_file_name}\'")
+            write_file_atomically(export_file_name, data)
+        else:
+            archive_file_name = os.path.join(export_dir, ARCHIVE_FILE_NAME.format(the_batch_number))
+            print(f"Exporting {len(the_jobs)} Jobs into the archive \'{archive_file_name}\'")
+            with manifest_lock:
+                write_archive(archive_file_name, data, the_jobs, manifest)
+        return None
+    except Exception as ex:
+        for job in the_jobs:
+            print(f"Error exporting Job \'{job.job_name}\': {ex}")
+        return ex
+
+# Method that fetches the latest run of a Job again, just before it is deleted, and checks that it
+# still has status INACTIVE and is before the last_run_threshold, in case the Job was started since
+# it was found. Returns the outcome to record if the Job must not be deleted, or None if it can be deleted
+def recheck_job(the_job):
+    try:
+        the_latest_run = latest_run_fetcher.get(the_job, the_fresh=True)
+    except Exception as ex:
+        print(f"Error getting status for Job \'{the_job.job_name}\': \'{ex}\'; the Job will not be deleted")
+        return 'error'
+    if the_latest_run is None or the_latest_run.status != 'INACTIVE':
+        print(f"Error: Job \'{the_job.job_name}\' does not have status \'INACTIVE\'; the Job will not be deleted")
+        return 'not-inactive'
+    if the_latest_run.finish_time >= last_run_threshold_millis:
+        print(f"- Job \'{the_job.job_name}\' was run at \'{millis_to_datetime_string(the_latest_run.finish_time)}\' which is more recent than the last_run_threshold of \'{last_run_threshold}\'")
+        print(" --> Job will not be deleted.")
+        return 'recently-run'
+    return None
+
+# Method to delete a batch of Jobs, split in half on failure until the Jobs that can't be deleted
+# are isolated, and record the outcome of each Job
+def delete_batch(the_jobs):
+    for job, ex in delete_jobs(sch, the_jobs, caller):
+        if ex is None:
+            print(f"- Job \'{job.job_name}\' with Job ID \'{job.job_id}\' was deleted.")
+            journal.record(job.job_id, 'deleted', last_run_threshold=last_run_threshold)
+        else:
+            print(f"Error: Attempt to delete Job \'{job.job_name}\' with Job ID \'{job.job_id}\' failed; {ex}")
+            journal.record(job.job_id, 'error' if is_transient_error(ex) else 'failed', error=str(ex), last_run_threshold=last_run_threshold)
+
+# Method that exports a batch of old Jobs, then fetches the latest run of each Job again and deletes
+# the Jobs whose export was written and that are still old. Job Template Instances can't be exported, so they are deleted without one
+def process_batch(the_numbered_batch):
+    batch_number, batch = the_numbered_batch
+    exportable_jobs = [job for job in batch if job.template_job_id is None]
+    export_error = export_batch(exportable_jobs, batch_number) if exportable_jobs else None
+    jobs_to_delete = []
+    for job in batch:
+        if job.template_job_id is not None:
+            print(f"Skipping export for Job \'{job.job_name}\' because it is a Job Template Instance")
+        elif export_error is not None:
+            journal.record(job.job_id, 'error' if is_transient_error(export_error) else 'export-failed', error=str(export_error), last_run_threshold=last_run_threshold)
+            continue
+        outcome = recheck_job(job)
+        if outcome is not None:
+            journal.record(job.job_id, outcome, last_run_threshold=last_run_threshold)
+        else:
+            jobs_to_delete.append(job)
+    if jobs_to_delete:
+        delete_batch(jobs_to_delete)
+    print("---------------------------------")
+
+#####################################
+# Main Program
+#####################################
+
+# Get CRED_ID from the environment
+CRED_ID = os.getenv('CRED_ID')
+
+# Get CRED_TOKEN from the environment
+CRED_TOKEN = os.getenv('CRED_TOKEN')
+
+# Get the optional command line options
+workers_option = pop_option('--workers', '1')
+rate_option = pop_option('--rate')
+retries_option = pop_option('--retries', '3')
+batch_size_option = pop_option('--batch-size', '50')
+resume = pop_flag('--resume')
+report_file = pop_option('--report')
+
+# Check the number of command line args
+if len(sys.argv) != 3:
+    print('Error: Wrong number of arguments')
+    print('Usage: $ python3 cleanup-old-jobs.py <last_run_threshold> <export_dir> [--workers N|auto] [--rate R] [--retries N] [--batch-size N] [--resume] [--report FILE]')
+    print('Usage Example: $ python3 cleanup-old-jobs.py 2024-06-30 /Users/mark/jobs-export --workers 8 --batch-size 50')
+    sys.exit(1)
+
+# Validate the optional command line options
+adaptive = workers_option == 'auto'
+workers = ADAPTIVE_MAX_CONCURRENCY if adaptive else validate_number_option('--workers', workers_option, int, 1)
+rate = validate_number_option('--rate', rate_option, float, 0.1) if rate_option is not None else None
+retries = validate_number_option('--retries', retries_option, int, 0)
+batch_size = validate_number_option('--batch-size', batch_size_option, int, 1)
+if workers is None or (rate_option is not None and rate is None) or retries is None or batch_size is None:
+    sys.exit(1)
+
+# Validate the last_run_threshold parameter
+last_run_threshold = sys.argv[1]
+last_run_threshold_millis = None
+if last_run_threshold_parameter_is_a_date(last_run_threshold) and last_run_threshold_parameter_is_at_least_one_day_old(last_run_threshold):
+    last_run_threshold_millis = convert_datetime_string_to_millis(last_run_threshold)
+if last_run_threshold_millis is None:
+    sys.exit(1)
+
+print("---------------------------------")
+print(f"last_run_threshold: '{last_run_threshold}'")
+
+# Validate the export_dir parameter
+export_dir = sys.argv[2]
+print(f"export_dir: '{export_dir}'")
+if not validate_export_dir_parameter(export_dir, resume):
+    sys.exit(1)
+print(f"Workers: {workers_option}  Rate limit: {str(rate) + ' requests/sec' if rate else 'none'}  Retries: {retries}  Batch size: {batch_size}")
+
+# Write the report of the run at exit, if one was requested
+if report_file is not None:
+    metrics.write_report_at_exit(report_file)
+    print(f"Report file: '{report_file}'")
+
+# Open the checkpoint journal, loading the outcomes recorded by the interrupted run if resuming
+journal = CheckpointJournal(os.path.join(export_dir, CHECKPOINT_FILE_NAME), resume)
+if resume:
+    print(f"Resuming with {len(journal)} Jobs already processed")
+    if journal.last_run_thresholds - {last_run_threshold}:
+        print(f"Error: The checkpoint file was written with a different last_run_threshold than \'{last_run_threshold}\'")
+        sys.exit(1)
+
+    # Remove the temporary files of zip files that the interrupted run did not finish writing
+    remove_partial_files(export_dir)
+
+# Connect to Control Hub
+print("---------------------------------")
+print('Connecting to Control Hub')
+print("---------------------------------")
+sch = ControlHub(credential_id=CRED_ID, token=CRED_TOKEN)
+
+# All Control Hub calls are made through the caller, which applies the rate limit and retries
+concurrency_controller = AdaptiveConcurrency() if adaptive else None
+caller = ControlHubCaller(rate, retries, concurrency_controller)
+
+# The latest run of each Job is fetched through the caller when the Job is found, and again just before it is deleted
+latest_run_fetcher = LatestRunFetcher(sch, caller)
+
+# With more than one Job per batch, the archives are numbered after any written by an interrupted
+# run, and the manifest is appended to
+archive_number = get_last_archive_number(export_dir)
+manifest = open(os.path.join(export_dir, MANIFEST_FILE_NAME), 'a') if batch_size > 1 else None
+manifest_lock = threading.Lock()
+
+print('Searching for old Jobs, and exporting and deleting them (this may take a while)...')
+print("---------------------------------")
+with metrics.phase('search'):
+    try:
+        candidate_pages = get_candidate_jobs(sch, last_run_threshold_millis, caller)
+    except Exception as ex:
+        print(f"Error: The Control Hub search for candidate Jobs failed: {ex}")
+        sys.exit(1)
+
+# With one Job per batch, each Job is written to a zip file named after the Job, with a numbered
+# suffix for Jobs of the same name. The candidates are read a page at a time, so the files are spread
+# across hashed subdirectories if the organization has many Jobs, or if it can't be told how many, as
+# are the files of a resumed run that already uses them. The files written by an interrupted run are
+# not overwritten
+export_path_planner = None
+if batch_size == 1:
+    use_subdirectories = resume and uses_subdirectories(export_dir)
+    if not use_subdirectories:
+        job_count = get_job_count(sch, caller)
+        use_subdirectories = job_count is None or job_count > SUBDIRECTORY_THRESHOLD
+    export_path_planner = ExportPathPlanner(export_dir, use_subdirectories)
+    if resume:
+        export_path_planner.reserve_existing_files()
+
+# Check each Job instance, then export and delete the old Jobs in batches, using pools of worker
+# threads if more than one worker was requested. Each page of candidates is finished before the next
+# one is read, so the Jobs deleted can be taken off the offset of the next page; a batch therefore
+# does not span pages
+deleted_count_at_start = journal.count_outcomes().get('deleted', 0)
+with metrics.phase('check, export and delete'):
+    for candidate_jobs in candidate_pages:
+        if workers == 1:
+            checked_jobs = (check_job(job) for job in job_instances(candidate_jobs))
+            for numbered_batch in old_job_batches(checked_jobs):
+                process_batch(numbered_batch)
+        else:
+            checked_jobs = map_in_order(check_job, job_instances(candidate_jobs), workers)
+            for _ in map_in_order(process_batch, old_job_batches(checked_jobs), workers):
+                pass
+        candidate_pages.removed_count = journal.count_outcomes().get('deleted', 0) - deleted_count_at_start
+if manifest is not None:
+    manifest.close()
+journal.close()
+outcome_counts = journal.count_outcomes()
+metrics.set_outcomes(outcome_counts)
+
+# Report the outcome of each Job
+print("---------------------------------")
+print(f"Fetched the latest run {latest_run_fetcher.fetch_count} times for {latest_run_fetcher.job_count} Jobs")
+for outcome, count in sorted(outcome_counts.items()):
+    print(f"Jobs {outcome}: {count}")
+if caller.retry_count > 0:
+    print(f"Retried {caller.retry_count} Control Hub requests that failed with a transient error")
+if concurrency_controller is not None:
+    print(concurrency_controller.summary())
+
+metrics.completed = True
+print('Done')
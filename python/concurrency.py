@@ -0,0 +1,277 @@
+#################################################################
+# FILE:  concurrency.py
+#
+# DESCRIPTION:    Helpers shared by the cleanup scripts to make Control Hub calls from a pool
+#                 of worker threads: a token-bucket rate limiter, retries with exponential
+#                 backoff for transient failures, an adaptive limit on the number of calls in
+#                 flight, and per-thread capture of print() output so the lines printed for one
+#                 Job are not interleaved with those of another.
+#
+#################################################################
+
+import re, sys, time, random, threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# HTTP status codes returned by Control Hub that are worth retrying
+TRANSIENT_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Error messages that indicate a transient failure when no HTTP status code is available
+TRANSIENT_MESSAGE_PATTERN = re.compile(r'\b(429|500|502|503|504) (Client|Server) Error|Too Many Requests|timed out|Connection (aborted|reset|refused)', re.IGNORECASE)
+
+# The initial and the maximum delay in seconds between retries
+RETRY_INITIAL_DELAY_SECONDS = 1.0
+RETRY_MAX_DELAY_SECONDS = 30.0
+
+# The initial and the maximum number of calls in flight with --workers auto
+ADAPTIVE_INITIAL_CONCURRENCY = 4
+ADAPTIVE_MAX_CONCURRENCY = 64
+
+# The fewest calls over which the p95 latency is measured before the concurrency is changed
+ADAPTIVE_MIN_WINDOW = 10
+
+# The concurrency is cut when the p95 latency of a window rises above this multiple of the baseline
+ADAPTIVE_LATENCY_TOLERANCE = 2.0
+
+# The least rise in the p95 latency, in seconds, that cuts the concurrency, so that the noise in
+# the latency of very fast calls is ignored
+ADAPTIVE_LATENCY_MIN_RISE_SECONDS = 0.01
+
+# The factor by which the baseline p95 latency may drift up with each window, so that it follows
+# Control Hub becoming slower or faster through the day
+ADAPTIVE_BASELINE_DRIFT = 1.02
+
+# The factor by which the concurrency is cut on throttling, timeouts or rising latency
+ADAPTIVE_DECREASE_FACTOR = 0.5
+
+
+# A token-bucket rate limiter. acquire() blocks until a token is available. Tokens are added
+# at the given rate per second, up to a burst of capacity tokens
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate)
+                self._last_refill = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_seconds = (1 - self._tokens) / self.rate
+            time.sleep(wait_seconds)
+
+
+# Method that returns the HTTP status code of an exception raised by a Control Hub call, or None
+def get_status_code(the_exception):
+    response = getattr(the_exception, 'response', None)
+    return getattr(response, 'status_code', None)
+
+# Method that returns True if an exception raised by a Control Hub call is transient, i.e. a
+# throttling response, a server error, a timeout or a dropped connection, and the call should be
+# retried. Permanent failures such as permission errors or Jobs that are referenced by Sequences
+# or Topologies return False
+def is_transient_error(the_exception):
+    if isinstance(the_exception, (TimeoutError, ConnectionError)):
+        return True
+    status_code = get_status_code(the_exception)
+    if status_code is not None:
+        return status_code in TRANSIENT_STATUS_CODES
+    exception_name = type(the_exception).__name__
+    if 'Timeout' in exception_name or 'ConnectionError' in exception_name:
+        return True
+    return TRANSIENT_MESSAGE_PATTERN.search(str(the_exception)) is not None
+
+# Method that returns how long to wait before the given retry attempt: the delay doubles with
+# each attempt, with full jitter, unless Control Hub asked for a specific delay with Retry-After
+def get_retry_delay(the_exception, the_attempt):
+    response = getattr(the_exception, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    retry_after = headers.get('Retry-After')
+    if retry_after is not None:
+        try:
+            return min(float(retry_after), RETRY_MAX_DELAY_SECONDS)
+        except ValueError:
+            pass
+    return random.uniform(0, min(RETRY_MAX_DELAY_SECONDS, RETRY_INITIAL_DELAY_SECONDS * 2 ** the_attempt))
+
+
+# An AIMD (additive increase, multiplicative decrease) limit on the number of Control Hub calls in
+# flight. acquire() blocks while the limit is reached, and release() records the latency or the
+# error of each call. After each window of calls (at least as many calls as the limit), the p95
+# latency of the window is compared with the baseline, the lowest p95 seen recently: if it is flat
+# the limit is raised by one, and if it has risen above ADAPTIVE_LATENCY_TOLERANCE times the
+# baseline the limit is halved. A call that is throttled or times out halves the limit at once,
+# at most once per window. Each change and its reason is printed
+class AdaptiveConcurrency:
+    def __init__(self, the_initial=ADAPTIVE_INITIAL_CONCURRENCY, the_maximum=ADAPTIVE_MAX_CONCURRENCY, the_minimum=1):
+        self.limit = min(the_initial, the_maximum)
+        self.minimum = the_minimum
+        self.maximum = the_maximum
+        self.lowest = self.limit
+        self.highest = self.limit
+        self.increase_count = 0
+        self.decrease_count = 0
+        self._in_flight = 0
+        self._latencies = []
+        self._calls_since_decrease = 0
+        self._last_decrease_time = 0.0
+        self._baseline = None
+        self._condition = threading.Condition()
+
+    # Method that blocks until another call may be made
+    def acquire(self):
+        with self._condition:
+            while self._in_flight >= self.limit:
+                self._condition.wait()
+            self._in_flight += 1
+
+    # Method that records a call that took the_seconds and failed with the_error, if not None
+    def release(self, the_seconds, the_error=None):
+        with self._condition:
+            self._in_flight -= 1
+            self._calls_since_decrease += 1
+            if the_error is not None and is_transient_error(the_error):
+                if self._calls_since_decrease >= self.limit:
+                    status_code = get_status_code(the_error)
+                    self._decrease(f"HTTP {status_code}" if status_code is not None else type(the_error).__name__)
+            elif time.monotonic() - the_seconds >= self._last_decrease_time:
+                # Only the calls started since the last decrease show the effect of the current limit
+                self._latencies.append(the_seconds)
+                if len(self._latencies) >= max(self.limit, ADAPTIVE_MIN_WINDOW):
+                    self._end_window()
+            self._condition.notify_all()
+
+    # Method that compares the p95 latency of the window of calls that just ended with the baseline
+    def _end_window(self):
+        latencies = sorted(self._latencies)
+        self._latencies = []
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        if self._baseline is None:
+            self._baseline = p95
+        if p95 > max(self._baseline * ADAPTIVE_LATENCY_TOLERANCE, self._baseline + ADAPTIVE_LATENCY_MIN_RISE_SECONDS):
+            self._decrease(f"p95 latency {p95 * 1000:.0f} ms is above {ADAPTIVE_LATENCY_TOLERANCE:g}x the baseline of {self._baseline * 1000:.0f} ms")
+        else:
+            self._baseline = min(p95, self._baseline * ADAPTIVE_BASELINE_DRIFT)
+            if self.limit < self.maximum:
+                self._change(self.limit + 1, f"p95 latency {p95 * 1000:.0f} ms is flat")
+                self.increase_count += 1
+
+    def _decrease(self, the_reason):
+        self._latencies = []
+        self._calls_since_decrease = 0
+        self._last_decrease_time = time.monotonic()
+        new_limit = max(self.minimum, int(self.limit * ADAPTIVE_DECREASE_FACTOR))
+        if new_limit != self.limit:
+            self._change(new_limit, the_reason)
+            self.decrease_count += 1
+
+    def _change(self, the_new_limit, the_reason):
+        print(f"Concurrency: {self.limit} -> {the_new_limit} ({the_reason})")
+        self.limit = the_new_limit
+        self.lowest = min(self.lowest, the_new_limit)
+        self.highest = max(self.highest, the_new_limit)
+
+    # Method that returns a summary of the changes to the concurrency
+    def summary(self):
+        return (f"Concurrency: ended at {self.limit} (range {self.lowest} to {self.highest}) after "
+                f"{self.increase_count} increases and {self.decrease_count} decreases")
+
+
+# Makes Control Hub calls subject to an optional rate limit, retrying transient failures. If
+# the_concurrency is given, an AdaptiveConcurrency, the number of calls in flight is limited by it
+class ControlHubCaller:
+    def __init__(self, rate=None, retries=3, the_concurrency=None):
+        self.rate_limiter = TokenBucket(rate) if rate else None
+        self.retries = retries
+        self.retry_count = 0
+        self.concurrency = the_concurrency
+        self._lock = threading.Lock()
+
+    # Method that calls the_function, retrying up to self.retries times if it fails with a
+    # transient error. Any other error, or the last transient error, is raised to the caller
+    def call(self, the_function):
+        attempt = 0
+        while True:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            if self.concurrency is not None:
+                self.concurrency.acquire()
+            start = time.perf_counter()
+            try:
+                result = the_function()
+            except Exception as ex:
+                if self.concurrency is not None:
+                    self.concurrency.release(time.perf_counter() - start, ex)
+                if attempt >= self.retries or not is_transient_error(ex):
+                    raise
+                with self._lock:
+                    self.retry_count += 1
+                time.sleep(get_retry_delay(ex, attempt))
+                attempt += 1
+                continue
+            if self.concurrency is not None:
+                self.concurrency.release(time.perf_counter() - start)
+            return result
+
+
+# A sys.stdout replacement that sends the output of threads that are capturing their output
+# to a per-thread buffer, and the output of all other threads to the real stdout
+class ThreadOutputCapture:
+    def __init__(self, the_stdout):
+        self._stdout = the_stdout
+        self._local = threading.local()
+
+    def write(self, text):
+        buffer = getattr(self._local, 'buffer', None)
+        if buffer is None:
+            return self._stdout.write(text)
+        buffer.append(text)
+        return len(text)
+
+    def flush(self):
+        self._stdout.flush()
+
+    def __getattr__(self, name):
+        return getattr(self._stdout, name)
+
+    # Method that calls the_function and returns a tuple of its result and everything it printed
+    def capture(self, the_function, *args):
+        self._local.buffer = []
+        try:
+            result = the_function(*args)
+            return result, ''.join(self._local.buffer)
+        finally:
+            self._local.buffer = None
+
+# Method that installs a ThreadOutputCapture as sys.stdout, if one is not installed already
+def install_thread_output_capture():
+    if not isinstance(sys.stdout, ThreadOutputCapture):
+        sys.stdout = ThreadOutputCapture(sys.stdout)
+    return sys.stdout
+
+
+# Method that calls the_function on each item of the_items using a pool of the_workers threads.
+# Whatever the_function prints is captured and printed in one piece when it completes, in the
+# same order as the_items. Yields the results in the same order as the_items. No more than
+# the_workers * 4 items are queued at once
+def map_in_order(the_function, the_items, the_workers):
+    output_capture = install_thread_output_capture()
+    with ThreadPoolExecutor(max_workers=the_workers) as executor:
+        pending = deque()
+        for item in the_items:
+            pending.append(executor.submit(output_capture.capture, the_function, item))
+            if len(pending) >= the_workers * 4:
+                result, output = pending.popleft().result()
+                print(output, end='')
+                yield result
+        while pending:
+            result, output = pending.popleft().result()
+            print(output, end='')
+            yield result
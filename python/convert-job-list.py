@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+#################################################################
+# FILE:  convert-job-list.py
+#
+# DESCRIPTION:    This script converts a list of old Jobs between the JSONL format written by
+#                 get-old-jobs.py and the compact binary format written by get-old-jobs.py
+#                 --format binary. A JSONL input file is converted to the binary format, and a
+#                 binary input file is converted to JSONL, for example to review or edit the list
+#                 by hand before converting it back. Both export-old-jobs.py and delete-old-jobs.py
+#                 read either format.
+#
+# ARGS:           - input_file - A list of old Jobs in either format.
+#
+#                 - output_file - The file to write the converted list to. If an existing file of the
+#                                 same name exists, it will be overwritten.
+#
+# OPTIONS:        --older-than DATE - Only convert the Jobs last run before DATE, in yyyy-mm-dd format.
+#
+#                 --ids-only  - Only write the Job IDs, one per line. Only for a binary input file.
+#
+# USAGE:          $ python3 convert-job-list.py <input_file> <output_file> [--older-than DATE] [--ids-only]
+#
+# USAGE EXAMPLE:  $ python3 convert-job-list.py /Users/mark/old-jobs/old_jobs.json /Users/mark/old-jobs/old_jobs.jobs
+#
+# PREREQUISITES:
+#
+#  - Python 3.9+
+#
+#################################################################
+
+import os, sys, time
+from datetime import datetime
+from job_list import is_binary_job_list, convert_jsonl_to_binary, convert_binary_to_jsonl
+
+# Method that removes an optional '--name value' command line option from sys.argv.
+# Returns the option's value, or the_default if the option was not specified
+def pop_option(the_name, the_default=None):
+    if the_name not in sys.argv:
+        return the_default
+    index = sys.argv.index(the_name)
+    if index + 1 >= len(sys.argv):
+        print(f"Error: The option '{the_name}' requires a value")
+        sys.exit(1)
+    value = sys.argv[index + 1]
+    del sys.argv[index:index + 2]
+    return value
+
+# Method that removes an optional '--name' command line flag from sys.argv.
+# Returns True if the flag was specified
+def pop_flag(the_name):
+    if the_name not in sys.argv:
+        return False
+    sys.argv.remove(the_name)
+    return True
+
+# Method to convert a date string in yyyy-mm-dd format to millis. Returns None if not valid
+def convert_date_string_to_millis(the_date_string):
+    try:
+        return int(datetime.strptime(the_date_string, "%Y-%m-%d").timestamp() * 1000)
+    except ValueError:
+        print(f"Error: The --older-than option \'{the_date_string}\' is not a valid date in yyyy-mm-dd format.")
+    return None
+
+#####################################
+# Main Program
+#####################################
+
+# Get the optional command line options
+older_than_option = pop_option('--older-than')
+ids_only = pop_flag('--ids-only')
+
+# Check the number of command line args
+if len(sys.argv) != 3:
+    print('Error: Wrong number of arguments')
+    print('Usage: $ python3 convert-job-list.py <input_file> <output_file> [--older-than DATE] [--ids-only]')
+    print('Usage Example: $ python3 convert-job-list.py /Users/mark/old-jobs/old_jobs.json /Users/mark/old-jobs/old_jobs.jobs')
+    sys.exit(1)
+
+input_file = sys.argv[1]
+output_file = sys.argv[2]
+if not os.path.isfile(input_file) or not os.access(input_file, os.R_OK):
+    print(f"Error: Input File \'{input_file}\' either does not exist or is not readable")
+    sys.exit(1)
+
+older_than_millis = None
+if older_than_option is not None:
+    older_than_millis = convert_date_string_to_millis(older_than_option)
+    if older_than_millis is None:
+        sys.exit(1)
+
+print("---------------------------------")
+start = time.perf_counter()
+try:
+    if is_binary_job_list(input_file):
+        print(f"Converting the binary job list \'{input_file}\' to {'a list of Job IDs' if ids_only else 'JSONL'} in \'{output_file}\'")
+        count = convert_binary_to_jsonl(input_file, output_file, older_than_millis, ids_only)
+    else:
+        if ids_only:
+            print('Error: The --ids-only option can only be used with a binary input file')
+            sys.exit(1)
+        print(f"Converting the JSONL job list \'{input_file}\' to the binary job list \'{output_file}\'")
+        count = convert_jsonl_to_binary(input_file, output_file, older_than_millis)
+except (ValueError, KeyError, OSError) as ex:
+    print(f"Error: Could not convert \'{input_file}\': {ex}")
+    sys.exit(1)
+print(f"Converted {count} Jobs in {time.perf_counter() - start:.2f} seconds")
+print("---------------------------------")
+print('Done')
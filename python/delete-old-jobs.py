@@ -7,11 +7,55 @@
 #                 are permission issues, or in cases where Job instances are referenced by
 #                 Sequences or Topologies.
 #
-# ARGS:           - input_file - A JSON list of Job instances to delete.
+# ARGS:           - input_file - A JSON list of Job instances to delete, or a binary job list written with
+#                                get-old-jobs.py --format binary.
 #
-# USAGE:          $ python3 delete-old-jobs.py <input_file>
+# OPTIONS:        --workers N - The number of Jobs to verify and delete concurrently. Defaults to 1.
+#                               With --workers auto, the number of Control Hub requests in flight is adjusted as
+#                               the run goes: raised while Control Hub's latency stays flat, and cut back on throttling,
+#                               timeouts or rising latency, between 1 and 64, starting from 4.
 #
-# USAGE EXAMPLE:  $ python3 delete-old-jobs.py /Users/mark/old-jobs/old_jobs.json
+#                 --rate R    - The maximum number of Control Hub requests per second, across all
+#                               workers. Defaults to no limit.
+#
+#                 --retries N - The number of times a Control Hub request that fails with a transient
+#                               error (HTTP 429 or 5xx, or a timeout) is retried, with exponential
+#                               backoff. Permanent errors are not retried. Defaults to 3.
+#
+#                 --batch-size N - The number of verified Jobs to delete with each Control Hub request.
+#                               If a batch can't be deleted, it is split in half and each half is
+#                               retried until the Jobs that can't be deleted are isolated. Defaults
+#                               to 1, which deletes each Job as soon as it is verified.
+#
+#                 --async     - Fetch the latest runs of each chunk of Jobs and delete the verified Jobs
+#                               with asyncio over one pooled HTTP session, with up to --workers
+#                               requests in flight (for example --workers 200). Batches of
+#                               --batch-size Jobs are deleted concurrently, and split in half on
+#                               failure as above. Requires aiohttp. The URL of Control Hub is taken
+#                               from the SCH_URL environment variable (default https://na01.hub.streamsets.com).
+#
+#                 --report FILE - Write a report of the run to FILE at exit: the time spent in each phase,
+#                               the number of Jobs with each outcome, and the count, latency histogram,
+#                               bytes and errors of each kind of Control Hub call. The report is in the
+#                               Prometheus textfile format if FILE ends with .prom, or in JSON otherwise.
+#
+#                 --dry-run   - Make every check except the deletion itself, and report what a real run
+#                               would do with each Job: would-delete, blocked-by-reference (the Job is
+#                               referenced by a Sequence or Topology), permission, recently-run,
+#                               not-inactive, not-found or error. Nothing is deleted. The outcome of
+#                               each Job is written to <input_file>.dry-run.jsonl. Defaults to
+#                               --workers auto unless --workers or --async is specified.
+#
+#                 --resume    - Resume a run that was interrupted. The outcome of each Job is recorded in
+#                               the checkpoint journal <input_file>.delete-checkpoint.jsonl, and Jobs
+#                               already recorded there are not processed again, unless their outcome
+#                               was a transient error.
+#
+# USAGE:          $ python3 delete-old-jobs.py <input_file> [--workers N|auto] [--rate R] [--retries N] [--batch-size N] [--async] [--dry-run] [--resume] [--report FILE]
+#
+# USAGE EXAMPLE:  $ python3 delete-old-jobs.py /Users/mark/old-jobs/old_jobs.json --workers 8 --rate 20
+#
+#                 $ python3 delete-old-jobs.py /Users/mark/old-jobs/old_jobs.json --dry-run
 #
 # PREREQUISITES:
 #
@@ -30,10 +74,17 @@
 #
 #################################################################
 
-import os,sys, json
+import os,sys
 from pathlib import Path
 from datetime import datetime
 from streamsets.sdk import ControlHub
+from job_lookup import read_job_info_chunks, get_jobs_by_id
+from concurrency import ControlHubCaller, AdaptiveConcurrency, ADAPTIVE_MAX_CONCURRENCY, map_in_order, is_transient_error, get_status_code
+from checkpoint import CheckpointJournal
+from job_history import LatestRunFetcher
+from job_references import get_referenced_job_ids
+from job_delete import delete_jobs, delete_jobs_async
+from instrumentation import metrics
 
 # Method to convert a datetime string of the form 'yyy-dd-mm' to millis
 def convert_dt_string_to_millis(dt_string):
@@ -56,14 +107,12 @@ def validate_input_file_parameter(the_input_file):
         return False
 
 # Method to confirm the Job has not been run since it was flagged as old
-# Returns True if the last Job run is before the last_run_threshold
-def job_has_not_been_run_recently(job, the_last_run_threshold):
-    last_run_threshold_millis = convert_dt_string_to_millis(the_last_run_threshold)
+# Returns True if the latest Job run is before the last_run_threshold
+def job_has_not_been_run_recently(job, the_latest_run, the_last_run_threshold):
     try:
-        history = job.history
-        if history is not None and len(history) > 0:
-            last_run = history[0]
-            last_run_millis = last_run.finish_time
+        last_run_threshold_millis = convert_dt_string_to_millis(the_last_run_threshold)
+        if the_latest_run is not None:
+            last_run_millis = the_latest_run.finish_time
             if last_run_millis < last_run_threshold_millis:
                 print("- Last Job run was before threshold date.")
                 return True
@@ -77,85 +126,207 @@ def job_has_not_been_run_recently(job, the_last_run_threshold):
     return False
 
 # Method to confirm the Job has INACTIVE status. Return True or False
-def job_is_inactive(the_job):
+def job_is_inactive(the_job, the_latest_run):
+    if the_latest_run is not None:
+        status = the_latest_run.status
+        if status == 'INACTIVE':
+            return True
+        else:
+            print(f"Error: Job \'{the_job.job_name}\' has status \'{status}\'; the Job should have status of \'INACTIVE\' to be deleted")
+    return False
+
+# Method to get the latest run of the Job. The history is fetched once per Job and the same
+# snapshot is used for both the status check and the last run check.
+# Returns a tuple of the error if the history could not be fetched, or None, and the latest run,
+# which is None if the Job has never been run
+def get_latest_run(the_job):
     try:
-        history = the_job.history
-        if history is not None and len(history) > 0:
-            last_run = history[0]
-            status = last_run.status
-            if status == 'INACTIVE':
-                return True
-            else:
-                print(f"Error: Job \'{the_job.job_name}\' has status \'{status}\'; the Job should have status of \'INACTIVE\' to be deleted")
+        return None, latest_run_fetcher.get(the_job)
     except Exception as ex:
         print(f"Error getting status for Job \'{the_job.job_name}\': \'{ex}\'")
-    return False
+        return ex, None
 
-# Method to get a Job from SCH using the job_id. Returns the Job or None if the
-# Job is not found or if there is any issue
-def get_job(the_job_info):
+# Method that returns True if an exception raised by a Control Hub call means the API credentials
+# are not allowed to act on the Job
+def is_permission_error(the_exception):
+    if get_status_code(the_exception) in (401, 403):
+        return True
+    message = str(the_exception).lower()
+    return any(text in message for text in ('permission', 'forbidden', 'not authorized', 'unauthorized'))
+
+# Method that returns the outcome to record for a Job whose lookup or history fetch failed with
+# the_exception. A dry run reports permission errors in their own category
+def get_error_outcome(the_exception):
+    return 'permission' if dry_run and is_permission_error(the_exception) else 'error'
+
+# Method to get a Job from the Jobs that were looked up in Control Hub for the current chunk
+# of the input file. Returns the Job or None if the Job was not found or if there was any issue
+def get_job(the_job_info, the_jobs_by_id, the_errors_by_id):
     job_id = the_job_info["job_id"]
     job_name = the_job_info["job_name"]
 
+    if job_id in the_errors_by_id:
+        print(f"Error getting Job from Control Hub \'{job_name}\': {the_errors_by_id[job_id]}")
+    elif job_id not in the_jobs_by_id:
+        print(f"Error getting Job from Control Hub \'{job_name}\': Job not found")
+    else:
+        return the_jobs_by_id[job_id]
+    return None
+
+# Method that removes an optional '--name value' command line option from sys.argv.
+# Returns the option's value, or the_default if the option was not specified
+def pop_option(the_name, the_default=None):
+    if the_name not in sys.argv:
+        return the_default
+    index = sys.argv.index(the_name)
+    if index + 1 >= len(sys.argv):
+        print(f"Error: The option \'{the_name}\' requires a value")
+        sys.exit(1)
+    value = sys.argv[index + 1]
+    del sys.argv[index:index + 2]
+    return value
+
+# Method that removes an optional '--name' command line flag from sys.argv.
+# Returns True if the flag was specified
+def pop_flag(the_name):
+    if the_name not in sys.argv:
+        return False
+    sys.argv.remove(the_name)
+    return True
+
+# Method that validates a numeric command line option. Returns the value converted with
+# the_type, or None if it is not a number of at least the_minimum
+def validate_number_option(the_name, the_value, the_type, the_minimum):
     try:
-        query = 'id=="' + job_id + '"'
-        jobs = sch.jobs.get_all(search=query)
-        if jobs is None or len(jobs) == 0:
-            print(f"Error getting Job from Control Hub \'{job_name}\': Job not found")
-        else:
-            job = jobs[0]
-            return job
-    except Exception as ex:
-        print(f"Error getting Job from Control Hub \'{job_name}\': {ex}")
+        value = the_type(the_value)
+        if value >= the_minimum:
+            return value
+    except ValueError:
+        pass
+    print(f"Error: The {the_name} option \'{the_value}\' is not a number of at least {the_minimum}.")
     return None
 
 # Method to delete a Job. The deletion attempt might fail due to permission issues
 # or if the Job is referenced by a Topology, a Task, or a Schedule
 def delete_job(job):
     try:
-        sch.delete_job(job)
+        caller.call(lambda: metrics.call('sch.delete_job', sch.delete_job, job))
         print(f"- Job was deleted.")
+        journal.record(job.job_id, 'deleted')
     except Exception as ex:
         print(f"Error: Attempt to delete Job failed; {ex}")
+        record_delete_failure(job, ex)
 
-# Method to handle each line the input file
-def handle_line(the_job_info):
+# Method to record a failed deletion in the checkpoint journal. Transient errors are recorded as
+# 'error' so the Job is retried when the run is resumed
+def record_delete_failure(the_job, the_exception):
+    journal.record(the_job.job_id, 'error' if is_transient_error(the_exception) else 'failed', error=str(the_exception))
 
-    print(f"Preparing to delete Job \'{job_info['job_name']}\' with Job ID \'{job_info['job_id']}\'")
+# Method that prints and records the outcome of deleting each Job of a batch, from a list of
+# (job, exception) tuples returned by delete_jobs() or delete_jobs_async()
+def record_delete_outcomes(the_outcomes):
+    for job, ex in the_outcomes:
+        if ex is None:
+            print(f"- Job \'{job.job_name}\' with Job ID \'{job.job_id}\' was deleted.")
+            journal.record(job.job_id, 'deleted')
+        else:
+            print(f"Error: Attempt to delete Job \'{job.job_name}\' with Job ID \'{job.job_id}\' failed; {ex}")
+            record_delete_failure(job, ex)
+
+# Method to handle each line the input file. If Jobs are deleted in batches, returns the Job
+# once it has been verified so it can be added to a batch; otherwise returns None
+def handle_line(the_job_info, the_jobs_by_id, the_errors_by_id):
+
+    print(f"{'Checking' if dry_run else 'Preparing to delete'} Job \'{the_job_info['job_name']}\' with Job ID \'{the_job_info['job_id']}\'")
 
     # Get the Job
-    job = get_job(the_job_info)
-    if job is not None:
+    job_id = the_job_info['job_id']
+    job = get_job(the_job_info, the_jobs_by_id, the_errors_by_id)
+    if job is None:
+        journal.record(job_id, get_error_outcome(the_errors_by_id[job_id]) if job_id in the_errors_by_id else 'not-found')
+    else:
 
         print("- Found Job")
 
+        # Get the latest run of the Job once, for both checks
+        error, latest_run = get_latest_run(job)
+
         # Make sure the Job is INACTIVE
-        if job_is_inactive(job):
+        if error is not None:
+            journal.record(job_id, get_error_outcome(error))
+        elif not job_is_inactive(job, latest_run):
+            journal.record(job_id, 'not-inactive')
+        else:
             print("- Job has status \'INACTIVE\'")
 
             # Make sure the Job hasn't been run since it was identified as old
-            if job_has_not_been_run_recently(job, job_info['last_run_threshold']):
+            if not job_has_not_been_run_recently(job, latest_run, the_job_info['last_run_threshold']):
+                journal.record(job_id, 'recently-run')
 
-                # Try to delete the Job
+            # In a dry run, report the Jobs that would be deleted, unless a Sequence or Topology refers to them
+            elif dry_run:
+                if job_id in referenced_job_ids:
+                    references = ', '.join(referenced_job_ids[job_id])
+                    print(f"- Job is referenced by {references}")
+                    print(" --> Job can't be deleted.")
+                    journal.record(job_id, 'blocked-by-reference', references=references)
+                else:
+                    print("- Job would be deleted.")
+                    journal.record(job_id, 'would-delete')
+
+            # Try to delete the Job, or return it to be deleted with the next batch
+            elif batch_size > 1 or async_client is not None:
+                print("- Job will be deleted with the next batch.")
+                print("---------------------------------")
+                return job
+            else:
                 delete_job(job)
 
     print("---------------------------------")
+    return None
 
 #####################################
 # Main Program
 #####################################
 
+# The outcomes of a dry run, in the order they are reported
+DRY_RUN_OUTCOMES = ['would-delete', 'blocked-by-reference', 'permission', 'recently-run', 'not-inactive', 'not-found', 'error']
+
 # Get CRED_ID from the environment
 CRED_ID = os.getenv('CRED_ID')
 
 # Get CRED_TOKEN from the environment
 CRED_TOKEN = os.getenv('CRED_TOKEN')
 
+# Get the optional command line options
+workers_option = pop_option('--workers')
+rate_option = pop_option('--rate')
+retries_option = pop_option('--retries', '3')
+batch_size_option = pop_option('--batch-size', '1')
+use_async = pop_flag('--async')
+dry_run = pop_flag('--dry-run')
+report_file = pop_option('--report')
+resume = pop_flag('--resume')
+
 # Check the number of command line args
 if len(sys.argv) != 2:
     print('Error: Wrong number of arguments')
-    print('Usage: $ python3 delete-jobs.py <input_file>')
-    print('Usage Example: $ python3 delete-jobs.py /Users/mark/old-jobs/old_jobs.json')
+    print('Usage: $ python3 delete-jobs.py <input_file> [--workers N|auto] [--rate R] [--retries N] [--batch-size N] [--async] [--dry-run] [--resume] [--report FILE]')
+    print('Usage Example: $ python3 delete-jobs.py /Users/mark/old-jobs/old_jobs.json --workers 8 --rate 20')
+    sys.exit(1)
+
+# Validate the optional command line options. A dry run adapts its concurrency by default
+if workers_option is None:
+    workers_option = 'auto' if dry_run and not use_async else '1'
+adaptive = workers_option == 'auto'
+workers = ADAPTIVE_MAX_CONCURRENCY if adaptive else validate_number_option('--workers', workers_option, int, 1)
+rate = validate_number_option('--rate', rate_option, float, 0.1) if rate_option is not None else None
+retries = validate_number_option('--retries', retries_option, int, 0)
+batch_size = validate_number_option('--batch-size', batch_size_option, int, 1)
+if workers is None or (rate_option is not None and rate is None) or retries is None or batch_size is None:
+    sys.exit(1)
+if use_async and adaptive:
+    print('Error: The --workers auto option can\'t be used with --async')
     sys.exit(1)
 
 # Validate the input_file parameter
@@ -164,6 +335,14 @@ print("---------------------------------")
 print(f"input_file: '{input_file}'")
 if not validate_input_file_parameter(input_file):
     sys.exit(1)
+print(f"Workers: {workers_option}  Rate limit: {str(rate) + ' requests/sec' if rate else 'none'}  Retries: {retries}  Batch size: {batch_size}")
+if dry_run:
+    print("Dry run: no Jobs will be deleted")
+
+# Write the report of the run at exit, if one was requested
+if report_file is not None:
+    metrics.write_report_at_exit(report_file)
+    print(f"Report file: '{report_file}'")
 
 # Connect to Control Hub
 print("---------------------------------")
@@ -171,13 +350,106 @@ print('Connecting to Control Hub')
 print("---------------------------------")
 sch = ControlHub(credential_id=CRED_ID, token=CRED_TOKEN)
 
-# Process each line of the input_file
-with open(input_file, 'r') as f:
-    for line in f:
-        try:
-            job_info = json.loads(line)
-            handle_line(job_info)
-        except json.JSONDecodeError as e:
-            print(f"Error: Invalid JSON for line {line}: {e}")
+# Open the checkpoint journal, loading the outcomes recorded by the interrupted run if resuming.
+# A dry run records its outcomes in a journal of its own, which is also its report
+checkpoint_file = input_file + ('.dry-run.jsonl' if dry_run else '.delete-checkpoint.jsonl')
+journal = CheckpointJournal(checkpoint_file, resume)
+if resume:
+    print(f"Resuming from checkpoint file '{checkpoint_file}' with {len(journal)} Jobs already processed")
+    print("---------------------------------")
+
+# All Control Hub calls are made through the caller, which applies the rate limit and retries
+concurrency_controller = AdaptiveConcurrency() if adaptive else None
+caller = ControlHubCaller(rate, retries, concurrency_controller)
+
+# The latest run of each Job is fetched once, through the caller
+latest_run_fetcher = LatestRunFetcher(sch, caller)
+
+# Create the asyncio client used to fetch the latest runs and delete the Jobs, if --async was specified
+async_client = None
+if use_async:
+    from sch_async import AsyncControlHub
+    try:
+        async_client = AsyncControlHub(CRED_ID, CRED_TOKEN, concurrency=workers, retries=retries, rate=rate)
+    except ImportError as ex:
+        print(f"Error: {ex}")
+        sys.exit(1)
+    print(f"Fetching latest runs{'' if dry_run else ' and deleting Jobs'} with asyncio from '{async_client.url}'")
+    print("---------------------------------")
+
+# In a dry run, list the Sequences and Topologies once to find the Jobs they reference
+referenced_job_ids = {}
+if dry_run:
+    with metrics.phase('list references'):
+        referenced_job_ids, unchecked_references = get_referenced_job_ids(sch, caller)
+    for message in unchecked_references:
+        print(f"Warning: {message}")
+    print("---------------------------------")
+
+# Method that reads the input_file in chunks, looking up all of the Jobs in a chunk at once.
+# Yields the arguments for handle_line for each line of the input_file that was not already
+# processed by an interrupted run
+def read_lines(the_input_file):
+    for chunk in read_job_info_chunks(the_input_file):
+        chunk = [job_info for job_info in chunk if not journal.is_done(job_info['job_id'])]
+        jobs_by_id, errors_by_id = get_jobs_by_id(sch, [job_info['job_id'] for job_info in chunk], caller)
+        if async_client is not None:
+            latest_run_fetcher.prefetch(jobs_by_id.values(), async_client)
+        for job_info in chunk:
+            yield job_info, jobs_by_id, errors_by_id
+
+# Method that deletes a batch of verified Jobs
+def delete_batch(the_batch):
+    print(f"Deleting a batch of {len(the_batch)} Jobs")
+    record_delete_outcomes(delete_jobs(sch, the_batch, caller))
+    print("---------------------------------")
+
+# Method that groups the verified Jobs into batches of batch_size Jobs
+def verified_batches(the_verified_jobs):
+    batch = []
+    for verified_job in the_verified_jobs:
+        if verified_job is not None:
+            batch.append(verified_job)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+# Process each line of the input_file, using a pool of worker threads if more than one worker was requested.
+# Jobs that were verified are deleted in batches of batch_size Jobs
+with metrics.phase('verify and delete'):
+    # With --async, the latest runs of each chunk are already prefetched, so the lines are verified in turn
+    if workers == 1 or async_client is not None:
+        verified_jobs = (handle_line(*line_args) for line_args in read_lines(input_file))
+    else:
+        verified_jobs = map_in_order(lambda line_args: handle_line(*line_args), read_lines(input_file), workers)
+    if async_client is None:
+        for batch in verified_batches(verified_jobs):
+            delete_batch(batch)
+    else:
+        # Delete the batches concurrently, printing the outcome of each Job as its batch completes
+        for outcomes in async_client.map_in_order(lambda the_batch: delete_jobs_async(async_client, the_batch), verified_batches(verified_jobs)):
+            record_delete_outcomes(outcomes)
+        async_client.close()
+journal.close()
+metrics.set_outcomes(journal.count_outcomes())
+
+# Summarize a dry run by outcome
+if dry_run:
+    outcome_counts = journal.count_outcomes()
+    print("Dry run report:")
+    for outcome in DRY_RUN_OUTCOMES:
+        print(f"  {outcome + ':':<22}{outcome_counts.get(outcome, 0):>8}")
+    print(f"The outcome of each Job was written to '{checkpoint_file}'")
+    print("---------------------------------")
+
+print(f"Fetched the latest run {latest_run_fetcher.fetch_count} times for {latest_run_fetcher.job_count} Jobs")
+retry_count = caller.retry_count + (async_client.retry_count if async_client is not None else 0)
+if retry_count > 0:
+    print(f"Retried {retry_count} Control Hub requests that failed with a transient error")
+if concurrency_controller is not None:
+    print(concurrency_controller.summary())
 
+metrics.completed = True
 print('Done')
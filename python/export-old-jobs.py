@@ -3,17 +3,54 @@
 # FILE:  export-old-jobs.py
 #
 # DESCRIPTION:    This script exports the Jobs instances listed in the input file.
+#                 Each Job is written to a zip file named after the Job. The file names are planned
+#                 as the Jobs are looked up, in the order of the input file: characters that are not
+#                 safe in file names are replaced with '_', and Jobs of the same name get a numbered
+#                 suffix, 'Name (2).zip' and so on, so no export overwrites another. Jobs that are
+#                 not found and Job Template Instances are not planned, so they take no file name.
+#                 With more than 10,000 Jobs, the zip files are spread across the hashed
+#                 subdirectories 00 to ff.
 #
-# ARGS:           - input_file - A JSON list of Job instances to export.  Note that Job Template
+# ARGS:           - input_file - A JSON list of Job instances to export, or a binary job list written with
+#                                get-old-jobs.py --format binary.  Note that Job Template
 #                                Instances can't be exported, so they will be skipped.
 #
 #                 - export_dir - The directory to write the exported Jobs instances to.
 #                                The directory will be created if it does not exist.
-#                                If the directory does exist, it must be empty
+#                                If the directory does exist, it must be empty, unless --resume
+#                                is specified
 #
-# USAGE:          $ python3 export-old-jobs.py <input_file> <export_dir>
+# OPTIONS:        --workers N  - The number of Jobs to export from Control Hub concurrently. Looking up
+#                                the Jobs, exporting them and writing the zip files run as separate
+#                                pipeline stages that overlap. Defaults to 1.
+#                                With --workers auto, the number of Control Hub requests in flight is adjusted as
+#                                the run goes: raised while Control Hub's latency stays flat, and cut back on throttling,
+#                                timeouts or rising latency, between 1 and 64, starting from 4.
 #
-# USAGE EXAMPLE:  $ python3 export-old-jobs.py /Users/mark/old-jobs/old_jobs.json /Users/mark/jobs-export
+#                 --archive-size N - Export N Jobs with each Control Hub request and write them to one
+#                                zip archive, jobs-00001.zip, jobs-00002.zip and so on, rather than
+#                                writing one zip file per Job. The manifest file manifest.jsonl maps
+#                                each Job ID to its archive, the member of the archive that holds the
+#                                Job, and the member's SHA-256 checksum, so a single Job can be found
+#                                and restored without unpacking every archive.
+#
+#                 --async      - Export the Jobs with asyncio over one pooled HTTP session instead of
+#                                a pool of export threads, with up to --workers export requests in
+#                                flight. Requires aiohttp. The URL of Control Hub is taken from the
+#                                SCH_URL environment variable (default https://na01.hub.streamsets.com).
+#
+#                 --report FILE - Write a report of the run to FILE at exit: the time spent in each phase,
+#                                the number of Jobs with each outcome, and the count, latency histogram,
+#                                bytes and errors of each kind of Control Hub call. The report is in the
+#                                Prometheus textfile format if FILE ends with .prom, or in JSON otherwise.
+#
+#                 --resume     - Resume a run that was interrupted. The outcome of each Job is recorded
+#                                in the checkpoint journal <export_dir>/.export-checkpoint.jsonl,
+#                                and Jobs already exported or skipped are not processed again.
+#
+# USAGE:          $ python3 export-old-jobs.py <input_file> <export_dir> [--workers N|auto] [--archive-size N] [--async] [--resume] [--report FILE]
+#
+# USAGE EXAMPLE:  $ python3 export-old-jobs.py /Users/mark/old-jobs/old_jobs.json /Users/mark/jobs-export --workers 8
 #
 # PREREQUISITES:
 #
@@ -32,9 +69,31 @@
 #
 #################################################################
 
-import os,sys, json
+import os,sys, queue, threading
 from pathlib import Path
 from streamsets.sdk import ControlHub
+from job_lookup import read_job_info_chunks, get_jobs_by_id
+from job_list import read_job_infos
+from checkpoint import CheckpointJournal
+from concurrency import ControlHubCaller, AdaptiveConcurrency, ADAPTIVE_MAX_CONCURRENCY
+from instrumentation import metrics
+from job_export import write_file_atomically, remove_partial_files, get_last_archive_number, write_archive, uses_subdirectories, ExportPathPlanner, MANIFEST_FILE_NAME, ARCHIVE_FILE_NAME, SUBDIRECTORY_THRESHOLD
+
+# The name of the checkpoint journal written to the export_dir
+CHECKPOINT_FILE_NAME = '.export-checkpoint.jsonl'
+
+
+# A Job to export as it moves through the stages of the export pipeline
+class ExportTask:
+    def __init__(self, job_info, job, error):
+        self.job_info = job_info
+        self.job = job
+        self.error = error
+        self.data = None
+
+    # Method that returns True if the Job was found and is not a Job Template Instance
+    def is_exportable(self):
+        return self.job is not None and self.job.template_job_id is None
 
 # Method that validates the input_file command line parameter.
 # Returns True if the input_file exists and is readable or False otherwise
@@ -48,13 +107,18 @@ def validate_input_file_parameter(the_input_file):
 
 # Method that validates that the directory specified in the export_dir command line parameter either
 # does not exist or exists but is an empty dir. If the directory does not exist it will be created.
+# When resuming, the directory may hold the Jobs exported by the interrupted run.
 # Returns True if the directory is OK or False if not.
-def validate_export_dir_parameter(the_export_dir):
+def validate_export_dir_parameter(the_export_dir, the_resume):
 
     # If export_dir already exists...
     if os.path.isdir(the_export_dir):
         # ... make sure it is empty
-        if os.listdir(the_export_dir):
+        if the_resume:
+            if not os.path.isfile(os.path.join(the_export_dir, CHECKPOINT_FILE_NAME)):
+                print(f"Error: Export directory \'{the_export_dir}\' does not have a checkpoint file to resume from.")
+                return False
+        elif os.listdir(the_export_dir):
             print(f"Error: Export directory \'{the_export_dir}\' already exists but is not empty. ")
             print("Please specify a new or empty directory for Job export")
             return False
@@ -71,6 +135,176 @@ def validate_export_dir_parameter(the_export_dir):
             return False
     return True
 
+# Method that removes an optional '--name' command line flag from sys.argv.
+# Returns True if the flag was specified
+def pop_flag(the_name):
+    if the_name not in sys.argv:
+        return False
+    sys.argv.remove(the_name)
+    return True
+
+# Method that removes an optional '--name value' command line option from sys.argv.
+# Returns the option's value, or the_default if the option was not specified
+def pop_option(the_name, the_default=None):
+    if the_name not in sys.argv:
+        return the_default
+    index = sys.argv.index(the_name)
+    if index + 1 >= len(sys.argv):
+        print(f"Error: The option \'{the_name}\' requires a value")
+        sys.exit(1)
+    value = sys.argv[index + 1]
+    del sys.argv[index:index + 2]
+    return value
+
+# Method that validates the --workers option. Returns the number of workers or None if not valid
+def validate_workers_option(the_workers):
+    try:
+        workers = int(the_workers)
+        if workers >= 1:
+            return workers
+    except ValueError:
+        pass
+    print(f"Error: The --workers option \'{the_workers}\' is not a positive integer.")
+    return None
+
+# Pipeline stage 1: reads the input_file in chunks, looks up all of the Jobs in a chunk at once,
+# and puts a list of ExportTasks on the_export_queue for the Jobs to export with one request.
+# With --archive-size, the Jobs to export are put on the queue in batches of archive_size Jobs;
+# otherwise each Job is put on the queue on its own, and the zip file of each Job that can be
+# exported is planned here, in the order of the input file, so the file names are the same however
+# the exports overlap. Jobs that were exported or skipped by an interrupted run are not processed again
+def lookup_stage(the_export_queue, the_workers):
+    try:
+        batch = []
+        for chunk in read_job_info_chunks(input_file):
+            chunk = [obj for obj in chunk if not journal.is_done(obj["job_id"])]
+            jobs_by_id, errors_by_id = get_jobs_by_id(sch, [obj["job_id"] for obj in chunk], caller)
+            for obj in chunk:
+                task = ExportTask(obj, jobs_by_id.get(obj["job_id"]), errors_by_id.get(obj["job_id"]))
+                if archive_size is None and task.is_exportable():
+                    export_path_planner.plan(task.job.job_id, task.job.job_name)
+                if archive_size is None or not task.is_exportable():
+                    the_export_queue.put([task])
+                else:
+                    batch.append(task)
+                    if len(batch) >= archive_size:
+                        the_export_queue.put(batch)
+                        batch = []
+        if batch:
+            the_export_queue.put(batch)
+    finally:
+        # Tell each of the export workers that there are no more Jobs
+        for _ in range(the_workers):
+            the_export_queue.put(None)
+
+# Pipeline stage 2: takes lists of ExportTasks from the_export_queue, exports the Jobs that were
+# found and are not Job Template Instances with one request, and puts the lists on the_write_queue
+def export_stage(the_export_queue, the_write_queue):
+    while True:
+        tasks = the_export_queue.get()
+        if tasks is None:
+            the_write_queue.put(None)
+            return
+        exportable_tasks = [task for task in tasks if task.is_exportable()]
+        if exportable_tasks:
+            try:
+                data = caller.call(lambda: metrics.call('sch.export_jobs', sch.export_jobs, [task.job for task in exportable_tasks]))
+                for task in exportable_tasks:
+                    task.data = data
+            except Exception as e:
+                for task in exportable_tasks:
+                    task.error = e
+        the_write_queue.put(tasks)
+
+# Method that exports the Jobs of a list of ExportTasks with the asyncio client, like export_stage()
+async def export_tasks_async(the_tasks):
+    exportable_tasks = [task for task in the_tasks if task.is_exportable()]
+    if exportable_tasks:
+        try:
+            data = await async_client.export_jobs([task.job.job_id for task in exportable_tasks])
+            for task in exportable_tasks:
+                task.data = data
+        except Exception as e:
+            for task in exportable_tasks:
+                task.error = e
+    return the_tasks
+
+# Pipeline stage 2 with --async: takes lists of ExportTasks from the_export_queue and exports them
+# with the asyncio client, with many exports in flight, and puts the lists on the_write_queue in order
+def async_export_stage(the_export_queue, the_write_queue):
+    def queued_tasks():
+        while True:
+            tasks = the_export_queue.get()
+            if tasks is None:
+                return
+            yield tasks
+
+    for tasks in async_client.map_in_order(export_tasks_async, queued_tasks()):
+        the_write_queue.put(tasks)
+    the_write_queue.put(None)
+
+# Pipeline stage 3: writes the zip file of an exported Job, or reports why it was not exported,
+# and records the outcome in the checkpoint journal
+def write_stage(the_task):
+    obj = the_task.job_info
+    job_id = obj["job_id"]
+    job = the_task.job
+
+    # Handle if Job is not found
+    if job is None and the_task.error is None:
+        print(f"Error exporting Job \'{obj['job_name']}\' with job ID \'{job_id}\': Job not found")
+        journal.record(job_id, 'not-found')
+
+    # Handle if the lookup of the Job failed
+    elif job is None:
+        print(f"Error exporting Job \'{obj['job_name']}\' with job ID \'{job_id}\': {the_task.error}")
+        journal.record(job_id, 'error')
+
+    # Skip this one if it is a Job Template Instance, which can't be exported
+    elif job.template_job_id is not None:
+        print(f"Skipping export for Job \'{job.job_name}\' because it is a Job Template Instance")
+        print(f"--> Job Template ID \'{job.template_job_id}\'")
+        journal.record(job_id, 'template')
+
+    # Handle if the export failed
+    elif the_task.error is not None:
+        print(f"Error exporting Job \'{job.job_name}\': {the_task.error}")
+        journal.record(job_id, 'error')
+
+    # Write a zip file for the Job
+    else:
+        try:
+            export_file_name = export_path_planner.plan(job_id, job.job_name)
+            export_path_planner.create_directory(export_file_name)
+
+            print(f"Exporting Job \'{job.job_name}\' into the file \'{export_file_name}\'")
+            write_file_atomically(export_file_name, the_task.data)
+            journal.record(job_id, 'exported', file=export_file_name)
+
+        except Exception as e:
+            print(f"Error exporting Job \'{job.job_name}\': {e}")
+            journal.record(job_id, 'error')
+
+    print("---------------------------------")
+
+# Pipeline stage 3 with --archive-size: writes the archive of a batch of exported Jobs, adds an
+# entry for each Job to the manifest, and records the outcome in the checkpoint journal
+def write_archive_stage(the_tasks, the_archive_number, the_manifest):
+    archive_file_name = os.path.join(export_dir, ARCHIVE_FILE_NAME.format(the_archive_number))
+    try:
+        if the_tasks[0].error is not None:
+            raise the_tasks[0].error
+        print(f"Exporting {len(the_tasks)} Jobs into the archive \'{archive_file_name}\'")
+        write_archive(archive_file_name, the_tasks[0].data, [task.job for task in the_tasks], the_manifest)
+        for task in the_tasks:
+            journal.record(task.job.job_id, 'exported', file=archive_file_name)
+    except Exception as e:
+        for task in the_tasks:
+            print(f"Error exporting Job \'{task.job.job_name}\': {e}")
+            journal.record(task.job.job_id, 'error')
+
+    print("---------------------------------")
+
 #####################################
 # Main Program
 #####################################
@@ -81,13 +315,38 @@ CRED_ID = os.getenv('CRED_ID')
 # Get CRED_TOKEN from the environment
 CRED_TOKEN = os.getenv('CRED_TOKEN')
 
+# Get the optional command line options
+workers_option = pop_option('--workers', '1')
+archive_size_option = pop_option('--archive-size')
+use_async = pop_flag('--async')
+report_file = pop_option('--report')
+resume = pop_flag('--resume')
+
 # Check the number of command line args
 if len(sys.argv) != 3:
     print('Error: Wrong number of arguments')
-    print('Usage: $ python3 export-old-jobs.py <input_file> <export_dir>')
-    print('Usage Example: $ python3 export-old-jobs.py /Users/mark/old-jobs/old_jobs.json /Users/mark/jobs-export')
+    print('Usage: $ python3 export-old-jobs.py <input_file> <export_dir> [--workers N|auto] [--archive-size N] [--async] [--resume] [--report FILE]')
+    print('Usage Example: $ python3 export-old-jobs.py /Users/mark/old-jobs/old_jobs.json /Users/mark/jobs-export --workers 8')
     sys.exit(1)
 
+# Validate the --workers and --archive-size options
+adaptive = workers_option == 'auto'
+workers = ADAPTIVE_MAX_CONCURRENCY if adaptive else validate_workers_option(workers_option)
+if workers is None:
+    sys.exit(1)
+if use_async and adaptive:
+    print('Error: The --workers auto option can\'t be used with --async')
+    sys.exit(1)
+archive_size = None
+if archive_size_option is not None:
+    try:
+        archive_size = int(archive_size_option)
+    except ValueError:
+        pass
+    if archive_size is None or archive_size < 1:
+        print(f"Error: The --archive-size option \'{archive_size_option}\' is not a positive integer.")
+        sys.exit(1)
+
 # Validate the input_file parameter
 input_file = sys.argv[1]
 print("---------------------------------")
@@ -99,9 +358,36 @@ if not validate_input_file_parameter(input_file):
 export_dir = sys.argv[2]
 print("---------------------------------")
 print(f"export_dir: '{export_dir}'")
-if not validate_export_dir_parameter(export_dir):
+if not validate_export_dir_parameter(export_dir, resume):
     sys.exit(1)
 
+# Open the checkpoint journal, loading the outcomes recorded by the interrupted run if resuming
+journal = CheckpointJournal(os.path.join(export_dir, CHECKPOINT_FILE_NAME), resume, the_kept_fields={'exported': ('file',)})
+if resume:
+    print(f"Resuming with {len(journal)} Jobs already processed")
+
+    # Remove the temporary files of zip files that the interrupted run did not finish writing
+    remove_partial_files(export_dir)
+print(f"Workers: {workers_option}")
+if archive_size is not None:
+    print(f"Archive size: {archive_size} Jobs")
+
+# The zip file of each Job is planned by the lookup stage. When resuming, the files of the Jobs
+# already exported are reserved, and the other Jobs are planned again in the order of the input file
+export_path_planner = None
+if archive_size is None:
+    use_subdirectories = (resume and uses_subdirectories(export_dir)) or sum(1 for _ in read_job_infos(input_file)) > SUBDIRECTORY_THRESHOLD
+    export_path_planner = ExportPathPlanner(export_dir, use_subdirectories)
+    for _, fields in journal.iter_fields():
+        export_path_planner.reserve(fields['file'])
+    if use_subdirectories:
+        print('The zip files are spread across hashed subdirectories')
+
+# Write the report of the run at exit, if one was requested
+if report_file is not None:
+    metrics.write_report_at_exit(report_file)
+    print(f"Report file: '{report_file}'")
+
 # Connect to Control Hub
 print("---------------------------------")
 print('Connecting to Control Hub')
@@ -111,52 +397,60 @@ print("---------------------------------")
 print('Exporting Jobs...')
 print("---------------------------------")
 
-# Process each line of the input_file
-with open(input_file, 'r') as f:
-    for line in f:
-        try:
-            obj = json.loads(line)
-            job_id = obj["job_id"]
-
-            try:
-                # Get the Job from Control Hub using its ID
-                query = 'id=="' + job_id + '"'
-                jobs = sch.jobs.get_all(search=query)
-
-                # Handle if Job is not found
-                if jobs is None or len(jobs) == 0:
-                    print(f"Error exporting Job \'{obj["Job Name"]}\' with job ID \'{job_id}\': Job not found")
-
-               # Export Job
-                else:
-                    job = jobs[0]
-
-                    # Skip this one if it is a Job Template Instance, which can't be exported
-                    if job.template_job_id is not None:
-                        print(f"Skipping export for Job \'{job.job_name}\' because it is a Job Template Instance")
-                        print(f"--> Job Template ID \'{job.template_job_id}\'")
-
-                    # Not a Job Template Instance
-                    else:
-
-                        # replace '/' with '_' in Job name
-                        job_name = job.job_name.replace("/", "_")
-                        export_file_name = export_dir + '/' + job_name + '.zip'
+# Control Hub calls are made through the caller, which retries transient errors
+concurrency_controller = AdaptiveConcurrency() if adaptive else None
+caller = ControlHubCaller(the_concurrency=concurrency_controller)
 
-                        print(f"Exporting Job \'{job.job_name}\' into the file \'{export_file_name}\'")
+# Create the asyncio client used to export the Jobs, if --async was specified
+async_client = None
+if use_async:
+    from sch_async import AsyncControlHub
+    try:
+        async_client = AsyncControlHub(CRED_ID, CRED_TOKEN, concurrency=workers)
+    except ImportError as ex:
+        print(f"Error: {ex}")
+        sys.exit(1)
 
-                        data = sch.export_jobs([job])
-
-                        # Write a zip file for the Job
-                        with open(export_file_name, 'wb') as file:
-                            file.write(data)
-
-            except Exception as e:
-                print(f"Error exporting Job \'{job.job_name}\': {e}")
+# Run the lookup and export stages of the pipeline in their own threads, connected by bounded
+# queues, and write the zip files in this thread as the exports complete. With --async, a single
+# export thread keeps up to workers exports in flight on the asyncio client
+export_queue = queue.Queue(maxsize=workers * 4)
+write_queue = queue.Queue(maxsize=workers * 4)
+export_threads = 1 if async_client is not None else workers
+threads = [threading.Thread(target=lookup_stage, args=(export_queue, export_threads), daemon=True)]
+if async_client is not None:
+    threads.append(threading.Thread(target=async_export_stage, args=(export_queue, write_queue), daemon=True))
+else:
+    threads += [threading.Thread(target=export_stage, args=(export_queue, write_queue), daemon=True) for _ in range(workers)]
+for thread in threads:
+    thread.start()
 
-        except json.JSONDecodeError as e:
-            print(f"Error: Invalid JSON for line {line}: {e}")
+# With --archive-size, the archives are numbered after any written by an interrupted run, and
+# the manifest is appended to
+archive_number = get_last_archive_number(export_dir)
+manifest = open(os.path.join(export_dir, MANIFEST_FILE_NAME), 'a') if archive_size is not None else None
 
-        print("---------------------------------")
+# The stages overlap, so the whole pipeline is timed as one 'export' phase
+with metrics.phase('export'):
+    finished_workers = 0
+    while finished_workers < export_threads:
+        tasks = write_queue.get()
+        if tasks is None:
+            finished_workers += 1
+        elif archive_size is not None and tasks[0].is_exportable():
+            archive_number += 1
+            write_archive_stage(tasks, archive_number, manifest)
+        else:
+            for task in tasks:
+                write_stage(task)
+if manifest is not None:
+    manifest.close()
+journal.close()
+metrics.set_outcomes(journal.count_outcomes())
+if async_client is not None:
+    async_client.close()
+if concurrency_controller is not None:
+    print(concurrency_controller.summary())
 
+metrics.completed = True
 print('Done')
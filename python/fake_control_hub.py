@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+#################################################################
+# FILE:  fake_control_hub.py
+#
+# DESCRIPTION:    A fake, in-memory stand-in for streamsets.sdk.ControlHub that can be used to
+#                 run and benchmark the cleanup scripts offline, without a Control Hub tenant.
+#                 Every simulated Control Hub call sleeps for a configurable latency so that
+#                 the effect of concurrency can be measured.
+#
+#                 The fake is configured with these environment variables:
+#
+#                 - FAKE_SCH_JOBS        - The number of synthetic Jobs to generate (default 1000)
+#                 - FAKE_SCH_LATENCY_MS  - The latency in millis of each simulated call (default 0)
+#                 - FAKE_SCH_SEED        - The random seed used to generate the Jobs (default 42)
+#                 - FAKE_SCH_ERROR_RATE  - The fraction of simulated calls that fail with a transient
+#                                          HTTP 429 or 503 error (default 0)
+#                 - FAKE_SCH_SEARCH_FIELDS - A comma separated list of the fields that job searches
+#                                          accept (default id,job_template,status,finish_time)
+#                 - FAKE_SCH_TEMPLATE_RATE - The fraction of Jobs that are Job Templates (default 0.05)
+#                 - FAKE_SCH_NEVER_RUN_RATE - The fraction of Job instances that have never been run
+#                                          (default 0.05)
+#                 - FAKE_SCH_HISTORY_RUNS - The average number of runs in the history of a Job that
+#                                          has been run (default 1)
+#                 - FAKE_SCH_RUN_LATENCY_US - The extra latency in micros of each run transferred by a
+#                                          history call, to model the cost of large histories (default 0)
+#                 - FAKE_SCH_CAPACITY    - The number of calls the fake can serve at once. Beyond it, the
+#                                          latency of each call grows with the number of calls in flight,
+#                                          and calls beyond twice the capacity fail with HTTP 429, to
+#                                          model a tenant that throttles under load (default unlimited)
+#
+# USAGE:          Call install() before the script under test imports streamsets.sdk, for
+#                 example from benchmark.py
+#
+#################################################################
+
+import io, os, sys, json, time, random, builtins, threading, types, zipfile
+
+# The epoch millis used as "now" for generated Job history so runs are reproducible
+FAKE_NOW_MILLIS = 1767225600000  # 2026-01-01
+
+# Statuses assigned to the latest run of the generated Jobs
+FAKE_STATUSES = ['INACTIVE', 'INACTIVE', 'INACTIVE', 'INACTIVE', 'ACTIVE', 'INACTIVE_ERROR']
+
+DAY_MILLIS = 24 * 60 * 60 * 1000
+
+
+# The response attached to a FakeHTTPError
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.headers = {}
+
+
+# An error raised by a simulated call, shaped like requests.exceptions.HTTPError
+class FakeHTTPError(Exception):
+    def __init__(self, status_code, message):
+        super().__init__(f"{status_code} {message}")
+        self.response = FakeResponse(status_code)
+
+
+# A single entry in a Job's run history
+class FakeJobStatus:
+    def __init__(self, status, finish_time):
+        self.status = status
+        self.finish_time = finish_time
+
+
+# A fake Job. Reading the history property counts as a Control Hub call. As in Control Hub,
+# last_modified_on is the time the Job's definition was last edited, which does not change when it runs
+class FakeJob:
+    def __init__(self, control_hub, job_id, job_name, job_template, template_job_id, history, in_sequence=False, last_modified_on=FAKE_NOW_MILLIS):
+        self._control_hub = control_hub
+        self._in_sequence = in_sequence
+        self.last_modified_on = last_modified_on
+        self.job_id = job_id
+        self.job_name = job_name
+        self.job_template = job_template
+        self.template_job_id = template_job_id
+        self._history = history
+
+    @property
+    def history(self):
+        self._control_hub._call('job.history', len(self._history))
+        return list(self._history)
+
+
+# The response of a fake API call, shaped like the SDK's Command objects
+class FakeCommand:
+    def __init__(self, json_body):
+        self.response = self
+        self._json_body = json_body
+
+    def json(self):
+        return self._json_body
+
+
+# A fake of the sch.api_client accessor
+class FakeApiClient:
+    def __init__(self, control_hub):
+        self._control_hub = control_hub
+
+    def get_job_status_history(self, job_id, offset=0, len=-1):
+        history = self._control_hub._jobs[job_id]._history
+        end = None if len < 0 else offset + len
+        self._control_hub._call('api_client.get_job_status_history', builtins.len(history[offset:end]))
+        return FakeCommand([{'status': run.status, 'finishTime': run.finish_time} for run in history[offset:end]])
+
+
+# A fake Sequence, with the raw data the SDK keeps in _data: its steps and the IDs of their Jobs
+class FakeSequence:
+    def __init__(self, sequence_id, name, job_ids):
+        self.name = name
+        self._data = {'id': sequence_id, 'name': name,
+                      'steps': [{'stepNumber': i + 1, 'jobs': [{'jobId': job_id}]} for i, job_id in enumerate(job_ids)]}
+
+
+# A fake of the sch.jobs accessor
+class FakeJobs:
+    def __init__(self, control_hub):
+        self._control_hub = control_hub
+
+    def __iter__(self):
+        self._control_hub._call('sch.jobs')
+        return iter(list(self._control_hub._jobs.values()))
+
+    def __len__(self):
+        return len(self._control_hub._jobs)
+
+    def get_all(self, search=None, offset=None, len=None, **kwargs):
+        self._control_hub._call('sch.jobs.get_all')
+        # Look up searches for Job IDs directly rather than scanning every Job, so lookups in
+        # chunks of IDs do not dominate the benchmarks of large orgs
+        job_ids = self._control_hub._get_searched_job_ids(search)
+        if job_ids is not None:
+            return [self._control_hub._jobs[job_id] for job_id in job_ids if job_id in self._control_hub._jobs]
+        # The results of a search are kept until Jobs are deleted, so paging through them does not
+        # scan every Job for each page
+        with self._control_hub._lock:
+            jobs = self._control_hub._search_results.get(search)
+            if jobs is None:
+                jobs = list(self._control_hub._jobs.values())
+                if search is not None:
+                    jobs = [job for job in jobs if self._control_hub._matches(job, search)]
+                self._control_hub._search_results[search] = jobs
+        start = offset or 0
+        return jobs[start:start + len] if len is not None else jobs[start:]
+
+
+# The fake ControlHub. Every instance created is kept in FakeControlHub.instances so that a
+# benchmark can read the call counts after a script has run
+class FakeControlHub:
+    instances = []
+
+    def __init__(self, credential_id=None, token=None, **kwargs):
+        FakeControlHub.instances.append(self)
+        self.latency_seconds = int(os.getenv('FAKE_SCH_LATENCY_MS', '0')) / 1000.0
+        self.run_latency_seconds = int(os.getenv('FAKE_SCH_RUN_LATENCY_US', '0')) / 1000000.0
+        self.error_rate = float(os.getenv('FAKE_SCH_ERROR_RATE', '0'))
+        self.capacity = int(os.getenv('FAKE_SCH_CAPACITY', '0'))
+        self._in_flight = 0
+        self._error_rng = random.Random(int(os.getenv('FAKE_SCH_SEED', '42')))
+        self.search_fields = os.getenv('FAKE_SCH_SEARCH_FIELDS', 'id,job_template,status,finish_time').split(',')
+        self.call_counts = {}
+        self._lock = threading.Lock()
+        self._search_results = {}
+        self._jobs = generate_jobs(self, int(os.getenv('FAKE_SCH_JOBS', '1000')), int(os.getenv('FAKE_SCH_SEED', '42')),
+                                   float(os.getenv('FAKE_SCH_TEMPLATE_RATE', '0.05')),
+                                   float(os.getenv('FAKE_SCH_NEVER_RUN_RATE', '0.05')),
+                                   float(os.getenv('FAKE_SCH_HISTORY_RUNS', '1')))
+        self.jobs = FakeJobs(self)
+        self.api_client = FakeApiClient(self)
+
+    # The Sequences, one for every few of the Jobs that are part of a sequence and can't be deleted
+    @property
+    def sequences(self):
+        self._call('sch.sequences')
+        job_ids = [job.job_id for job in self._jobs.values() if job._in_sequence]
+        return [FakeSequence(f"sequence-{i // 5 + 1}", f"Fake Sequence {i // 5 + 1}", job_ids[i:i + 5])
+                for i in range(0, len(job_ids), 5)]
+
+    # Method that records a simulated Control Hub call and sleeps for the configured latency,
+    # plus the configured latency per run for calls that transfer the_runs history entries
+    def _call(self, operation, the_runs=0):
+        with self._lock:
+            self.call_counts[operation] = self.call_counts.get(operation, 0) + 1
+            self._in_flight += 1
+            in_flight = self._in_flight
+        try:
+            latency_seconds = self.latency_seconds + the_runs * self.run_latency_seconds
+            if self.capacity > 0:
+                if in_flight > 2 * self.capacity:
+                    raise FakeHTTPError(429, 'Client Error: Too Many Requests')
+                latency_seconds *= max(1.0, in_flight / self.capacity)
+            if latency_seconds > 0:
+                time.sleep(latency_seconds)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+        if self.error_rate > 0:
+            with self._lock:
+                failed = self._error_rng.random() < self.error_rate
+            if failed:
+                raise random.choice([FakeHTTPError(429, 'Client Error: Too Many Requests'), FakeHTTPError(503, 'Server Error: Service Unavailable')])
+
+    # Method that returns the Job IDs of a search made only of id=="..." alternatives, or None if
+    # the search has any other clause
+    def _get_searched_job_ids(self, search):
+        if search is None or 'id' not in self.search_fields:
+            return None
+        job_ids = []
+        for alternative in search.split(','):
+            field, found, value = alternative.partition('==')
+            if field != 'id' or not found or ';' in value:
+                return None
+            job_ids.append(value.strip('"'))
+        return job_ids
+
+    # Method that evaluates a search query made of ','-separated alternatives, each of which is
+    # made of ';'-separated clauses of the form <field>==<value> or <field><<value>, for example:
+    # job_template==false;status==INACTIVE or id=="a",id=="b"
+    def _matches(self, job, search):
+        return any(self._matches_all(job, alternative) for alternative in search.split(','))
+
+    # Method that evaluates ';'-separated search clauses, all of which must match
+    def _matches_all(self, job, search):
+        for clause in search.split(';'):
+            for operator in ('==', '<'):
+                field, found, value = clause.partition(operator)
+                if found:
+                    break
+            else:
+                raise ValueError(f"Unsupported search clause \'{clause}\'")
+            if field not in self.search_fields:
+                raise ValueError(f"Unsupported search field \'{field}\'")
+            value = value.strip('"')
+            last_run = job._history[0] if job._history else None
+            if field == 'id':
+                matched = job.job_id == value
+            elif field == 'job_template':
+                matched = str(job.job_template).lower() == value
+            elif field == 'status':
+                matched = last_run is not None and last_run.status == value
+            elif field == 'finish_time' and operator == '<':
+                matched = last_run is not None and last_run.finish_time < int(value)
+            else:
+                raise ValueError(f"Unsupported search clause \'{clause}\'")
+            if not matched:
+                return False
+        return True
+
+    # Returns a zip archive with a JSON member for each Job, like the real export
+    def export_jobs(self, jobs):
+        self._call('sch.export_jobs')
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as archive:
+            for i, job in enumerate(jobs):
+                archive.writestr(f"{job.job_name}_{i}.json", json.dumps({'jobId': job.job_id, 'name': job.job_name}))
+        return buffer.getvalue()
+
+    def delete_job(self, *jobs):
+        self._call('sch.delete_job')
+        for job in jobs:
+            if job._in_sequence:
+                raise Exception(f"JOBRUNNER_251: Cannot delete job \'{job.job_name}\' as it is part of sequences: \'1\'")
+        with self._lock:
+            for job in jobs:
+                self._jobs.pop(job.job_id, None)
+            self._search_results.clear()
+
+
+# Method that generates a reproducible set of synthetic Jobs. A fraction the_template_rate of the
+# Jobs are Job Templates, and a fraction the_never_run_rate of the Job instances have never been
+# run. The others have a history of the_history_runs runs on average, newest first. Returns a dict
+# of Jobs keyed by Job ID
+def generate_jobs(control_hub, number_of_jobs, seed, the_template_rate=0.05, the_never_run_rate=0.05, the_history_runs=1):
+    rng = random.Random(seed)
+
+    # The older runs come from their own generator, so the latest runs are the same for any history size
+    history_rng = random.Random(seed + 1)
+    jobs = {}
+    for i in range(number_of_jobs):
+        job_id = f"{i:08x}-0000-4000-8000-{rng.getrandbits(48):012x}:fake-org"
+        is_template = rng.random() < the_template_rate
+        history = []
+        if not is_template and rng.random() < 1 - the_never_run_rate:
+            finish_time = FAKE_NOW_MILLIS - rng.randint(0, 730) * DAY_MILLIS - rng.randint(0, DAY_MILLIS)
+            history.append(FakeJobStatus(rng.choice(FAKE_STATUSES), finish_time))
+            older_runs = history_rng.randint(0, round(2 * (the_history_runs - 1))) if the_history_runs > 1 else 0
+            for _ in range(older_runs):
+                finish_time -= history_rng.randint(1, 30 * DAY_MILLIS)
+                history.append(FakeJobStatus(history_rng.choice(['INACTIVE', 'INACTIVE_ERROR']), finish_time))
+        in_sequence = rng.random() < 0.02
+        # The Jobs were created, and last edited, before any of their runs
+        last_modified_on = FAKE_NOW_MILLIS - 1000 * DAY_MILLIS + i
+        jobs[job_id] = FakeJob(control_hub, job_id, f"Fake Job {i % 500}", is_template, None, history, in_sequence, last_modified_on)
+    return jobs
+
+
+# Method that registers this fake as the streamsets.sdk module so that scripts which run
+# "from streamsets.sdk import ControlHub" get the FakeControlHub instead
+def install():
+    streamsets_module = types.ModuleType('streamsets')
+    sdk_module = types.ModuleType('streamsets.sdk')
+    sdk_module.ControlHub = FakeControlHub
+    streamsets_module.sdk = sdk_module
+    sys.modules['streamsets'] = streamsets_module
+    sys.modules['streamsets.sdk'] = sdk_module
@@ -13,9 +13,59 @@
 #                                 Directories in the path will be created as needed and if an existing file
 #                                 of the same name exists, it will be overwritten.
 #
-# USAGE:          $ python3 get-old-jobs.py <last_run_threshold> <output_file>
+# OPTIONS:        --workers N - The number of Job histories to fetch from Control Hub concurrently.
+#                               Defaults to 1, which fetches the histories one Job at a time.
+#                               With --workers auto, the number of Control Hub requests in flight is adjusted as
+#                               the run goes: raised while Control Hub's latency stays flat, and cut back on throttling,
+#                               timeouts or rising latency, between 1 and 64, starting from 4.
+#                               Transient errors are retried up to 3 times, with exponential backoff.
 #
-# USAGE EXAMPLE:  $ python3 get-old-jobs.py 2024-06-30 /Users/mark/old-jobs/old_jobs.json
+#                 --resume    - Resume a run that was interrupted. The outcome of each Job checked is
+#                               recorded in the checkpoint journal <output_file>.checkpoint.jsonl,
+#                               and Jobs already recorded there are not checked again.
+#
+#                 --async     - Fetch the Job histories with asyncio over one pooled HTTP session
+#                               instead of a thread pool, with up to --workers requests in flight
+#                               (for example --workers 500). Requires aiohttp. The URL of Control
+#                               Hub is taken from the SCH_URL environment variable
+#                               (default https://na01.hub.streamsets.com).
+#
+#                 --report FILE - Write a report of the run to FILE at exit: the time spent in each phase,
+#                               the number of Jobs with each outcome, and the count, latency histogram,
+#                               bytes and errors of each kind of Control Hub call. The report is in the
+#                               Prometheus textfile format if FILE ends with .prom, or in JSON otherwise.
+#
+#                 --index FILE - A SQLite file in which the state of each Job checked is kept between
+#                               runs. Later runs only fetch the history of Jobs that are new, that
+#                               were modified, that were not old at the previous run, or whose last
+#                               run is within a week of the last_run_threshold. Jobs that are no longer
+#                               found are removed from the index. Since a Job's last-modified time does
+#                               not change when it runs, the index is only used when Control Hub accepts
+#                               the search on finish_time, which excludes the Jobs run since; otherwise
+#                               every history is fetched and the index is only updated.
+#
+#                 --format F  - The format of the output_file: jsonl (the default), one JSON object per
+#                               line, or binary, the compact binary format of job_list.py, for very large
+#                               lists. export-old-jobs.py and delete-old-jobs.py read either format, and
+#                               convert-job-list.py converts between them. Shard files are always JSONL.
+#
+#                 --shards K  - Split the Jobs across K worker processes by a hash of the Job ID, and merge
+#                               the old Jobs found by each process into the output_file. Process I uses the
+#                               API Credentials in CRED_ID_I and CRED_TOKEN_I, if they are set, or CRED_ID
+#                               and CRED_TOKEN otherwise, so each process can have its own rate limit. The
+#                               other options are passed to each process; the --index and --report files
+#                               get a .shard-I-of-K suffix, so each process has its own.
+#
+#                 --shard I/K - Find the old Jobs in shard I of K only, and write them to the output_file as
+#                               a shard file for --merge. Used to spread the shards across several hosts.
+#
+#                 --merge FILE,FILE,... - Merge the shard files written with --shard into the output_file,
+#                               oldest first, without connecting to Control Hub.
+#
+# USAGE:          $ python3 get-old-jobs.py <last_run_threshold> <output_file> [--workers N|auto] [--async] [--resume] [--index FILE] [--report FILE] [--format jsonl|binary] [--shards K | --shard I/K | --merge FILE,FILE,...]
+#
+# USAGE EXAMPLE:  $ python3 get-old-jobs.py 2024-06-30 /Users/mark/old-jobs/old_jobs.json --workers 16
+#                 $ python3 get-old-jobs.py 2024-06-30 /Users/mark/old-jobs/old_jobs.json --workers 16 --shards 4
 #
 # PREREQUISITES:
 #
@@ -34,10 +84,25 @@
 #
 #################################################################
 
-import os,sys,json
+import os,sys,json,zlib,heapq,threading,subprocess
+from itertools import chain
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import date, datetime, timedelta
 from streamsets.sdk import ControlHub
+from checkpoint import CheckpointJournal
+from concurrency import ControlHubCaller, AdaptiveConcurrency, ADAPTIVE_MAX_CONCURRENCY
+from job_records import ExternalSorter
+from job_index import JobIndex
+from job_list import JobListWriter
+from job_history import LatestRunFetcher
+from job_lookup import filters_finish_time, get_candidate_jobs, get_job_count, get_outcome
+from instrumentation import metrics
+
+# Jobs in the index whose last run is within this many millis of the threshold have their history
+# fetched again, in case they were run since the previous scan
+RECHECK_MARGIN_MILLIS = 7 * 24 * 60 * 60 * 1000
 
 # Method to convert millis to datetime string
 def millis_to_datetime_string(millis):
@@ -99,24 +164,260 @@ def validate_output_file_parameter(the_output_file):
             print(f"Error: OS error when trying to create directory \'{parent_dir}\': {e}")
             return False
 
+# Method that removes an optional '--name value' command line option from sys.argv.
+# Returns the option's value, or the_default if the option was not specified
+def pop_option(the_name, the_default=None):
+    if the_name not in sys.argv:
+        return the_default
+    index = sys.argv.index(the_name)
+    if index + 1 >= len(sys.argv):
+        print(f"Error: The option '{the_name}' requires a value")
+        sys.exit(1)
+    value = sys.argv[index + 1]
+    del sys.argv[index:index + 2]
+    return value
+
+# Method that removes an optional '--name' command line flag from sys.argv.
+# Returns True if the flag was specified
+def pop_flag(the_name):
+    if the_name not in sys.argv:
+        return False
+    sys.argv.remove(the_name)
+    return True
+
+# Method that validates the --workers option. Returns the number of workers or None if not valid
+def validate_workers_option(the_workers):
+    try:
+        workers = int(the_workers)
+        if workers >= 1:
+            return workers
+    except ValueError:
+        pass
+    print(f"Error: The --workers option '{the_workers}' is not a positive integer.")
+    return None
+
+# Method that validates the --shards option. Returns the number of shards or None if not valid
+def validate_shards_option(the_shards):
+    try:
+        shards = int(the_shards)
+        if shards >= 1:
+            return shards
+    except ValueError:
+        pass
+    print(f"Error: The --shards option '{the_shards}' is not a positive integer.")
+    return None
+
+# Method that validates the --shard option. Returns a tuple of the shard number and the number of
+# shards, or None if not valid
+def validate_shard_option(the_shard):
+    try:
+        shard, shards = (int(part) for part in the_shard.split('/'))
+        if 1 <= shard <= shards:
+            return shard, shards
+    except ValueError:
+        pass
+    print(f"Error: The --shard option '{the_shard}' is not in the form I/K, where I is a shard number from 1 to K.")
+    return None
+
+# Method that returns the shard, from 1 to the_shard_count, that a Job belongs to. The shard is
+# taken from a CRC-32 hash of the Job ID, which is the same in every process and on every host
+def get_shard(the_job_id, the_shard_count):
+    return zlib.crc32(the_job_id.encode('utf-8')) % the_shard_count + 1
+
+# Method that returns the name of the_file_name for a shard, with the shard number inserted before
+# the extension, for example old_jobs.shard-1-of-4.json
+def get_shard_file_name(the_file_name, the_shard, the_shard_count):
+    base, extension = os.path.splitext(the_file_name)
+    return f"{base}.shard-{the_shard}-of-{the_shard_count}{extension}"
+
+# Method that returns the environment for the process of a shard, with the shard's own API
+# Credentials from CRED_ID_I and CRED_TOKEN_I if they are set. Returns None if only one of them is set
+def get_shard_environment(the_shard):
+    shard_cred_id = os.getenv(f'CRED_ID_{the_shard}')
+    shard_cred_token = os.getenv(f'CRED_TOKEN_{the_shard}')
+    if (shard_cred_id is None) != (shard_cred_token is None):
+        print(f"Error: Only one of CRED_ID_{the_shard} and CRED_TOKEN_{the_shard} is set")
+        return None
+    env = dict(os.environ, PYTHONUNBUFFERED='1')
+    if shard_cred_id is not None:
+        env['CRED_ID'] = shard_cred_id
+        env['CRED_TOKEN'] = shard_cred_token
+    return env
+
+# Method that prints the output of the process of a shard as it is written, with the shard as a
+# prefix on each line
+def print_shard_output(the_process, the_prefix):
+    for line in the_process.stdout:
+        print(f"{the_prefix} {line}", end='')
+
+# Method that runs get-old-jobs.py with --shard for each of the_shard_count shards in parallel, each
+# writing its shard file next to the output file. Returns the shard files, or None if any shard failed.
+# The environment of every shard is checked before any shard is started, so that a shard with wrong
+# API Credentials does not leave the shards before it running.
+def run_shards(the_shard_count):
+    envs = [get_shard_environment(shard) for shard in range(1, the_shard_count + 1)]
+    if None in envs:
+        return None
+    processes = []
+    for shard, env in enumerate(envs, start=1):
+        args = [last_run_threshold, get_shard_file_name(output_file, shard, the_shard_count), '--shard', f"{shard}/{the_shard_count}", '--workers', workers_option]
+        if use_async:
+            args.append('--async')
+        if resume:
+            args.append('--resume')
+        if index_file is not None:
+            args += ['--index', get_shard_file_name(index_file, shard, the_shard_count)]
+        if report_file is not None:
+            args += ['--report', get_shard_file_name(report_file, shard, the_shard_count)]
+        print(f"Starting shard {shard}/{the_shard_count} with the API Credentials in {'CRED_ID_' + str(shard) if f'CRED_ID_{shard}' in os.environ else 'CRED_ID'}")
+        process = subprocess.Popen([sys.executable, os.path.abspath(__file__)] + args, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        output_thread = threading.Thread(target=print_shard_output, args=(process, f"[shard {shard}/{the_shard_count}]"))
+        output_thread.start()
+        processes.append((shard, process, output_thread))
+
+    failed_shards = []
+    for shard, process, output_thread in processes:
+        process.wait()
+        output_thread.join()
+        if process.returncode != 0:
+            failed_shards.append(shard)
+    if failed_shards:
+        print(f"Error: Shards {', '.join(map(str, failed_shards))} failed; rerun with --resume to retry them")
+        return None
+    return [get_shard_file_name(output_file, shard, the_shard_count) for shard in range(1, the_shard_count + 1)]
+
+# Method that reads the records of a shard file written with --shard
+def read_shard_records(the_shard_file):
+    with open(the_shard_file, 'r') as f:
+        for line in f:
+            record = json.loads(line)
+            if 'last_run_millis' not in record or 'sequence' not in record:
+                raise ValueError(f"'{the_shard_file}' is not a shard file written with --shard")
+            if record.get('last_run_threshold') != last_run_threshold:
+                raise ValueError(f"'{the_shard_file}' was written with a different last_run_threshold than '{last_run_threshold}'")
+            yield record
+
+# Method that merges the shard files into the output file, oldest first. Each shard file is already
+# sorted, and Jobs with the same last run are kept in the order Control Hub listed them, so the
+# output is the same as if the Jobs had been found by one process. The output is written to a
+# temporary file that is renamed when complete. Returns the number of old Jobs, or None on error
+def merge_shard_files(the_shard_files):
+    partial_output_file = output_file + '.part'
+    count = 0
+    writer = None
+    try:
+        shard_records = [read_shard_records(shard_file) for shard_file in the_shard_files]
+        merged_records = heapq.merge(*shard_records, key=lambda the_record: (the_record['last_run_millis'], the_record['sequence']))
+        if output_format == 'binary':
+            writer = JobListWriter(output_file, last_run_threshold)
+            for record in merged_records:
+                writer.add(record['last_run_millis'], record['job_name'], record['job_id'])
+                count += 1
+            writer.close()
+            return count
+        with open(partial_output_file, 'w') as f:
+            for record in merged_records:
+                f.write(json.dumps({"last_run": record['last_run'], "job_name": record['job_name'], "job_id": record['job_id'], "last_run_threshold": record['last_run_threshold']}) + '\n')
+                count += 1
+    except (OSError, ValueError, KeyError) as ex:
+        print(f"Error: Could not merge the shard files: {ex}")
+        if writer is not None:
+            writer.discard()
+        if os.path.exists(partial_output_file):
+            os.remove(partial_output_file)
+        return None
+    os.replace(partial_output_file, output_file)
+    return count
+
+# Method that returns the last run of a Job, or None if the Job has never been run. Only the newest
+# entry of the Job's history is requested from Control Hub
+def get_last_run(the_job):
+    return latest_run_fetcher.get(the_job)
+
+# Method that fetches the last run of each Job, using a pool of the_workers threads.
+# Yields (job, last_run) tuples in the same order as the_jobs, so the results are identical
+# to fetching the histories one at a time. No more than the_workers * 4 fetches are queued
+# at once so that a large org does not flood the pool.
+def get_last_runs(the_jobs, the_workers):
+    if the_workers == 1:
+        for job in the_jobs:
+            yield job, get_last_run(job)
+        return
+
+    with ThreadPoolExecutor(max_workers=the_workers) as executor:
+        pending = deque()
+        for job in the_jobs:
+            pending.append((job, executor.submit(get_last_run, job)))
+            if len(pending) >= the_workers * 4:
+                pending_job, future = pending.popleft()
+                yield pending_job, future.result()
+        while pending:
+            pending_job, future = pending.popleft()
+            yield pending_job, future.result()
+
+# Method that fetches the last run of each Job with the_async_client. Yields (job, last_run) tuples
+# in the same order as the_jobs, like get_last_runs()
+def get_last_runs_async(the_jobs, the_async_client):
+    async def fetch(the_job):
+        return the_job, await the_async_client.get_latest_run(the_job.job_id)
+
+    for result in the_async_client.map_in_order(fetch, the_jobs):
+        if isinstance(result, Exception):
+            raise result
+        yield result
+
 #####################################
 # Main Program
 #####################################
 
-# A map of old Jobs. The key is the last run timestamp millis, the value is the Job
-old_jobs = {}
-
 # Get CRED_ID from the environment
 CRED_ID = os.getenv('CRED_ID')
 
 # Get CRED_TOKEN from the environment
 CRED_TOKEN = os.getenv('CRED_TOKEN')
 
+# Get the optional command line options
+workers_option = pop_option('--workers', '1')
+use_async = pop_flag('--async')
+resume = pop_flag('--resume')
+index_file = pop_option('--index')
+report_file = pop_option('--report')
+shards_option = pop_option('--shards')
+shard_option = pop_option('--shard')
+merge_option = pop_option('--merge')
+output_format = pop_option('--format', 'jsonl')
+
 # Check the number of command line args
 if len(sys.argv) != 3:
     print('Error: Wrong number of arguments')
-    print('Usage: $ python3 get-old-jobs.py <last_run_threshold> <output_file>')
-    print('Usage Example: $ python3 get-old-jobs.py 2024-06-30 /Users/mark/old-jobs/old_jobs.json')
+    print('Usage: $ python3 get-old-jobs.py <last_run_threshold> <output_file> [--workers N|auto] [--async] [--resume] [--index FILE] [--report FILE] [--format jsonl|binary] [--shards K | --shard I/K | --merge FILE,FILE,...]')
+    print('Usage Example: $ python3 get-old-jobs.py 2024-06-30 /Users/mark/old-jobs/old_jobs.json --workers 16')
+    sys.exit(1)
+
+# Validate the --workers option. With --workers auto, the pool has the maximum number of workers
+# and the number of fetches in flight is limited by the adaptive concurrency
+adaptive = workers_option == 'auto'
+workers = ADAPTIVE_MAX_CONCURRENCY if adaptive else validate_workers_option(workers_option)
+if workers is None:
+    sys.exit(1)
+if adaptive and use_async:
+    print('Error: The --workers auto option can\'t be used with --async')
+    sys.exit(1)
+
+# Validate the --format option
+if output_format not in ('jsonl', 'binary'):
+    print(f"Error: The --format option '{output_format}' is not 'jsonl' or 'binary'.")
+    sys.exit(1)
+
+# Validate the sharding options, of which only one can be specified
+if sum(option is not None for option in (shards_option, shard_option, merge_option)) > 1:
+    print('Error: Only one of the --shards, --shard and --merge options can be specified')
+    sys.exit(1)
+shard_count = validate_shards_option(shards_option) if shards_option is not None else 1
+shard, shard_of = None, None
+if shard_option is not None:
+    shard, shard_of = validate_shard_option(shard_option) or (None, None)
+if shard_count is None or (shard_option is not None and shard is None):
     sys.exit(1)
 
 # Validate the last_run_threshold parameter
@@ -136,6 +437,57 @@ output_file = sys.argv[2]
 if not validate_output_file_parameter(output_file):
     sys.exit(1)
 print(f"Output file: '{output_file}'")
+print(f"Workers: {workers_option}")
+
+# Write the report of the run at exit, if one was requested
+if report_file is not None:
+    metrics.write_report_at_exit(report_file)
+    print(f"Report file: '{report_file}'")
+
+# Merge the shard files, running a process for each shard first if --shards was specified
+if merge_option is not None or shard_count > 1:
+    shard_files = merge_option.split(',') if merge_option is not None else None
+    if shard_count > 1:
+        print(f"Shards: {shard_count}")
+        print("---------------------------------")
+        with metrics.phase('shards'):
+            shard_files = run_shards(shard_count)
+        if shard_files is None:
+            sys.exit(1)
+    print("---------------------------------")
+    print(f"Merging {len(shard_files)} shard files into the output file in sorted date order (oldest first)")
+    with metrics.phase('merge'):
+        old_job_count = merge_shard_files(shard_files)
+    if old_job_count is None:
+        sys.exit(1)
+    print(f"Old Jobs: {old_job_count}")
+
+    # The shard files written by the shard processes are no longer needed once they are merged
+    if shard_count > 1:
+        for shard_file in shard_files:
+            os.remove(shard_file)
+    metrics.set_outcomes({'old': old_job_count})
+    metrics.completed = True
+    print("---------------------------------")
+    print('Done')
+    sys.exit(0)
+if shard is not None:
+    print(f"Shard: {shard}/{shard_of}")
+
+# Open the checkpoint journal, loading the outcomes recorded by the interrupted run if resuming
+checkpoint_file = output_file + '.checkpoint.jsonl'
+journal = CheckpointJournal(checkpoint_file, resume, the_kept_fields={'old': ('finish_time',)})
+if resume:
+    print(f"Resuming from checkpoint file '{checkpoint_file}' with {len(journal)} Jobs already checked")
+    if journal.last_run_thresholds - {last_run_threshold}:
+        print(f"Error: The checkpoint file was written with a different last_run_threshold than \'{last_run_threshold}\'")
+        sys.exit(1)
+
+# Open the Job index, if one was specified
+job_index = None
+if index_file is not None:
+    job_index = JobIndex(index_file)
+    print(f"Index file: '{index_file}' with {len(job_index)} Jobs")
 
 # Connect to Control Hub
 print("---------------------------------")
@@ -143,40 +495,177 @@ print('Connecting to Control Hub')
 print("---------------------------------")
 sch = ControlHub(credential_id=CRED_ID, token=CRED_TOKEN)
 
+# The Job histories are fetched through the caller, which retries transient errors and, with
+# --workers auto, adapts the number of fetches in flight
+concurrency_controller = AdaptiveConcurrency() if adaptive else None
+caller = ControlHubCaller(the_concurrency=concurrency_controller)
+latest_run_fetcher = LatestRunFetcher(sch, caller)
+
+# Create the asyncio client used to fetch the Job histories, if --async was specified
+async_client = None
+if use_async:
+    from sch_async import AsyncControlHub
+    try:
+        async_client = AsyncControlHub(CRED_ID, CRED_TOKEN, concurrency=workers)
+    except ImportError as ex:
+        print(f"Error: {ex}")
+        sys.exit(1)
+    print(f"Fetching Job histories with asyncio from '{async_client.url}'")
+
 # Loop through all Jobs
 print('Searching for old Jobs (this may take a while)...')
 print("---------------------------------")
-for job in sch.jobs:
 
-    # Ignore Job Templates
-    if not job.job_template:
+# The old Jobs, as compact (finish_time, job_name, job_id) records that are sorted oldest first
+# with an external merge sort, spilling to temporary files next to the output file
+old_jobs = ExternalSorter(the_temp_dir=str(Path(output_file).parent))
+
+# Get the candidate Jobs, filtered by Control Hub as far as it can. The candidates are read a page at
+# a time as the Jobs are checked, so they are never all held in memory
+with metrics.phase('search'):
+    try:
+        candidate_pages = get_candidate_jobs(sch, last_run_threshold_millis, caller)
+    except Exception as ex:
+        print(f"Error: The Control Hub search for candidate Jobs failed: {ex}")
+        sys.exit(1)
+candidate_jobs = chain.from_iterable(candidate_pages)
+
+# A Job's last-modified time changes when its definition is edited, not when it is run, so the index
+# can't tell that a Job was run again since the previous scan. The last runs in the index are only
+# used when the Control Hub search has already excluded the Jobs run after the threshold
+use_index = job_index is not None and filters_finish_time(candidate_pages.query)
+if job_index is not None and not use_index:
+    print('Control Hub did not accept the finish_time search, so the history of every Job is fetched and the index is only updated')
+
+# The number of Jobs pruned at each stage of the search
+pruned_counts = {'Job Templates': 0, 'Jobs never run': 0, 'Jobs not INACTIVE': 0, 'Jobs run after the threshold': 0}
+
+# The stage at which a Job is pruned for each outcome of checking its last run
+PRUNED_STAGES = {'never-run': 'Jobs never run', 'not-inactive': 'Jobs not INACTIVE', 'recent': 'Jobs run after the threshold'}
 
-        # Get the Job History
-        history = job.history
-        if history is not None and len(history) > 0:
-            last_run = history[0]
-            status = last_run.status
+# Method that returns the last run of a Job recorded in the index if it can be used instead of
+# fetching the Job's history, or None otherwise. The indexed last run is used only if the search
+# excluded the Jobs run after the threshold, and the Job has not been modified since the previous scan,
+# was INACTIVE, and was last run well before the threshold
+def get_indexed_last_run(the_job):
+    if not use_index:
+        return None
+    indexed_job = job_index.get(the_job.job_id)
+    last_modified = getattr(the_job, 'last_modified_on', None)
+    if indexed_job is None or last_modified is None or indexed_job.last_modified != last_modified:
+        return None
+    if indexed_job.status != 'INACTIVE' or indexed_job.finish_time >= last_run_threshold_millis - RECHECK_MARGIN_MILLIS:
+        return None
+    return indexed_job
 
-            # Only consider Jobs with status of INACTIVE
-            if status == 'INACTIVE':
+# The position in the list of candidate Jobs of each Job being checked, so that Jobs with the same
+# last run are written in the same order whether or not the Jobs are split into shards
+job_positions = {}
 
-                # If the Job's last run is older than the threshold...
-                if last_run.finish_time < last_run_threshold_millis:
+# Method that filters out Job Templates, in case Control Hub did not exclude them, the Jobs in other
+# shards, the Jobs that were already checked by the interrupted run when resuming, and the Jobs whose
+# last run can be taken from the index
+def job_instances(the_jobs):
+    global candidate_count, index_hit_count, other_shard_count
+    for position, the_job in enumerate(the_jobs):
+        candidate_count += 1
+        if the_job.job_template:
+            pruned_counts['Job Templates'] += 1
+            continue
+        if shard is not None and get_shard(the_job.job_id, shard_of) != shard:
+            other_shard_count += 1
+            continue
+        job_positions[the_job.job_id] = position
+        if job_index is not None:
+            job_index.mark_seen(the_job.job_id)
+        outcome = journal.get_outcome(the_job.job_id)
+        if outcome is not None:
+            handle_outcome(the_job, outcome, journal.get_fields(the_job.job_id).get('finish_time'))
+            continue
+        indexed_last_run = get_indexed_last_run(the_job)
+        if indexed_last_run is not None:
+            index_hit_count += 1
+            outcome = get_outcome(indexed_last_run, last_run_threshold_millis)
+            journal.record(the_job.job_id, outcome, finish_time=indexed_last_run.finish_time, last_run_threshold=last_run_threshold)
+            handle_outcome(the_job, outcome, indexed_last_run.finish_time)
+        else:
+            yield the_job
 
-                    print(f"Job: \'{job.job_name}\' Last Run Date: {millis_to_datetime_string(last_run.finish_time)}")
+# Method that adds an old Job to the old Job records, or counts the stage at which it was pruned
+def handle_outcome(the_job, the_outcome, the_finish_time):
+    position = job_positions.pop(the_job.job_id, None)
+    if the_outcome == 'old':
+        print(f"Job: \'{the_job.job_name}\' Last Run Date: {millis_to_datetime_string(the_finish_time)}")
 
-                    # Add the job to the map
-                    old_jobs[last_run.finish_time] = job
+        # Add a record of the job
+        old_jobs.add(the_finish_time, the_job.job_name, the_job.job_id, position)
+    else:
+        pruned_counts[PRUNED_STAGES[the_outcome]] += 1
+
+# Get the last run of each Job instance
+history_count = 0
+candidate_count = 0
+index_hit_count = 0
+other_shard_count = 0
+if async_client is not None:
+    last_runs = get_last_runs_async(job_instances(candidate_jobs), async_client)
+else:
+    last_runs = get_last_runs(job_instances(candidate_jobs), workers)
+with metrics.phase('check'):
+    for job, last_run in last_runs:
+        history_count += 1
+        outcome = get_outcome(last_run, last_run_threshold_millis)
+        finish_time = last_run.finish_time if last_run is not None else None
+        journal.record(job.job_id, outcome, finish_time=finish_time, last_run_threshold=last_run_threshold)
+        if job_index is not None:
+            job_index.update(job.job_id, last_run.status if last_run is not None else None, finish_time, getattr(job, 'last_modified_on', None))
+        handle_outcome(job, outcome, finish_time)
+journal.close()
+metrics.set_outcomes(dict(journal.count_outcomes(), template=pruned_counts['Job Templates']))
+if async_client is not None:
+    async_client.close()
+
+# Report how many Jobs were pruned at each stage
+print("---------------------------------")
+print(f"Job histories fetched: {history_count}")
+if caller.retry_count > 0:
+    print(f"Retried {caller.retry_count} Control Hub requests that failed with a transient error")
+if concurrency_controller is not None:
+    print(concurrency_controller.summary())
+if job_index is not None:
+    print(f"Job histories taken from the index: {index_hit_count}")
+    print(f"Jobs no longer found removed from the index: {job_index.evict_unseen()}")
+    job_index.close()
+print(f"Candidate Jobs: {candidate_count}")
+# Jobs excluded by the Control Hub search never reach the local checks, so they are counted from
+# the number of Jobs in the organization
+if candidate_pages.query is not None:
+    job_count = get_job_count(sch, caller)
+    if job_count is not None:
+        print(f"Excluded by the Control Hub search \'{candidate_pages.query}\': {job_count - candidate_count}")
+for stage, count in pruned_counts.items():
+    print(f"Pruned {stage}: {count}")
+if shard is not None:
+    print(f"Jobs in other shards: {other_shard_count}")
 
 # Write the old Jobs to the output file in ascending datetime order (i.e. oldest first)
 # This will overwrite a pre-existing file of the same name
 print("---------------------------------")
 print('Writing the list of old Job Instances to the output file in sorted date order (oldest first)')
-with open(output_file, 'w') as output_file:
-    for last_run_millis in sorted(old_jobs.keys()):
-        job = old_jobs[last_run_millis]
-        last_run_finish_time = millis_to_datetime_string(last_run_millis)
-        line = json.dumps({"last_run": last_run_finish_time, "job_name": job.job_name, "job_id": job.job_id, "last_run_threshold": last_run_threshold}) + '\n'
-        output_file.write(line)
+if output_format == 'binary' and shard is None:
+    with metrics.phase('write'), JobListWriter(output_file, last_run_threshold) as writer:
+        for last_run_millis, job_name, job_id in old_jobs.sorted_records():
+            writer.add(last_run_millis, job_name, job_id)
+else:
+    # A shard file also holds the last run in millis and the position of each Job, to merge the shards by
+    with metrics.phase('write'), open(output_file, 'w') as output_file:
+        for last_run_millis, position, job_name, job_id in old_jobs.sorted_records(the_with_sequence=True):
+            last_run_finish_time = millis_to_datetime_string(last_run_millis)
+            record = {"last_run": last_run_finish_time, "job_name": job_name, "job_id": job_id, "last_run_threshold": last_run_threshold}
+            if shard is not None:
+                record.update(last_run_millis=last_run_millis, sequence=position)
+            output_file.write(json.dumps(record) + '\n')
+old_jobs.close()
+metrics.completed = True
 print("---------------------------------")
 print('Done')
\ No newline at end of file
@@ -0,0 +1,206 @@
+#################################################################
+# FILE:  instrumentation.py
+#
+# DESCRIPTION:    Instrumentation shared by the cleanup scripts. Every Control Hub call is made
+#                 through metrics.call(), which records a latency histogram, the number of calls,
+#                 the bytes transferred where they are known, and the errors by HTTP status code
+#                 for each operation. The scripts also time their phases and count the outcome of
+#                 each Job. With the --report option, a script writes a report of all of this at
+#                 exit, in JSON or, if the file name ends with .prom, in the Prometheus textfile
+#                 format, so that cron runs can be monitored and alerted on.
+#
+#################################################################
+
+import os, sys, json, time, atexit, threading, contextlib
+from concurrency import get_status_code
+
+# The upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+
+# The prefix of the Prometheus metric names
+METRIC_PREFIX = 'sch_cleanup'
+
+
+# The metrics recorded for one Control Hub operation
+class OperationMetrics:
+    def __init__(self):
+        self.calls = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.bucket_counts = [0] * len(LATENCY_BUCKETS)
+        self.errors = {}
+
+    def to_json(self):
+        return {'calls': self.calls,
+                'bytes': self.bytes,
+                'seconds': round(self.seconds, 6),
+                'latency_buckets': {str(bound): count for bound, count in zip(LATENCY_BUCKETS, self.bucket_counts)},
+                'errors': dict(self.errors)}
+
+
+# The metrics of a run of one of the cleanup scripts
+class RunMetrics:
+    def __init__(self):
+        self.script = os.path.basename(sys.argv[0]) if sys.argv and sys.argv[0] else 'unknown'
+        self.start_time = time.time()
+        self.operations = {}
+        self.phases = {}
+        self.outcomes = {}
+        self.completed = False
+        self._lock = threading.Lock()
+
+    # Method that calls the_function with args as the Control Hub operation the_operation, and
+    # records its latency, and the error if it raises one. If the_function returns bytes, or a
+    # response whose content is known, the number of bytes is recorded too. Returns the result
+    def call(self, the_operation, the_function, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            result = the_function(*args, **kwargs)
+        except Exception as ex:
+            self.record(the_operation, time.perf_counter() - start, the_error=ex)
+            raise
+        self.record(the_operation, time.perf_counter() - start, the_bytes=get_size(result))
+        return result
+
+    # Method that records one call of the_operation that took the_seconds
+    def record(self, the_operation, the_seconds, the_bytes=0, the_error=None):
+        with self._lock:
+            operation = self.operations.get(the_operation)
+            if operation is None:
+                operation = self.operations[the_operation] = OperationMetrics()
+            operation.calls += 1
+            operation.bytes += the_bytes or 0
+            operation.seconds += the_seconds
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if the_seconds <= bound:
+                    operation.bucket_counts[i] += 1
+                    break
+            if the_error is not None:
+                status = str(get_status_code(the_error) or type(the_error).__name__)
+                operation.errors[status] = operation.errors.get(status, 0) + 1
+
+    # Method that yields the items of the_iterable, recording the total time spent waiting for
+    # them, for example while the SDK pages through sch.jobs, as one call of the_operation
+    def iterate(self, the_operation, the_iterable):
+        seconds = 0.0
+        iterator = None
+        try:
+            start = time.perf_counter()
+            iterator = iter(the_iterable)
+            seconds += time.perf_counter() - start
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    seconds += time.perf_counter() - start
+                    break
+                seconds += time.perf_counter() - start
+                yield item
+        except Exception as ex:
+            self.record(the_operation, seconds, the_error=ex)
+            raise
+        self.record(the_operation, seconds)
+
+    # Context manager that adds the time spent in the with block to the phase the_name
+    @contextlib.contextmanager
+    def phase(self, the_name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.phases[the_name] = self.phases.get(the_name, 0.0) + time.perf_counter() - start
+
+    # Method that sets the number of Jobs with each outcome
+    def set_outcomes(self, the_outcomes):
+        with self._lock:
+            self.outcomes = dict(the_outcomes)
+
+    # Method that returns the report as a dict
+    def to_json(self):
+        with self._lock:
+            duration = time.time() - self.start_time
+            jobs = sum(self.outcomes.values())
+            return {'script': self.script,
+                    'start_time': self.start_time,
+                    'duration_seconds': round(duration, 3),
+                    'completed': self.completed,
+                    'jobs': jobs,
+                    'jobs_per_second': round(jobs / duration, 3) if duration > 0 else 0,
+                    'outcomes': dict(self.outcomes),
+                    'phases': {name: round(seconds, 3) for name, seconds in self.phases.items()},
+                    'operations': {name: operation.to_json() for name, operation in self.operations.items()}}
+
+    # Method that returns the report in the Prometheus textfile format
+    def to_prometheus(self):
+        report = self.to_json()
+        script = report['script']
+        lines = []
+
+        def add(the_name, the_type, the_help, the_samples):
+            lines.append(f"# HELP {METRIC_PREFIX}_{the_name} {the_help}")
+            lines.append(f"# TYPE {METRIC_PREFIX}_{the_name} {the_type}")
+            for suffix, labels, value in the_samples:
+                label_text = ','.join(f'{key}="{escape_label(value)}"' for key, value in [('script', script)] + labels)
+                lines.append(f"{METRIC_PREFIX}_{the_name}{suffix}{{{label_text}}} {value}")
+
+        add('last_run_timestamp_seconds', 'gauge', 'The time the run started.', [('', [], report['start_time'])])
+        add('run_duration_seconds', 'gauge', 'The wall time of the run.', [('', [], report['duration_seconds'])])
+        add('run_completed', 'gauge', '1 if the run completed, 0 if it exited early.', [('', [], int(report['completed']))])
+        add('jobs_per_second', 'gauge', 'The number of Jobs processed per second.', [('', [], report['jobs_per_second'])])
+        add('jobs', 'gauge', 'The number of Jobs processed, by outcome.',
+            [('', [('outcome', outcome)], count) for outcome, count in report['outcomes'].items()])
+        add('phase_duration_seconds', 'gauge', 'The wall time spent in each phase of the run.',
+            [('', [('phase', name)], seconds) for name, seconds in report['phases'].items()])
+        add('calls_total', 'counter', 'The number of Control Hub calls, by operation.',
+            [('', [('operation', name)], operation['calls']) for name, operation in report['operations'].items()])
+        add('call_bytes_total', 'counter', 'The bytes received from Control Hub, by operation, where known.',
+            [('', [('operation', name)], operation['bytes']) for name, operation in report['operations'].items()])
+        add('call_errors_total', 'counter', 'The number of failed Control Hub calls, by operation and HTTP status.',
+            [('', [('operation', name), ('status', status)], count)
+             for name, operation in report['operations'].items() for status, count in operation['errors'].items()])
+        samples = []
+        for name, operation in report['operations'].items():
+            cumulative = 0
+            for bound, count in operation['latency_buckets'].items():
+                cumulative += count
+                samples.append(('_bucket', [('operation', name), ('le', bound)], cumulative))
+            samples.append(('_bucket', [('operation', name), ('le', '+Inf')], operation['calls']))
+            samples.append(('_sum', [('operation', name)], operation['seconds']))
+            samples.append(('_count', [('operation', name)], operation['calls']))
+        add('call_duration_seconds', 'histogram', 'The latency of Control Hub calls, by operation.', samples)
+        return '\n'.join(lines) + '\n'
+
+    # Method that writes the report to the_path, in the Prometheus textfile format if the_path
+    # ends with .prom or in JSON otherwise. The report is written to a temporary file that is
+    # renamed when complete, so a collector never reads a partial report
+    def write_report(self, the_path):
+        text = self.to_prometheus() if the_path.endswith('.prom') else json.dumps(self.to_json(), indent=2) + '\n'
+        partial_path = the_path + '.part'
+        with open(partial_path, 'w') as f:
+            f.write(text)
+        os.replace(partial_path, the_path)
+
+    # Method that writes the report to the_path when the script exits, whether it completes or not
+    def write_report_at_exit(self, the_path):
+        atexit.register(self.write_report, the_path)
+
+
+# Method that returns the size in bytes of the result of a Control Hub call, or 0 if not known
+def get_size(the_result):
+    if isinstance(the_result, (bytes, bytearray)):
+        return len(the_result)
+    response = getattr(the_result, 'response', None)
+    content = getattr(response, 'content', None)
+    if isinstance(content, (bytes, bytearray)):
+        return len(content)
+    return 0
+
+# Method that escapes a Prometheus label value
+def escape_label(the_value):
+    return str(the_value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# The metrics of this run, shared by all of the modules
+metrics = RunMetrics()
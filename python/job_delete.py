@@ -0,0 +1,40 @@
+#################################################################
+# FILE:  job_delete.py
+#
+# DESCRIPTION:    Helper methods shared by delete-old-jobs.py and cleanup-old-jobs.py to delete
+#                 batches of Jobs. A batch is deleted with one Control Hub request, and if the request
+#                 fails the batch is split in half and each half is deleted in turn, so that one Job
+#                 that can't be deleted, for example because it is referenced by a Topology, does not
+#                 prevent the others from being deleted. A transient error that persists after the
+#                 retries is returned for the whole batch instead, so that a throttling Control Hub is
+#                 not sent a request for every Job; the Jobs are retried with --resume.
+#
+#################################################################
+
+from instrumentation import metrics
+from concurrency import is_transient_error
+
+# Method to delete a batch of Jobs with the_caller, splitting the batch in half on a failure that
+# is not transient. Returns a list of (job, exception) tuples in the order of the_jobs, where the exception is None
+# if the Job was deleted
+def delete_jobs(the_sch, the_jobs, the_caller):
+    try:
+        the_caller.call(lambda: metrics.call('sch.delete_job', the_sch.delete_job, *the_jobs))
+        return [(job, None) for job in the_jobs]
+    except Exception as ex:
+        if len(the_jobs) == 1 or is_transient_error(ex):
+            return [(job, ex) for job in the_jobs]
+        middle = len(the_jobs) // 2
+        return delete_jobs(the_sch, the_jobs[:middle], the_caller) + delete_jobs(the_sch, the_jobs[middle:], the_caller)
+
+# Method to delete a batch of Jobs with an AsyncControlHub from sch_async.py, splitting the batch
+# in half on a failure that is not transient like delete_jobs()
+async def delete_jobs_async(the_async_client, the_jobs):
+    try:
+        await the_async_client.delete_jobs([job.job_id for job in the_jobs])
+        return [(job, None) for job in the_jobs]
+    except Exception as ex:
+        if len(the_jobs) == 1 or is_transient_error(ex):
+            return [(job, ex) for job in the_jobs]
+        middle = len(the_jobs) // 2
+        return await delete_jobs_async(the_async_client, the_jobs[:middle]) + await delete_jobs_async(the_async_client, the_jobs[middle:])
@@ -0,0 +1,185 @@
+#################################################################
+# FILE:  job_export.py
+#
+# DESCRIPTION:    Helpers to write the Jobs exported from Control Hub to the export directory,
+#                 shared by export-old-jobs.py and cleanup-old-jobs.py: atomic writes of zip files,
+#                 the planning of a collision-free file name for each Job, and the numbered
+#                 archives and the manifest that maps each Job to its archive.
+#
+#################################################################
+
+import os, io, re, json, glob, hashlib, zipfile, threading
+from functools import lru_cache
+
+# The suffix of the temporary file each zip file is written to before it is renamed
+PARTIAL_FILE_SUFFIX = '.part'
+
+# The name of the manifest file and the format of the names of the archives of several Jobs
+MANIFEST_FILE_NAME = 'manifest.jsonl'
+ARCHIVE_FILE_NAME = 'jobs-{:05d}.zip'
+ARCHIVE_FILE_PATTERN = re.compile(r'jobs-(\d+)\.zip')
+
+# Characters that are not allowed in file names on Linux, macOS or Windows, and control characters
+UNSAFE_FILE_NAME_CHARACTERS = re.compile(r'[\x00-\x1f\x7f<>:"/\\|?*]')
+
+# File names that Windows reserves for devices, with or without an extension
+RESERVED_FILE_NAMES = {'con', 'prn', 'aux', 'nul'} | {f'{device}{i}' for device in ('com', 'lpt') for i in range(1, 10)}
+
+# The longest file name, in UTF-8 bytes, kept from a Job name, leaving room for a suffix and '.zip'
+# within the 255 bytes most file systems allow
+MAX_FILE_NAME_BYTES = 200
+
+# The number of Job zip files above which they are spread across hashed subdirectories of the
+# export directory, 00 to ff, so that no directory holds too many files
+SUBDIRECTORY_THRESHOLD = 10000
+SUBDIRECTORY_PATTERN = re.compile(r'[0-9a-f]{2}')
+
+
+# Method that writes data to a file atomically: the data is written to a temporary file in the
+# same directory, which is renamed once it is complete, so a crash never leaves a partial file
+def write_file_atomically(the_file_name, the_data):
+    partial_file_name = the_file_name + PARTIAL_FILE_SUFFIX
+    with open(partial_file_name, 'wb') as file:
+        file.write(the_data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(partial_file_name, the_file_name)
+
+# Method that removes the temporary files of zip files that an interrupted run did not finish
+# writing, in the export directory and its hashed subdirectories
+def remove_partial_files(the_export_dir):
+    export_dir = glob.escape(the_export_dir)
+    for pattern in ('*' + PARTIAL_FILE_SUFFIX, os.path.join('[0-9a-f][0-9a-f]', '*' + PARTIAL_FILE_SUFFIX)):
+        for partial_file_name in glob.glob(os.path.join(export_dir, pattern)):
+            os.remove(partial_file_name)
+
+# Method that returns a Job name made safe to use as a file name on any file system: unsafe and
+# control characters are replaced with '_', trailing dots and spaces are removed, names reserved by
+# Windows get a leading '_', and long names are truncated. Many Jobs share a name, so the results
+# are cached
+@lru_cache(maxsize=65536)
+def sanitize_file_name(the_name):
+    name = UNSAFE_FILE_NAME_CHARACTERS.sub('_', the_name).rstrip(' .')
+    encoded_name = name.encode('utf-8')
+    if len(encoded_name) > MAX_FILE_NAME_BYTES:
+        name = encoded_name[:MAX_FILE_NAME_BYTES].decode('utf-8', 'ignore').rstrip(' .')
+    if not name or name in ('.', '..'):
+        return '_'
+    if name.split('.')[0].lower() in RESERVED_FILE_NAMES:
+        return '_' + name
+    return name
+
+# Method that returns True if the_export_dir holds hashed subdirectories written by an earlier run
+def uses_subdirectories(the_export_dir):
+    return any(entry.is_dir() and SUBDIRECTORY_PATTERN.fullmatch(entry.name) for entry in os.scandir(the_export_dir))
+
+
+# Plans the name of the zip file of each exported Job. The Job's name is sanitized, and Jobs whose
+# names are the same, or differ only in case, so they would overwrite each other on a
+# case-insensitive file system, get a numbered suffix in the order they are planned: 'Name.zip',
+# 'Name (2).zip', 'Name (3).zip' and so on. With the_use_subdirectories, each file goes to the
+# subdirectory named after the first byte of a hash of the sanitized name, so Jobs of the same name
+# stay together; the writer creates it with create_directory() before writing the file, so planning
+# a Job that is never written leaves no empty subdirectory. Each Job ID is planned once, so asking
+# again returns the same file name. Safe to use from several threads
+class ExportPathPlanner:
+    def __init__(self, the_export_dir, the_use_subdirectories=False):
+        self.export_dir = the_export_dir
+        self.use_subdirectories = the_use_subdirectories
+        self._paths = {}
+        self._used_names = set()
+        self._next_suffixes = {}
+        self._directories = {the_export_dir}
+        self._lock = threading.Lock()
+
+    # Method that reserves the_path, a zip file written by an interrupted run, so that no Job
+    # planned from now on is written to it
+    def reserve(self, the_path):
+        with self._lock:
+            self._used_names.add(self._get_key(os.path.dirname(the_path), os.path.basename(the_path)))
+
+    # Method that reserves the names of the zip files already in the export directory, for example
+    # those written by an interrupted run, so that no new file overwrites them
+    def reserve_existing_files(self):
+        directories = [self.export_dir] + [entry.path for entry in os.scandir(self.export_dir)
+                                           if entry.is_dir() and SUBDIRECTORY_PATTERN.fullmatch(entry.name)]
+        for directory in directories:
+            for entry in os.scandir(directory):
+                if entry.name.endswith('.zip') and not ARCHIVE_FILE_PATTERN.fullmatch(entry.name):
+                    self._used_names.add(self._get_key(directory, entry.name))
+
+    def _get_key(self, the_directory, the_file_name):
+        return os.path.relpath(os.path.join(the_directory, the_file_name), self.export_dir).casefold()
+
+    def _get_directory(self, the_name):
+        if not self.use_subdirectories:
+            return self.export_dir
+        return os.path.join(self.export_dir, hashlib.sha1(the_name.casefold().encode('utf-8')).hexdigest()[:2])
+
+    # Method that returns the path of the zip file for the Job the_job_id named the_job_name
+    def plan(self, the_job_id, the_job_name):
+        with self._lock:
+            path = self._paths.get(the_job_id)
+            if path is not None:
+                return path
+            name = sanitize_file_name(the_job_name)
+            directory = self._get_directory(name)
+            base_key = self._get_key(directory, name)
+            suffix = self._next_suffixes.get(base_key, 1)
+            while True:
+                file_name = name + '.zip' if suffix == 1 else f"{name} ({suffix}).zip"
+                key = self._get_key(directory, file_name)
+                if key not in self._used_names:
+                    break
+                suffix += 1
+            self._next_suffixes[base_key] = suffix + 1
+            self._used_names.add(key)
+            path = os.path.join(directory, file_name)
+            self._paths[the_job_id] = path
+            return path
+
+    # Method that creates the directory of the_path, a path returned by plan(), if it does not exist yet
+    def create_directory(self, the_path):
+        directory = os.path.dirname(the_path)
+        with self._lock:
+            if directory in self._directories:
+                return
+            os.makedirs(directory, exist_ok=True)
+            self._directories.add(directory)
+
+    def __len__(self):
+        return len(self._paths)
+
+# Method that returns the number of the last archive in the_export_dir, or 0 if there are none
+def get_last_archive_number(the_export_dir):
+    numbers = [int(match.group(1)) for match in map(ARCHIVE_FILE_PATTERN.fullmatch, os.listdir(the_export_dir)) if match]
+    return max(numbers, default=0)
+
+# Method that finds the member of an archive returned by sch.export_jobs that holds each Job, by
+# looking for the Job's ID in the content of each member. Returns a dict keyed by Job ID of tuples
+# of the member name and the member's SHA-256 checksum. If the archive can't be read as a zip
+# file, the dict is empty
+def index_archive_members(the_data, the_job_ids):
+    members = {}
+    try:
+        with zipfile.ZipFile(io.BytesIO(the_data)) as archive:
+            for info in archive.infolist():
+                content = archive.read(info)
+                for job_id in the_job_ids:
+                    if job_id not in members and job_id.encode('utf-8') in content:
+                        members[job_id] = (info.filename, hashlib.sha256(content).hexdigest())
+    except zipfile.BadZipFile:
+        pass
+    return members
+
+# Method that writes the archive of the_jobs exported with one request to the_archive_file_name,
+# and adds an entry for each Job to the_manifest. The entry holds the member of the archive that
+# holds the Job and its checksum, or the checksum of the whole archive if the member is not found
+def write_archive(the_archive_file_name, the_data, the_jobs, the_manifest):
+    write_file_atomically(the_archive_file_name, the_data)
+    archive_checksum = hashlib.sha256(the_data).hexdigest()
+    members = index_archive_members(the_data, [job.job_id for job in the_jobs])
+    for job in the_jobs:
+        member, checksum = members.get(job.job_id, (None, archive_checksum))
+        the_manifest.write(json.dumps({"job_id": job.job_id, "job_name": job.job_name, "archive": os.path.basename(the_archive_file_name), "member": member, "sha256": checksum}) + '\n')
+    the_manifest.flush()
@@ -0,0 +1,91 @@
+#################################################################
+# FILE:  job_history.py
+#
+# DESCRIPTION:    Helpers to get the latest run of a Job from Control Hub. Only the latest run's
+#                 status and finish time are kept, and the number of history fetches is counted
+#                 so a run can confirm that each Job's history is fetched only once.
+#
+#################################################################
+
+import threading
+from instrumentation import metrics
+
+
+# The latest run of a Job
+class LatestRun:
+    __slots__ = ('status', 'finish_time')
+
+    def __init__(self, status, finish_time):
+        self.status = status
+        self.finish_time = finish_time
+
+
+# Fetches the latest run of Jobs, counting the fetches, and the Jobs fetched other than with
+# the_fresh, so the count does not grow with a set of Job IDs. If the_caller is given, the fetches are
+# made with the_caller.call() so that they are rate limited and transient errors are retried.
+#
+# The latest run is requested from Control Hub's job history API with a page size of one, so the
+# rest of the history is not transferred. If the installed SDK does not offer that API, the full
+# job.history is read instead and all but the latest run is discarded.
+#
+# The latest runs of many Jobs can also be fetched at once with prefetch() and an AsyncControlHub
+# from sch_async.py; get() then returns the prefetched run instead of making a request.
+class LatestRunFetcher:
+    def __init__(self, the_sch, the_caller=None):
+        self._sch = the_sch
+        self._caller = the_caller
+        self._use_history_api = True
+        self._lock = threading.Lock()
+        self._prefetched = {}
+        self.fetch_count = 0
+        self.job_count = 0
+
+    # Method that fetches the latest run of each of the_jobs concurrently with the_async_client and
+    # keeps the results, or the errors, for get()
+    def prefetch(self, the_jobs, the_async_client):
+        the_jobs = list(the_jobs)
+        results = list(the_async_client.map_in_order(the_async_client.get_latest_run, [job.job_id for job in the_jobs]))
+        with self._lock:
+            for job, result in zip(the_jobs, results):
+                self._prefetched[job.job_id] = result
+
+    # Method that returns the latest run of the_job, or None if the Job has never been run. With
+    # the_fresh, the run is always fetched from Control Hub, even if it was prefetched
+    def get(self, the_job, the_fresh=False):
+        with self._lock:
+            self.fetch_count += 1
+            if not the_fresh:
+                self.job_count += 1
+            prefetched = self._prefetched.pop(the_job.job_id, self)
+        if the_fresh:
+            prefetched = self
+        if prefetched is not self:
+            if isinstance(prefetched, Exception):
+                raise prefetched
+            return prefetched
+        if self._caller is not None:
+            return self._caller.call(lambda: self._fetch(the_job))
+        return self._fetch(the_job)
+
+    def _fetch(self, the_job):
+        if self._use_history_api:
+            try:
+                get_job_status_history = self._sch.api_client.get_job_status_history
+            except AttributeError:
+                self._use_history_api = False
+            else:
+                try:
+                    statuses = metrics.call('api_client.get_job_status_history', get_job_status_history, the_job.job_id, offset=0, len=1).response.json()
+                except TypeError:
+                    self._use_history_api = False
+                else:
+                    if isinstance(statuses, dict):
+                        statuses = statuses.get('data')
+                    if not statuses:
+                        return None
+                    return LatestRun(statuses[0].get('status'), statuses[0].get('finishTime'))
+
+        history = metrics.call('job.history', lambda: the_job.history)
+        if history is not None and len(history) > 0:
+            return LatestRun(history[0].status, history[0].finish_time)
+        return None
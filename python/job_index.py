@@ -0,0 +1,75 @@
+#################################################################
+# FILE:  job_index.py
+#
+# DESCRIPTION:    A persistent local index of Job state used by get-old-jobs.py for incremental
+#                 discovery. The SQLite database records the last status, the last finish time
+#                 and the last-modified time of each Job seen by a previous scan, so later scans
+#                 only need to fetch the history of Jobs that are new or changed, or that are
+#                 close to the last_run_threshold.
+#
+#################################################################
+
+import sqlite3
+
+# The number of updates between commits
+COMMIT_INTERVAL = 1000
+
+
+# The state of a Job recorded in the index
+class IndexedJob:
+    __slots__ = ('status', 'finish_time', 'last_modified')
+
+    def __init__(self, status, finish_time, last_modified):
+        self.status = status
+        self.finish_time = finish_time
+        self.last_modified = last_modified
+
+
+# A SQLite index of job_id -> last status, last finish time and last-modified time
+class JobIndex:
+    def __init__(self, the_path):
+        self._connection = sqlite3.connect(the_path)
+        self._connection.execute('''CREATE TABLE IF NOT EXISTS jobs (
+                                        job_id TEXT PRIMARY KEY,
+                                        status TEXT,
+                                        finish_time INTEGER,
+                                        last_modified INTEGER,
+                                        last_seen_scan INTEGER NOT NULL)''')
+        row = self._connection.execute('SELECT MAX(last_seen_scan) FROM jobs').fetchone()
+        self.scan = (row[0] or 0) + 1
+        self._uncommitted_count = 0
+
+    def __len__(self):
+        return self._connection.execute('SELECT COUNT(*) FROM jobs').fetchone()[0]
+
+    # Method that returns the IndexedJob for the_job_id, or None if the Job is not in the index
+    def get(self, the_job_id):
+        row = self._connection.execute('SELECT status, finish_time, last_modified FROM jobs WHERE job_id = ?', (the_job_id,)).fetchone()
+        return IndexedJob(*row) if row is not None else None
+
+    # Method that records that the_job_id was seen by this scan without updating its state
+    def mark_seen(self, the_job_id):
+        self._execute('UPDATE jobs SET last_seen_scan = ? WHERE job_id = ?', (self.scan, the_job_id))
+
+    # Method that records the state of the_job_id as fetched by this scan
+    def update(self, the_job_id, the_status, the_finish_time, the_last_modified):
+        self._execute('INSERT OR REPLACE INTO jobs (job_id, status, finish_time, last_modified, last_seen_scan) VALUES (?, ?, ?, ?, ?)',
+                      (the_job_id, the_status, the_finish_time, the_last_modified, self.scan))
+
+    def _execute(self, the_sql, the_parameters):
+        self._connection.execute(the_sql, the_parameters)
+        self._uncommitted_count += 1
+        if self._uncommitted_count >= COMMIT_INTERVAL:
+            self._connection.commit()
+            self._uncommitted_count = 0
+
+    # Method that removes the Jobs that were not seen by this scan, for example because they were
+    # deleted. Returns the number of Jobs removed
+    def evict_unseen(self):
+        cursor = self._connection.execute('DELETE FROM jobs WHERE last_seen_scan < ?', (self.scan,))
+        self._connection.commit()
+        return cursor.rowcount
+
+    def close(self):
+        self._connection.commit()
+        self._connection.close()
@@ -0,0 +1,297 @@
+#################################################################
+# FILE:  job_list.py
+#
+# DESCRIPTION:    Reading and writing the list of old Jobs, either as the JSONL file written by
+#                 get-old-jobs.py by default, or in a compact binary format for very large lists.
+#
+#                 The binary format holds one fixed-width record per Job, with the Job's last run
+#                 in millis, the index of the Job's name in a table of distinct names, and the
+#                 position of the Job's ID in a block of IDs. The last_run_threshold is stored once.
+#                 The file is memory-mapped and iterated without parsing JSON, and it supports
+#                 selective reads: only the Job IDs, or only the Jobs last run before a date, which
+#                 are found with a binary search when the records are sorted oldest first.
+#
+#                 File layout (all integers little-endian):
+#                   header     - magic, version, flags, record count, and the offsets of the sections
+#                   records    - per Job: last run millis (int64), name index, ID offset, ID length (uint32)
+#                   IDs        - the UTF-8 Job IDs, one after another
+#                   name table - per distinct name: offset and length (uint32) in the names block
+#                   names      - the UTF-8 Job names, one after another
+#                   threshold  - the UTF-8 last_run_threshold, to the end of the file
+#
+#################################################################
+
+import os, json, mmap, shutil, struct, tempfile
+from datetime import datetime
+
+# The first bytes of a binary job list, and the version of the format
+MAGIC = b'SCHJOBS\x00'
+VERSION = 1
+
+# The header flag set when the records are sorted oldest first
+FLAG_SORTED = 1
+
+HEADER = struct.Struct('<8sIIQQQQQQ')
+RECORD = struct.Struct('<qIII')
+NAME_ENTRY = struct.Struct('<II')
+LAST_RUN_MILLIS = struct.Struct('<q')
+
+# The number of records unpacked at a time when a binary job list is read
+READ_CHUNK_RECORDS = 65536
+
+
+# Method to convert millis to datetime string, as written to the JSONL job list
+def millis_to_datetime_string(millis):
+    seconds = millis / 1000.0
+    dt = datetime.fromtimestamp(seconds)
+    dt_string = dt.strftime('%Y-%m-%d %H:%M:%S')
+    return dt_string
+
+# Method to convert a datetime string from the JSONL job list to millis
+def datetime_string_to_millis(the_datetime_string):
+    return int(datetime.strptime(the_datetime_string, '%Y-%m-%d %H:%M:%S').timestamp() * 1000)
+
+# A Job info dict read from a binary job list, with the last run in millis under last_run_millis.
+# The last_run datetime string is only formatted from the millis if it is used, as formatting it
+# is the most expensive part of reading a record
+class JobInfo(dict):
+    def __missing__(self, the_key):
+        if the_key != 'last_run':
+            raise KeyError(the_key)
+        self['last_run'] = millis_to_datetime_string(self['last_run_millis'])
+        return self['last_run']
+
+    def get(self, the_key, the_default=None):
+        return self[the_key] if the_key == 'last_run' else super().get(the_key, the_default)
+
+    # Method that returns the Job info as it is written to a JSONL job list
+    def to_json(self):
+        return {"last_run": self['last_run'], "job_name": self['job_name'], "job_id": self['job_id'], "last_run_threshold": self['last_run_threshold']}
+
+
+# Method that returns True if the_path is a binary job list
+def is_binary_job_list(the_path):
+    with open(the_path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+# Writes a binary job list. Records are added with add(), and the file is complete once close()
+# is called. The file is written to a temporary file that is renamed when complete
+class JobListWriter:
+    def __init__(self, the_path, the_last_run_threshold):
+        self._path = the_path
+        self._partial_path = the_path + '.part'
+        self._last_run_threshold = the_last_run_threshold
+        self._file = open(self._partial_path, 'wb')
+        self._file.write(bytes(HEADER.size))
+        self._ids = tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(the_path)))
+        self._ids_size = 0
+        self._name_indexes = {}
+        self._count = 0
+        self._sorted = True
+        self._last_millis = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, the_type, the_value, the_traceback):
+        self.close()
+
+    def __len__(self):
+        return self._count
+
+    # Method that adds the record of one Job. The Job's name is stored once however many Jobs have it
+    def add(self, the_last_run_millis, the_job_name, the_job_id):
+        name_index = self._name_indexes.setdefault(the_job_name, len(self._name_indexes))
+        job_id = the_job_id.encode('utf-8')
+        self._file.write(RECORD.pack(the_last_run_millis, name_index, self._ids_size, len(job_id)))
+        self._ids.write(job_id)
+        self._ids_size += len(job_id)
+        if self._last_millis is not None and the_last_run_millis < self._last_millis:
+            self._sorted = False
+        self._last_millis = the_last_run_millis
+        self._count += 1
+
+    # Method that abandons the file, removing the temporary file
+    def discard(self):
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        self._ids.close()
+        os.remove(self._partial_path)
+
+    # Method that writes the IDs, the names and the header, and renames the file into place
+    def close(self):
+        if self._file is None:
+            return
+        ids_offset = self._file.tell()
+        self._ids.seek(0)
+        shutil.copyfileobj(self._ids, self._file)
+        self._ids.close()
+
+        names_offset = self._file.tell()
+        names = [name.encode('utf-8') for name in self._name_indexes]
+        offset = 0
+        for name in names:
+            self._file.write(NAME_ENTRY.pack(offset, len(name)))
+            offset += len(name)
+        for name in names:
+            self._file.write(name)
+
+        threshold_offset = self._file.tell()
+        self._file.write(self._last_run_threshold.encode('utf-8'))
+        self._file.seek(0)
+        self._file.write(HEADER.pack(MAGIC, VERSION, FLAG_SORTED if self._sorted else 0, self._count,
+                                     HEADER.size, ids_offset, names_offset, len(names), threshold_offset))
+        self._file.close()
+        self._file = None
+        os.replace(self._partial_path, self._path)
+
+
+# Reads a binary job list through a memory map
+class JobList:
+    def __init__(self, the_path):
+        self._file = open(the_path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError(f"\'{the_path}\' is not a binary job list")
+        if len(self._map) < HEADER.size:
+            self.close()
+            raise ValueError(f"\'{the_path}\' is not a binary job list")
+        (magic, version, flags, self._count, self._records_offset, self._ids_offset,
+         self._names_offset, self._name_count, threshold_offset) = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"\'{the_path}\' is not a binary job list of version {VERSION}")
+        self.is_sorted = bool(flags & FLAG_SORTED)
+        self.last_run_threshold = self._map[threshold_offset:].decode('utf-8')
+        self._names = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, the_type, the_value, the_traceback):
+        self.close()
+
+    def __len__(self):
+        return self._count
+
+    # Method that returns the distinct Job names, decoded once on first use
+    def _get_names(self):
+        if self._names is None:
+            names_start = self._names_offset + self._name_count * NAME_ENTRY.size
+            self._names = [self._map[names_start + offset:names_start + offset + length].decode('utf-8')
+                           for offset, length in NAME_ENTRY.iter_unpack(self._map[self._names_offset:names_start])]
+        return self._names
+
+    # Method that returns the number of records to read for the_older_than_millis: the number of
+    # Jobs last run before it, found with a binary search if the records are sorted, or all of the
+    # records otherwise
+    def _get_end(self, the_older_than_millis):
+        if the_older_than_millis is None or not self.is_sorted:
+            return self._count
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if LAST_RUN_MILLIS.unpack_from(self._map, self._records_offset + middle * RECORD.size)[0] < the_older_than_millis:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    # Method that yields the fields of the records, skipping those not last run before
+    # the_older_than_millis. The records are unpacked READ_CHUNK_RECORDS at a time
+    def _iter_records(self, the_older_than_millis):
+        end = self._records_offset + self._get_end(the_older_than_millis) * RECORD.size
+        for start in range(self._records_offset, end, READ_CHUNK_RECORDS * RECORD.size):
+            chunk = self._map[start:min(start + READ_CHUNK_RECORDS * RECORD.size, end)]
+            for record in RECORD.iter_unpack(chunk):
+                if the_older_than_millis is None or record[0] < the_older_than_millis:
+                    yield record
+
+    # Method that yields the Job IDs, of only the Jobs last run before the_older_than_millis if given
+    def job_ids(self, the_older_than_millis=None):
+        ids_offset = self._ids_offset
+        for _, _, id_offset, id_length in self._iter_records(the_older_than_millis):
+            start = ids_offset + id_offset
+            yield self._map[start:start + id_length].decode('utf-8')
+
+    # Method that yields (last_run_millis, job_name, job_id) tuples, of only the Jobs last run before
+    # the_older_than_millis if given
+    def records(self, the_older_than_millis=None):
+        names = self._get_names()
+        ids_offset = self._ids_offset
+        for last_run_millis, name_index, id_offset, id_length in self._iter_records(the_older_than_millis):
+            start = ids_offset + id_offset
+            yield last_run_millis, names[name_index], self._map[start:start + id_length].decode('utf-8')
+
+    # Method that yields a JobInfo dict like each line of the JSONL job list, of only the Jobs last run
+    # before the_older_than_millis if given
+    def job_infos(self, the_older_than_millis=None):
+        last_run_threshold = self.last_run_threshold
+        for last_run_millis, job_name, job_id in self.records(the_older_than_millis):
+            yield JobInfo({"last_run_millis": last_run_millis, "job_name": job_name, "job_id": job_id, "last_run_threshold": last_run_threshold})
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+
+# Method that yields the Job info dicts of a job list in either format. Lines of a JSONL job list
+# that are not valid JSON are reported and skipped
+def read_job_infos(the_path):
+    if is_binary_job_list(the_path):
+        with JobList(the_path) as job_list:
+            yield from job_list.job_infos()
+        return
+    with open(the_path, 'r') as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"Error: Invalid JSON for line {line}: {e}")
+
+# Method that converts a JSONL job list to a binary job list, keeping only the Jobs last run before
+# the_older_than_millis if given. All of the Jobs must have the same last_run_threshold. Returns the
+# number of Jobs written
+def convert_jsonl_to_binary(the_jsonl_path, the_binary_path, the_older_than_millis=None):
+    writer = None
+    try:
+        for job_info in read_job_infos(the_jsonl_path):
+            if writer is None:
+                writer = JobListWriter(the_binary_path, job_info['last_run_threshold'])
+                last_run_threshold = job_info['last_run_threshold']
+            elif job_info['last_run_threshold'] != last_run_threshold:
+                raise ValueError(f"Job \'{job_info['job_name']}\' has a last_run_threshold of \'{job_info['last_run_threshold']}\' rather than \'{last_run_threshold}\'")
+            last_run_millis = job_info.get('last_run_millis') or datetime_string_to_millis(job_info['last_run'])
+            if the_older_than_millis is None or last_run_millis < the_older_than_millis:
+                writer.add(last_run_millis, job_info['job_name'], job_info['job_id'])
+    except Exception:
+        if writer is not None:
+            writer.discard()
+        raise
+    if writer is None:
+        raise ValueError(f"\'{the_jsonl_path}\' has no Jobs")
+    writer.close()
+    return len(writer)
+
+# Method that converts a binary job list to a JSONL job list, keeping only the Jobs last run before
+# the_older_than_millis if given. If the_ids_only is True, only the Job IDs are written, one per
+# line. Returns the number of Jobs written
+def convert_binary_to_jsonl(the_binary_path, the_jsonl_path, the_older_than_millis=None, the_ids_only=False):
+    count = 0
+    with JobList(the_binary_path) as job_list, open(the_jsonl_path, 'w') as f:
+        if the_ids_only:
+            for job_id in job_list.job_ids(the_older_than_millis):
+                f.write(job_id + '\n')
+                count += 1
+        else:
+            for job_info in job_list.job_infos(the_older_than_millis):
+                f.write(json.dumps(job_info.to_json()) + '\n')
+                count += 1
+    return count
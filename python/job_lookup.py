@@ -0,0 +1,185 @@
+#################################################################
+# FILE:  job_lookup.py
+#
+# DESCRIPTION:    Helper methods shared by the cleanup scripts to read the list of old Jobs in
+#                 chunks and to look up each chunk of Jobs in Control Hub with a single search query
+#                 rather than one query per Job, and to search Control Hub for the candidate old
+#                 Jobs a page at a time and decide from a Job's latest run whether it is old.
+#
+#################################################################
+
+from job_list import read_job_infos
+from instrumentation import metrics
+from concurrency import is_transient_error
+
+# The number of lines of the input file that are looked up in Control Hub at once
+LOOKUP_CHUNK_SIZE = 200
+
+# The number of candidate Jobs requested from Control Hub at once
+CANDIDATE_PAGE_SIZE = 1000
+
+# Method that reads the input file, a JSONL or binary job list, in chunks of the_chunk_size Job
+# info objects. Lines of a JSONL job list that are not valid JSON are reported and skipped.
+def read_job_info_chunks(the_input_file, the_chunk_size=LOOKUP_CHUNK_SIZE):
+    chunk = []
+    for job_info in read_job_infos(the_input_file):
+        chunk.append(job_info)
+        if len(chunk) >= the_chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+# Method that returns the Control Hub search query that matches any of the_job_ids
+def build_job_id_query(the_job_ids):
+    return ','.join('id=="' + job_id + '"' for job_id in the_job_ids)
+
+# Method that looks up the_job_ids in Control Hub with one combined search query.
+# If Control Hub rejects the query, for example because it is too long, the IDs are split
+# in half and each half is looked up in turn, down to one ID per query.
+# If the_caller is given, the queries are made with the_caller.call() so that they are rate
+# limited and transient errors are retried. A transient error that persists is recorded for every
+# ID of the query rather than splitting it, so a throttling Control Hub is not sent more requests.
+# Returns a tuple of two dicts: the Jobs found keyed by Job ID, and the errors keyed by Job ID.
+# Job IDs that are in neither dict were not found.
+def get_jobs_by_id(the_sch, the_job_ids, the_caller=None):
+    jobs_by_id = {}
+    errors_by_id = {}
+    job_ids = list(dict.fromkeys(the_job_ids))
+    if not job_ids:
+        return jobs_by_id, errors_by_id
+    try:
+        query = build_job_id_query(job_ids)
+        if the_caller is not None:
+            jobs = the_caller.call(lambda: metrics.call('sch.jobs.get_all', the_sch.jobs.get_all, search=query))
+        else:
+            jobs = metrics.call('sch.jobs.get_all', the_sch.jobs.get_all, search=query)
+        for job in jobs or []:
+            if job.job_id in job_ids:
+                jobs_by_id[job.job_id] = job
+    except Exception as ex:
+        if len(job_ids) == 1 or is_transient_error(ex):
+            for job_id in job_ids:
+                errors_by_id[job_id] = ex
+        else:
+            middle = len(job_ids) // 2
+            for half in (job_ids[:middle], job_ids[middle:]):
+                half_jobs_by_id, half_errors_by_id = get_jobs_by_id(the_sch, half, the_caller)
+                jobs_by_id.update(half_jobs_by_id)
+                errors_by_id.update(half_errors_by_id)
+    return jobs_by_id, errors_by_id
+
+# Method that returns the Control Hub search queries used to select candidate Jobs, from the most
+# to the least selective. The clauses exclude Job Templates, Jobs whose status is not INACTIVE,
+# and Jobs that finished after the threshold, so that only the remaining candidates need to have
+# their history fetched.
+def build_candidate_queries(the_last_run_threshold_millis):
+    clauses = ['job_template==false', 'status==INACTIVE', f'finish_time<{the_last_run_threshold_millis}']
+    return [';'.join(clauses[:n]) for n in range(len(clauses), 0, -1)]
+
+# Method that returns True if the_query, a query from build_candidate_queries(), excludes the Jobs
+# that finished after the threshold, so that only Jobs whose last run is old are candidates
+def filters_finish_time(the_query):
+    return the_query is not None and 'finish_time<' in the_query
+
+# The candidate Jobs, read from Control Hub a page of the_page_size Jobs at a time so that only one
+# page is held in memory. Iterating yields the pages, each a list of Jobs, starting with
+# the_first_page. query is the search that Control Hub accepted, or None if all Jobs are listed.
+# If the_page_size is None, the_first_page is an iterable of all the Jobs, yielded as the only page.
+#
+# The next page is requested from the offset of the Jobs read so far, less removed_count. A consumer
+# that deletes candidates must have finished deleting the Jobs of a page, and added them to
+# removed_count, before it asks for the next page, since the Jobs after them move up in the results.
+# If Control Hub ignores the offset, the rest of the Jobs are yielded as one last page.
+class CandidateJobPages:
+    def __init__(self, the_sch, the_query, the_first_page, the_page_size, the_caller=None):
+        self.query = the_query
+        self.removed_count = 0
+        self._sch = the_sch
+        self._first_page = the_first_page
+        self._page_size = the_page_size
+        self._caller = the_caller
+
+    def __iter__(self):
+        page = self._first_page
+        self._first_page = None
+        if self._page_size is None:
+            yield page
+            return
+        read_count = 0
+        while page:
+            yield page
+            read_count += len(page)
+
+            # A version of the SDK that does not page the results returns them all at once
+            if len(page) != self._page_size:
+                return
+            first_job_id = page[0].job_id
+            offset = read_count - self.removed_count
+            page = get_job_page(self._sch, self.query, offset, self._page_size, self._caller)
+
+            # A version of the SDK that ignores the offset returns the first page again, so the rest
+            # of the Jobs are listed in one pass instead, skipping the ones already read
+            if page and page[0].job_id == first_job_id:
+                print(f"Control Hub ignored the offset of the page of Jobs at {offset}; listing the rest of the Jobs in one pass")
+                page = get_job_page(self._sch, self.query, None, None, self._caller)[offset:]
+                if page:
+                    yield page
+                return
+
+# Method that gets the page of the_len Jobs matching the_query, or all Jobs if it is None, from
+# the_offset. If the_len is None, all the matching Jobs are returned at once.
+# If the_caller is given, the request is made with the_caller.call()
+def get_job_page(the_sch, the_query, the_offset, the_len, the_caller=None):
+    kwargs = dict(offset=the_offset, len=the_len) if the_len is not None else {}
+    if the_query is not None:
+        kwargs['search'] = the_query
+    get_page = lambda: metrics.call('sch.jobs.get_all', the_sch.jobs.get_all, **kwargs)
+    return list(the_caller.call(get_page) if the_caller is not None else get_page())
+
+# Method that gets the candidate Jobs from Control Hub as a CandidateJobPages of the_page_size Jobs,
+# or of one page of all the candidates if the_page_size is None. Each query is tried in turn until
+# Control Hub accepts one; if none of them are accepted, all Jobs are listed instead.
+# If the_caller is given, the searches are made with the_caller.call() so that transient errors
+# are retried. A transient error that persists is raised to the caller rather than taken as a
+# query that Control Hub does not accept, so it never widens the search.
+def get_candidate_jobs(the_sch, the_last_run_threshold_millis, the_caller=None, the_page_size=CANDIDATE_PAGE_SIZE):
+    for query in build_candidate_queries(the_last_run_threshold_millis) + [None]:
+        try:
+            first_page = get_job_page(the_sch, query, 0, the_page_size, the_caller)
+        except Exception as ex:
+            if is_transient_error(ex):
+                raise
+            if query is not None:
+                print(f"Control Hub did not accept the search \'{query}\': {ex}")
+            continue
+        print(f"Control Hub accepted the search \'{query}\'" if query is not None else 'Listing all Jobs')
+        return CandidateJobPages(the_sch, query, first_page, the_page_size, the_caller)
+
+    # A version of the SDK that can't page the Jobs lists them all in one pass
+    print('Listing all Jobs')
+    return CandidateJobPages(the_sch, None, metrics.iterate('sch.jobs', the_sch.jobs), None)
+
+# Method that returns the number of Jobs in the organization, or None if Control Hub can't tell
+def get_job_count(the_sch, the_caller=None):
+    count = lambda: metrics.call('sch.jobs.len', len, the_sch.jobs)
+    try:
+        return the_caller.call(count) if the_caller is not None else count()
+    except Exception as ex:
+        print(f"Could not count the Jobs in the organization: {ex}")
+    return None
+
+# Method that returns the outcome of checking the latest run of a Job: 'old' if the Job is INACTIVE
+# and its latest run is older than the threshold, or the reason it is not old otherwise
+def get_outcome(the_latest_run, the_last_run_threshold_millis):
+    if the_latest_run is None:
+        return 'never-run'
+
+    # Only consider Jobs with status of INACTIVE
+    if the_latest_run.status != 'INACTIVE':
+        return 'not-inactive'
+
+    # If the Job's last run is older than the threshold...
+    if the_latest_run.finish_time < the_last_run_threshold_millis:
+        return 'old'
+    return 'recent'
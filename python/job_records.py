@@ -0,0 +1,71 @@
+#################################################################
+# FILE:  job_records.py
+#
+# DESCRIPTION:    An external merge sort of compact old Job records, used by get-old-jobs.py
+#                 to write the list of old Jobs oldest first without holding every Job in memory.
+#                 Each record is a (finish_time, job_name, job_id) tuple. Records are buffered up
+#                 to a fixed run size, then each full buffer is sorted and spilled to a temporary
+#                 file, and the sorted runs are merged when the records are read back. Records
+#                 with the same finish_time are all kept, in the order they were added.
+#
+#################################################################
+
+import json, heapq, tempfile
+
+# The number of records held in memory before they are sorted and spilled to a temporary file
+DEFAULT_RUN_SIZE = 50000
+
+
+# Sorts (finish_time, job_name, job_id) records by finish_time with bounded memory
+class ExternalSorter:
+    def __init__(self, the_run_size=DEFAULT_RUN_SIZE, the_temp_dir=None):
+        self._run_size = the_run_size
+        self._temp_dir = the_temp_dir
+        self._buffer = []
+        self._run_files = []
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    # Method that adds a record. The sequence number keeps records with the same finish_time
+    # in the order they were added, unless the_sequence is given to order them by instead
+    def add(self, the_finish_time, the_job_name, the_job_id, the_sequence=None):
+        self._buffer.append((the_finish_time, self._count if the_sequence is None else the_sequence, the_job_name, the_job_id))
+        self._count += 1
+        if len(self._buffer) >= self._run_size:
+            self._spill()
+
+    # Method that sorts the buffered records and writes them to a temporary run file
+    def _spill(self):
+        self._buffer.sort()
+        run_file = tempfile.TemporaryFile(mode='w+', dir=self._temp_dir)
+        for record in self._buffer:
+            run_file.write(json.dumps(record) + '\n')
+        run_file.seek(0)
+        self._run_files.append(run_file)
+        self._buffer = []
+
+    # Method that yields the records of a run file
+    @staticmethod
+    def _read_run(the_run_file):
+        for line in the_run_file:
+            yield tuple(json.loads(line))
+
+    # Method that yields all of the records as (finish_time, job_name, job_id) tuples, oldest first,
+    # or as (finish_time, sequence, job_name, job_id) tuples if the_with_sequence is True
+    def sorted_records(self, the_with_sequence=False):
+        self._buffer.sort()
+        runs = [self._read_run(run_file) for run_file in self._run_files]
+        for finish_time, sequence, job_name, job_id in heapq.merge(iter(self._buffer), *runs):
+            if the_with_sequence:
+                yield finish_time, sequence, job_name, job_id
+            else:
+                yield finish_time, job_name, job_id
+
+    # Method that deletes the temporary run files
+    def close(self):
+        for run_file in self._run_files:
+            run_file.close()
+        self._run_files = []
+        self._buffer = []
@@ -0,0 +1,70 @@
+#################################################################
+# FILE:  job_references.py
+#
+# DESCRIPTION:    Helpers to find the Jobs that are referenced by Sequences or Topologies, which
+#                 Control Hub refuses to delete. Each kind of referencing object is listed once,
+#                 and the Job IDs are collected from the raw data of each object, so they are found
+#                 however deeply the version of the SDK nests them (in Sequence steps, or in the
+#                 topology definition, which Control Hub returns as a JSON string).
+#
+#                 Versions of the SDK that do not have an accessor for a kind of object, or a
+#                 Control Hub that refuses to list it, are reported rather than treated as errors,
+#                 so the caller can say which references were not checked.
+#
+#################################################################
+
+import json
+from instrumentation import metrics
+
+# The kinds of objects that can reference Jobs: the name of the sch accessor, and the label used in reports
+REFERENCING_ACCESSORS = [('sequences', 'Sequence'), ('topologies', 'Topology')]
+
+
+# Method that yields every string held in the_data, a structure of dicts and lists. Strings that
+# hold a JSON object or array, like a topology definition, are parsed and searched too
+def iter_strings(the_data):
+    if isinstance(the_data, dict):
+        for value in the_data.values():
+            yield from iter_strings(value)
+    elif isinstance(the_data, (list, tuple)):
+        for value in the_data:
+            yield from iter_strings(value)
+    elif isinstance(the_data, str):
+        yield the_data
+        if the_data[:1] in ('{', '['):
+            try:
+                yield from iter_strings(json.loads(the_data))
+            except ValueError:
+                pass
+
+# Method that returns the name of a Sequence or Topology, for reports
+def get_object_name(the_object):
+    for attribute in ('name', 'topology_name'):
+        name = getattr(the_object, attribute, None)
+        if isinstance(name, str):
+            return name
+    return '?'
+
+# Method that lists each kind of object that can reference Jobs, with the_caller.call() if given.
+# Returns a tuple of a dict keyed by the referenced Job IDs of lists of labels like
+# "Sequence 'Nightly load'", and a list of the messages for the kinds of objects that could not be
+# listed, which are empty if every kind of reference was checked
+def get_referenced_job_ids(the_sch, the_caller=None):
+    references = {}
+    unchecked = []
+    for accessor, label in REFERENCING_ACCESSORS:
+        if not hasattr(the_sch, accessor):
+            unchecked.append(f"{label} references were not checked: this version of the SDK has no sch.{accessor}")
+            continue
+        list_objects = lambda: metrics.call(f"sch.{accessor}", lambda: list(getattr(the_sch, accessor)))
+        try:
+            objects = the_caller.call(list_objects) if the_caller is not None else list_objects()
+        except Exception as ex:
+            unchecked.append(f"{label} references were not checked: {ex}")
+            continue
+        for referencing_object in objects:
+            data = getattr(referencing_object, '_data', None)
+            reference = f"{label} \'{get_object_name(referencing_object)}\'"
+            for value in set(iter_strings(data)):
+                references.setdefault(value, []).append(reference)
+    return references, unchecked
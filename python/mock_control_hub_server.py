@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+#################################################################
+# FILE:  mock_control_hub_server.py
+#
+# DESCRIPTION:    A mock Control Hub REST server that serves the Job endpoints used by
+#                 sch_async.py, so the --async option of the cleanup scripts can be run and
+#                 benchmarked offline. The Jobs are generated by fake_control_hub.py with the same
+#                 FAKE_SCH_* environment variables, so a script run with the fake SDK and this
+#                 server sees the same Jobs through both.
+#
+#                 Endpoints:
+#
+#                 - GET  /jobrunner/rest/v1/jobs?offset=N&len=N
+#                 - GET  /jobrunner/rest/v1/job/<job_id>
+#                 - GET  /jobrunner/rest/v1/job/<job_id>/history?offset=N&len=N
+#                 - POST /jobrunner/rest/v1/jobs/exportJobs   (body: a list of Job IDs)
+#                 - POST /jobrunner/rest/v1/jobs/deleteJobs   (body: a list of Job IDs)
+#
+# USAGE:          $ python3 mock_control_hub_server.py <port>
+#
+# USAGE EXAMPLE:  $ FAKE_SCH_JOBS=10000 FAKE_SCH_LATENCY_MS=50 python3 mock_control_hub_server.py 18630
+#
+#################################################################
+
+import sys, json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, unquote
+from fake_control_hub import FakeControlHub, FakeHTTPError
+
+JOBS_PATH = '/jobrunner/rest/v1/jobs'
+JOB_PATH = '/jobrunner/rest/v1/job/'
+
+
+# Handles one request against the FakeControlHub in the server
+class MockControlHubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def _handle(self, method):
+        control_hub = self.server.control_hub
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        offset = int(query.get('offset', ['0'])[0])
+        length = int(query.get('len', ['-1'])[0])
+        body = None
+        if method == 'POST':
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'null')
+        try:
+            if method == 'GET' and url.path == JOBS_PATH:
+                control_hub._call('sch.jobs')
+                jobs = list(control_hub._jobs.values())[offset:None if length < 0 else offset + length]
+                self._send_json([self._job_json(job) for job in jobs])
+            elif method == 'GET' and url.path.startswith(JOB_PATH) and url.path.endswith('/history'):
+                job_id = unquote(url.path[len(JOB_PATH):-len('/history')])
+                if job_id not in control_hub._jobs:
+                    return self._send_error(404, f"Job '{job_id}' not found")
+                self._send_json(control_hub.api_client.get_job_status_history(job_id, offset, length).response.json())
+            elif method == 'GET' and url.path.startswith(JOB_PATH):
+                control_hub._call('sch.jobs.get')
+                job = control_hub._jobs.get(unquote(url.path[len(JOB_PATH):]))
+                if job is None:
+                    return self._send_error(404, 'Job not found')
+                self._send_json(self._job_json(job))
+            elif method == 'POST' and url.path == JOBS_PATH + '/exportJobs':
+                jobs = [control_hub._jobs[job_id] for job_id in body if job_id in control_hub._jobs]
+                self._send(200, 'application/octet-stream', control_hub.export_jobs(jobs))
+            elif method == 'POST' and url.path == JOBS_PATH + '/deleteJobs':
+                control_hub.delete_job(*[control_hub._jobs[job_id] for job_id in body if job_id in control_hub._jobs])
+                self._send_json(None)
+            else:
+                self._send_error(404, f"No endpoint for {method} {url.path}")
+        except FakeHTTPError as ex:
+            self._send_error(ex.response.status_code, str(ex))
+        except Exception as ex:
+            self._send_error(400, str(ex))
+
+    @staticmethod
+    def _job_json(job):
+        return {'id': job.job_id, 'name': job.job_name, 'jobTemplate': job.job_template,
+                'templateJobId': job.template_job_id, 'lastModifiedOn': job.last_modified_on}
+
+    def _send_json(self, the_body):
+        self._send(200, 'application/json', json.dumps(the_body).encode())
+
+    def _send_error(self, the_status_code, the_message):
+        self._send(the_status_code, 'application/json', json.dumps({'message': the_message}).encode())
+
+    def _send(self, the_status_code, the_content_type, the_body):
+        self.send_response(the_status_code)
+        self.send_header('Content-Type', the_content_type)
+        self.send_header('Content-Length', str(len(the_body)))
+        self.end_headers()
+        self.wfile.write(the_body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# A threaded HTTP server with a listen backlog large enough for thousands of concurrent clients
+class MockControlHubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, the_port):
+        super().__init__(('127.0.0.1', the_port), MockControlHubHandler)
+        self.control_hub = FakeControlHub()
+
+#####################################
+# Main Program
+#####################################
+
+if __name__ == '__main__':
+
+    if len(sys.argv) != 2:
+        print('Error: Wrong number of arguments')
+        print('Usage: $ python3 mock_control_hub_server.py <port>')
+        print('Usage Example: $ FAKE_SCH_JOBS=10000 FAKE_SCH_LATENCY_MS=50 python3 mock_control_hub_server.py 18630')
+        sys.exit(1)
+
+    server = MockControlHubServer(int(sys.argv[1]))
+    print(f"Serving {len(server.control_hub._jobs)} Jobs on http://127.0.0.1:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+#################################################################
+# FILE:  sch_async.py
+#
+# DESCRIPTION:    A thin asyncio client for the Control Hub REST API calls made in the hot loops
+#                 of the cleanup scripts: getting a Job's latest run, exporting Jobs and deleting
+#                 Jobs. All requests share one pooled HTTP session and a semaphore that caps the
+#                 number of requests in flight, and transient errors are retried with backoff.
+#
+#                 The scripts use the client with their --async option. The event loop runs in a
+#                 background thread, and map_in_order() lets the synchronous scripts keep
+#                 thousands of requests in flight on that one loop.
+#
+#                 When run as a script, it measures the throughput of latest-run requests against
+#                 a Control Hub, for example the mock server in mock_control_hub_server.py.
+#
+# USAGE:          $ python3 sch_async.py <number_of_jobs> [--concurrency N]
+#
+# USAGE EXAMPLE:  $ SCH_URL=http://localhost:18630 python3 sch_async.py 10000 --concurrency 500
+#
+# PREREQUISITES:
+#
+#  - aiohttp. See: https://docs.aiohttp.org/en/stable/#library-installation
+#
+#  - The environment variables CRED_ID and CRED_TOKEN, as for the other scripts, and optionally
+#    SCH_URL with the URL of Control Hub (default https://na01.hub.streamsets.com)
+#
+#################################################################
+
+import os, sys, json, time, asyncio, threading
+from collections import deque
+from concurrency import TokenBucket, is_transient_error, get_retry_delay
+from job_history import LatestRun
+from instrumentation import metrics
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+# The default URL of Control Hub, which can be overridden with the SCH_URL environment variable
+DEFAULT_SCH_URL = 'https://na01.hub.streamsets.com'
+
+# The default maximum number of requests in flight
+DEFAULT_CONCURRENCY = 200
+
+
+# An error returned by Control Hub. Like requests.exceptions.HTTPError, it has a response with the
+# status code and headers, so is_transient_error() and get_retry_delay() can be used with it
+class AsyncControlHubError(Exception):
+    def __init__(self, the_status_code, the_headers, the_message):
+        super().__init__(f"{the_status_code} {the_message}")
+        self.response = type('Response', (), {'status_code': the_status_code, 'headers': the_headers})()
+
+
+# An asyncio Control Hub client whose event loop runs in a background thread. If rate is given,
+# no more than rate requests per second are made
+class AsyncControlHub:
+    def __init__(self, credential_id, token, url=None, concurrency=DEFAULT_CONCURRENCY, retries=3, rate=None):
+        if aiohttp is None:
+            raise ImportError("The --async option requires aiohttp. Install it with: pip3 install aiohttp")
+        self.url = (url or os.getenv('SCH_URL') or DEFAULT_SCH_URL).rstrip('/')
+        self.concurrency = concurrency
+        self.retries = retries
+        self.request_count = 0
+        self.retry_count = 0
+        self._bucket = TokenBucket(rate) if rate else None
+        self._headers = {'Content-Type': 'application/json',
+                         'X-Requested-By': 'sch',
+                         'X-SS-REST-CALL': 'true',
+                         'X-SS-App-Component-Id': credential_id or '',
+                         'X-SS-App-Auth-Token': token or ''}
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        self.run(self._open())
+
+    async def _open(self):
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._session = aiohttp.ClientSession(headers=self._headers, connector=aiohttp.TCPConnector(limit=self.concurrency))
+
+    # Method that runs a coroutine on the client's event loop and waits for its result
+    def run(self, the_coroutine):
+        return asyncio.run_coroutine_threadsafe(the_coroutine, self._loop).result()
+
+    # Method that calls the_coroutine_function on each item of the_items on the client's event
+    # loop, with up to self.concurrency calls in flight. Yields the results in the same order as
+    # the_items. If a call raises an exception, the exception is yielded as its result
+    def map_in_order(self, the_coroutine_function, the_items):
+        async def call(item):
+            try:
+                return await the_coroutine_function(item)
+            except Exception as ex:
+                return ex
+
+        pending = deque()
+        for item in the_items:
+            pending.append(asyncio.run_coroutine_threadsafe(call(item), self._loop))
+            if len(pending) >= self.concurrency:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    # Method that makes a request to Control Hub for the_operation, retrying transient errors with
+    # backoff. Each attempt is recorded in the metrics. Returns the response body, parsed as JSON
+    # unless the_binary is True
+    async def _request(self, the_operation, the_method, the_path, the_json=None, the_binary=False):
+        attempt = 0
+        while True:
+            if self._bucket is not None:
+                await asyncio.to_thread(self._bucket.acquire)
+            try:
+                async with self._semaphore:
+                    self.request_count += 1
+                    start = time.perf_counter()
+                    try:
+                        async with self._session.request(the_method, self.url + the_path, json=the_json) as response:
+                            body = await response.read()
+                            if response.status >= 400:
+                                raise AsyncControlHubError(response.status, dict(response.headers), body.decode(errors='replace'))
+                    except Exception as ex:
+                        metrics.record(the_operation, time.perf_counter() - start, the_error=ex)
+                        raise
+                    metrics.record(the_operation, time.perf_counter() - start, the_bytes=len(body))
+                    if the_binary:
+                        return body
+                    return json.loads(body) if body else None
+            except (AsyncControlHubError, aiohttp.ClientError, asyncio.TimeoutError) as ex:
+                if attempt >= self.retries or not is_transient_error(ex):
+                    raise
+                await asyncio.sleep(get_retry_delay(ex, attempt))
+                attempt += 1
+                self.retry_count += 1
+
+    # Method that returns one page of Jobs as a list of dicts
+    async def list_jobs(self, offset=0, length=1000):
+        jobs = await self._request('async.list_jobs', 'GET', f'/jobrunner/rest/v1/jobs?offset={offset}&len={length}')
+        return jobs.get('data', []) if isinstance(jobs, dict) else jobs
+
+    # Method that returns a Job as a dict, or None if the Job is not found
+    async def get_job(self, job_id):
+        try:
+            return await self._request('async.get_job', 'GET', f'/jobrunner/rest/v1/job/{job_id}')
+        except AsyncControlHubError as ex:
+            if ex.response.status_code == 404:
+                return None
+            raise
+
+    # Method that returns the latest run of a Job, or None if the Job has never been run
+    async def get_latest_run(self, job_id):
+        statuses = await self._request('async.get_latest_run', 'GET', f'/jobrunner/rest/v1/job/{job_id}/history?offset=0&len=1')
+        if isinstance(statuses, dict):
+            statuses = statuses.get('data')
+        if not statuses:
+            return None
+        return LatestRun(statuses[0].get('status'), statuses[0].get('finishTime'))
+
+    # Method that exports Jobs. Returns the zip archive as bytes
+    async def export_jobs(self, job_ids):
+        return await self._request('async.export_jobs', 'POST', '/jobrunner/rest/v1/jobs/exportJobs', the_json=list(job_ids), the_binary=True)
+
+    # Method that deletes Jobs
+    async def delete_jobs(self, job_ids):
+        await self._request('async.delete_jobs', 'POST', '/jobrunner/rest/v1/jobs/deleteJobs', the_json=list(job_ids))
+
+    # Method that closes the HTTP session and stops the event loop
+    def close(self):
+        self.run(self._session.close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+#####################################
+# Main Program
+#####################################
+
+if __name__ == '__main__':
+
+    concurrency = DEFAULT_CONCURRENCY
+    if '--concurrency' in sys.argv:
+        index = sys.argv.index('--concurrency')
+        concurrency = int(sys.argv[index + 1])
+        del sys.argv[index:index + 2]
+
+    if len(sys.argv) != 2:
+        print('Error: Wrong number of arguments')
+        print('Usage: $ python3 sch_async.py <number_of_jobs> [--concurrency N]')
+        print('Usage Example: $ SCH_URL=http://localhost:18630 python3 sch_async.py 10000 --concurrency 500')
+        sys.exit(1)
+    number_of_jobs = int(sys.argv[1])
+
+    client = AsyncControlHub(os.getenv('CRED_ID'), os.getenv('CRED_TOKEN'), concurrency=concurrency)
+    print(f"Control Hub: '{client.url}'  Concurrency: {concurrency}")
+
+    # List the Jobs
+    job_ids = []
+    while len(job_ids) < number_of_jobs:
+        page = client.run(client.list_jobs(len(job_ids), min(1000, number_of_jobs - len(job_ids))))
+        if not page:
+            break
+        job_ids += [job['id'] for job in page]
+
+    # Get the latest run of each Job
+    start = time.perf_counter()
+    errors = sum(1 for result in client.map_in_order(client.get_latest_run, job_ids) if isinstance(result, Exception))
+    seconds = time.perf_counter() - start
+    client.close()
+
+    print(f"Fetched the latest run of {len(job_ids)} Jobs in {seconds:.2f} s ({len(job_ids) / seconds:.0f} Jobs/s) with {errors} errors")
@@ -0,0 +1,11 @@
+#################################################################
+# FILE:  conftest.py
+#
+# DESCRIPTION:    Makes the modules in the python directory importable by the tests, which are
+#                 run from the python directory with:  $ python3 -m pytest -q
+#
+#################################################################
+
+import os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,81 @@
+#################################################################
+# FILE:  test_checkpoint.py
+#
+# DESCRIPTION:    Tests of the checkpoint journal in checkpoint.py.
+#
+#################################################################
+
+from checkpoint import CheckpointJournal
+
+
+def test_resume_loads_the_outcomes_and_kept_fields(tmp_path):
+    path = str(tmp_path / 'checkpoint.jsonl')
+    journal = CheckpointJournal(path, False, the_kept_fields={'exported': ('file',)})
+    journal.record('job-1', 'exported', file='A.zip', last_run_threshold='2025-06-30')
+    journal.record('job-2', 'error', last_run_threshold='2025-06-30')
+    journal.record('job-3', 'not-found')
+    journal.close()
+
+    journal = CheckpointJournal(path, True, the_kept_fields={'exported': ('file',)})
+    assert len(journal) == 3
+    assert journal.get_outcome('job-1') == 'exported'
+    assert journal.get_fields('job-1') == {'file': 'A.zip'}
+    assert journal.get_fields('job-2') == {}
+    assert list(journal.iter_fields()) == [('job-1', {'file': 'A.zip'})]
+    assert journal.is_done('job-1') and journal.is_done('job-3')
+    assert not journal.is_done('job-2') and not journal.is_done('job-4')
+    assert journal.last_run_thresholds == {'2025-06-30'}
+    journal.close()
+
+
+def test_a_later_record_replaces_the_outcome(tmp_path):
+    path = str(tmp_path / 'checkpoint.jsonl')
+    journal = CheckpointJournal(path, True, the_kept_fields={'exported': ('file',)})
+    journal.record('job-1', 'exported', file='A.zip')
+    journal.record('job-1', 'error')
+    assert journal.count_outcomes() == {'error': 1}
+    assert journal.get_fields('job-1') == {}
+    journal.close()
+
+    journal = CheckpointJournal(path, True)
+    assert journal.get_outcome('job-1') == 'error'
+    assert journal.count_outcomes() == {'error': 1}
+    journal.close()
+
+
+def test_without_resume_only_the_outcome_counts_are_kept(tmp_path):
+    path = str(tmp_path / 'checkpoint.jsonl')
+    journal = CheckpointJournal(path, False, the_kept_fields={'exported': ('file',)})
+    journal.record('job-1', 'exported', file='A.zip', last_run_threshold='2025-06-30')
+    journal.record('job-2', 'error')
+    assert journal.count_outcomes() == {'exported': 1, 'error': 1}
+    assert journal.get_outcome('job-1') is None and journal.get_fields('job-1') == {}
+    assert journal.last_run_thresholds == {'2025-06-30'}
+    journal.close()
+
+    journal = CheckpointJournal(path, True, the_kept_fields={'exported': ('file',)})
+    assert journal.get_outcome('job-1') == 'exported'
+    assert journal.get_fields('job-1') == {'file': 'A.zip'}
+    journal.close()
+
+
+def test_a_partly_written_line_is_ignored(tmp_path):
+    path = tmp_path / 'checkpoint.jsonl'
+    path.write_text('{"job_id": "job-1", "outcome": "deleted"}\n{"job_id": "job-2", "outc')
+    journal = CheckpointJournal(str(path), True)
+    assert len(journal) == 1
+    journal.record('job-3', 'deleted')
+    journal.close()
+
+    journal = CheckpointJournal(str(path), True)
+    assert journal.count_outcomes() == {'deleted': 2}
+    journal.close()
+
+
+def test_without_resume_the_journal_is_started_afresh(tmp_path):
+    path = tmp_path / 'checkpoint.jsonl'
+    path.write_text('{"job_id": "job-1", "outcome": "deleted"}\n')
+    journal = CheckpointJournal(str(path), False)
+    assert len(journal) == 0
+    journal.close()
+    assert path.read_text() == ''
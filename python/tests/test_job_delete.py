@@ -0,0 +1,47 @@
+#################################################################
+# FILE:  test_job_delete.py
+#
+# DESCRIPTION:    Tests of the batch deletes in job_delete.py, against a stub Control Hub.
+#
+#################################################################
+
+from concurrency import ControlHubCaller
+from fake_control_hub import FakeHTTPError
+from job_delete import delete_jobs
+
+
+class StubJob:
+    def __init__(self, job_id):
+        self.job_id = job_id
+
+
+# A stub Control Hub that fails every delete of a batch holding one of the_failing_job_ids, or every
+# delete with the_error if the_failing_job_ids is None, and counts the deletes
+class StubControlHub:
+    def __init__(self, the_error, the_failing_job_ids=None):
+        self.error = the_error
+        self.failing_job_ids = the_failing_job_ids
+        self.delete_count = 0
+
+    def delete_job(self, *jobs):
+        self.delete_count += 1
+        if self.failing_job_ids is None or any(job.job_id in self.failing_job_ids for job in jobs):
+            raise self.error
+
+
+def test_a_failing_job_is_isolated():
+    error = Exception("JOBRUNNER_251: Cannot delete job as it is part of sequences: '1'")
+    sch = StubControlHub(error, {'job-5'})
+    jobs = [StubJob(f'job-{i}') for i in range(8)]
+    outcomes = delete_jobs(sch, jobs, ControlHubCaller(retries=0))
+    assert [(job.job_id, ex) for job, ex in outcomes] == [(job.job_id, error if job.job_id == 'job-5' else None) for job in jobs]
+    assert sch.delete_count == 7
+
+
+def test_a_transient_error_is_not_split():
+    error = FakeHTTPError(503, 'Server Error: Service Unavailable')
+    sch = StubControlHub(error)
+    jobs = [StubJob(f'job-{i}') for i in range(200)]
+    outcomes = delete_jobs(sch, jobs, ControlHubCaller(retries=0))
+    assert outcomes == [(job, error) for job in jobs]
+    assert sch.delete_count == 1
@@ -0,0 +1,86 @@
+#################################################################
+# FILE:  test_job_export.py
+#
+# DESCRIPTION:    Tests of the planning of export file names in job_export.py.
+#
+#################################################################
+
+import os
+from job_export import ExportPathPlanner, sanitize_file_name, uses_subdirectories, MAX_FILE_NAME_BYTES
+
+
+def test_same_names_get_numbered_suffixes(tmp_path):
+    planner = ExportPathPlanner(str(tmp_path))
+    paths = [planner.plan(f'job-{i}', 'Weather to MongoDB') for i in range(3)]
+    assert [os.path.basename(path) for path in paths] == ['Weather to MongoDB.zip', 'Weather to MongoDB (2).zip', 'Weather to MongoDB (3).zip']
+    assert len(planner) == 3
+
+
+def test_names_that_differ_in_case_do_not_collide(tmp_path):
+    planner = ExportPathPlanner(str(tmp_path))
+    assert os.path.basename(planner.plan('job-1', 'Weather')) == 'Weather.zip'
+    assert os.path.basename(planner.plan('job-2', 'WEATHER')) == 'WEATHER (2).zip'
+
+
+def test_a_suffixed_name_does_not_collide_with_a_job_name(tmp_path):
+    planner = ExportPathPlanner(str(tmp_path))
+    assert os.path.basename(planner.plan('job-1', 'A (2)')) == 'A (2).zip'
+    assert os.path.basename(planner.plan('job-2', 'A')) == 'A.zip'
+    assert os.path.basename(planner.plan('job-3', 'A')) == 'A (3).zip'
+
+
+def test_a_job_is_planned_once(tmp_path):
+    planner = ExportPathPlanner(str(tmp_path))
+    path = planner.plan('job-1', 'A')
+    assert planner.plan('job-1', 'A') == path
+    assert len(planner) == 1
+
+
+def test_reserved_paths_are_not_planned(tmp_path):
+    planner = ExportPathPlanner(str(tmp_path))
+    planner.reserve(os.path.join(str(tmp_path), 'A.zip'))
+    assert os.path.basename(planner.plan('job-1', 'a')) == 'a (2).zip'
+
+
+def test_existing_files_are_reserved(tmp_path):
+    (tmp_path / 'A.zip').write_bytes(b'')
+    (tmp_path / 'jobs-00001.zip').write_bytes(b'')
+    planner = ExportPathPlanner(str(tmp_path))
+    planner.reserve_existing_files()
+    assert os.path.basename(planner.plan('job-1', 'A')) == 'A (2).zip'
+    assert os.path.basename(planner.plan('job-2', 'jobs-00001')) == 'jobs-00001.zip'
+
+
+def test_subdirectories_are_created_only_when_written(tmp_path):
+    planner = ExportPathPlanner(str(tmp_path), the_use_subdirectories=True)
+    path = planner.plan('job-1', 'A')
+    assert os.path.dirname(os.path.dirname(path)) == str(tmp_path)
+    assert not uses_subdirectories(str(tmp_path))
+    planner.create_directory(path)
+    assert os.path.isdir(os.path.dirname(path))
+    assert uses_subdirectories(str(tmp_path))
+
+
+def test_same_names_share_a_subdirectory(tmp_path):
+    planner = ExportPathPlanner(str(tmp_path), the_use_subdirectories=True)
+    first_path = planner.plan('job-1', 'Weather')
+    second_path = planner.plan('job-2', 'weather')
+    assert os.path.dirname(first_path) == os.path.dirname(second_path)
+    assert os.path.basename(second_path) == 'weather (2).zip'
+
+
+def test_sanitize_file_name():
+    assert sanitize_file_name('a/b\\c:d*e?f"g<h>i|j') == 'a_b_c_d_e_f_g_h_i_j'
+    assert sanitize_file_name('tab\there') == 'tab_here'
+    assert sanitize_file_name('name. . ') == 'name'
+    assert sanitize_file_name('...') == '_'
+    assert sanitize_file_name('') == '_'
+    assert sanitize_file_name('CON') == '_CON'
+    assert sanitize_file_name('com1.backup') == '_com1.backup'
+    assert sanitize_file_name('console') == 'console'
+
+
+def test_long_names_are_truncated_on_a_character_boundary():
+    name = sanitize_file_name('é' * MAX_FILE_NAME_BYTES)
+    assert len(name.encode('utf-8')) <= MAX_FILE_NAME_BYTES
+    assert name == 'é' * (MAX_FILE_NAME_BYTES // 2)
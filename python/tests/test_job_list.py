@@ -0,0 +1,152 @@
+#################################################################
+# FILE:  test_job_list.py
+#
+# DESCRIPTION:    Round-trip and edge-case tests of the binary job list format in job_list.py.
+#
+#################################################################
+
+import json
+import pytest
+from job_list import (JobList, JobListWriter, JobInfo, read_job_infos, is_binary_job_list, convert_jsonl_to_binary,
+                      convert_binary_to_jsonl, millis_to_datetime_string, datetime_string_to_millis)
+
+THRESHOLD = '2025-06-30'
+
+# Records of (last_run_millis, job_name, job_id), sorted oldest first, with a shared name, a
+# non-ASCII name, and two Jobs last run at the same time
+RECORDS = [
+    (1700000000000, 'Weather to MongoDB', 'job-1:org'),
+    (1700000000000, 'Weather to MongoDB', 'job-2:org'),
+    (1710000000000, 'Météo → Kafka', 'job-3:org'),
+    (1720000000000, 'Weather to MongoDB', 'job-4:org'),
+]
+
+
+# Method that writes the_records to a binary job list at the_path and returns the path
+def write_job_list(the_path, the_records, the_threshold=THRESHOLD):
+    with JobListWriter(str(the_path), the_threshold) as writer:
+        for record in the_records:
+            writer.add(*record)
+    return str(the_path)
+
+
+def test_round_trip(tmp_path):
+    path = write_job_list(tmp_path / 'jobs.bin', RECORDS)
+    assert is_binary_job_list(path)
+    with JobList(path) as job_list:
+        assert len(job_list) == len(RECORDS)
+        assert job_list.is_sorted
+        assert job_list.last_run_threshold == THRESHOLD
+        assert list(job_list.records()) == RECORDS
+        assert list(job_list.job_ids()) == [job_id for _, _, job_id in RECORDS]
+
+
+def test_no_partial_file_is_left(tmp_path):
+    write_job_list(tmp_path / 'jobs.bin', RECORDS)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['jobs.bin']
+
+
+def test_empty_job_list(tmp_path):
+    path = write_job_list(tmp_path / 'jobs.bin', [])
+    with JobList(path) as job_list:
+        assert len(job_list) == 0
+        assert list(job_list.records()) == []
+        assert list(job_list.job_ids(1700000000000)) == []
+        assert job_list.last_run_threshold == THRESHOLD
+
+
+@pytest.mark.parametrize('older_than_millis, expected_count', [
+    (1600000000000, 0),
+    (1700000000000, 0),
+    (1700000000001, 2),
+    (1710000000000, 2),
+    (1720000000000, 3),
+    (1800000000000, 4),
+])
+def test_older_than_with_sorted_records(tmp_path, older_than_millis, expected_count):
+    path = write_job_list(tmp_path / 'jobs.bin', RECORDS)
+    with JobList(path) as job_list:
+        assert list(job_list.records(older_than_millis)) == RECORDS[:expected_count]
+
+
+def test_older_than_with_unsorted_records(tmp_path):
+    records = [RECORDS[2], RECORDS[0], RECORDS[3], RECORDS[1]]
+    path = write_job_list(tmp_path / 'jobs.bin', records)
+    with JobList(path) as job_list:
+        assert not job_list.is_sorted
+        assert list(job_list.job_ids(1710000000000)) == ['job-1:org', 'job-2:org']
+        assert list(job_list.records()) == records
+
+
+def test_reads_across_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr('job_list.READ_CHUNK_RECORDS', 3)
+    records = [(1700000000000 + i, f'Job {i % 4}', f'job-{i}:org') for i in range(10)]
+    path = write_job_list(tmp_path / 'jobs.bin', records)
+    with JobList(path) as job_list:
+        assert list(job_list.records()) == records
+        assert list(job_list.records(1700000000007)) == records[:7]
+
+
+def test_discard_removes_the_partial_file(tmp_path):
+    writer = JobListWriter(str(tmp_path / 'jobs.bin'), THRESHOLD)
+    writer.add(*RECORDS[0])
+    writer.discard()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / 'jobs.jsonl'
+    path.write_text('{"job_id": "job-1:org"}\n' * 10)
+    assert not is_binary_job_list(str(path))
+    with pytest.raises(ValueError):
+        JobList(str(path))
+
+
+def test_job_info_formats_last_run_on_use():
+    job_info = JobInfo({'last_run_millis': 1700000000000, 'job_name': 'A', 'job_id': 'job-1:org', 'last_run_threshold': THRESHOLD})
+    assert 'last_run' not in job_info
+    assert job_info.get('last_run') == millis_to_datetime_string(1700000000000)
+    assert job_info.to_json() == {'last_run': millis_to_datetime_string(1700000000000), 'job_name': 'A',
+                                  'job_id': 'job-1:org', 'last_run_threshold': THRESHOLD}
+    with pytest.raises(KeyError):
+        job_info['missing']
+
+
+def test_datetime_string_round_trip():
+    assert datetime_string_to_millis(millis_to_datetime_string(1700000000000)) == 1700000000000
+
+
+def test_convert_jsonl_to_binary_and_back(tmp_path):
+    jsonl_path = tmp_path / 'jobs.jsonl'
+    job_infos = [{'last_run': millis_to_datetime_string(millis), 'job_name': name, 'job_id': job_id, 'last_run_threshold': THRESHOLD}
+                 for millis, name, job_id in RECORDS]
+    jsonl_path.write_text(''.join(json.dumps(job_info) + '\n' for job_info in job_infos))
+
+    binary_path = str(tmp_path / 'jobs.bin')
+    assert convert_jsonl_to_binary(str(jsonl_path), binary_path) == len(RECORDS)
+    assert [job_info.to_json() for job_info in read_job_infos(binary_path)] == job_infos
+
+    copy_path = tmp_path / 'copy.jsonl'
+    assert convert_binary_to_jsonl(binary_path, str(copy_path)) == len(RECORDS)
+    assert copy_path.read_text() == jsonl_path.read_text()
+
+    ids_path = tmp_path / 'ids.txt'
+    assert convert_binary_to_jsonl(binary_path, str(ids_path), 1710000000000, the_ids_only=True) == 2
+    assert ids_path.read_text() == 'job-1:org\njob-2:org\n'
+
+
+def test_convert_rejects_mixed_thresholds(tmp_path):
+    jsonl_path = tmp_path / 'jobs.jsonl'
+    jsonl_path.write_text(''.join(json.dumps({'last_run': '2024-01-01 00:00:00', 'job_name': 'A', 'job_id': f'job-{i}:org',
+                                              'last_run_threshold': threshold}) + '\n'
+                                  for i, threshold in enumerate([THRESHOLD, '2024-06-30'])))
+    with pytest.raises(ValueError):
+        convert_jsonl_to_binary(str(jsonl_path), str(tmp_path / 'jobs.bin'))
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['jobs.jsonl']
+
+
+def test_convert_rejects_empty_input(tmp_path):
+    jsonl_path = tmp_path / 'jobs.jsonl'
+    jsonl_path.write_text('')
+    with pytest.raises(ValueError):
+        convert_jsonl_to_binary(str(jsonl_path), str(tmp_path / 'jobs.bin'))
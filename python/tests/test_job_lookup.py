@@ -0,0 +1,74 @@
+#################################################################
+# FILE:  test_job_lookup.py
+#
+# DESCRIPTION:    Tests of the lookup of Jobs by ID and of the candidate Jobs in job_lookup.py, against a
+#                 stub Control Hub.
+#
+#################################################################
+
+from concurrency import ControlHubCaller
+from fake_control_hub import FakeHTTPError
+from job_lookup import get_jobs_by_id, get_candidate_jobs
+
+
+# A stub Job with just an ID
+class StubJob:
+    def __init__(self, job_id):
+        self.job_id = job_id
+
+
+# A stub sch.jobs that fails every search with the_error if it has more than the_max_ids IDs,
+# and counts the searches
+class StubJobs:
+    def __init__(self, the_error, the_max_ids=0):
+        self.error = the_error
+        self.max_ids = the_max_ids
+        self.search_count = 0
+
+    def get_all(self, search=None, **kwargs):
+        self.search_count += 1
+        job_ids = [clause[len('id=="'):-1] for clause in search.split(',')]
+        if len(job_ids) > self.max_ids:
+            raise self.error
+        return [StubJob(job_id) for job_id in job_ids]
+
+
+class StubControlHub:
+    def __init__(self, the_jobs):
+        self.jobs = the_jobs
+
+
+def test_a_rejected_query_is_split_in_half():
+    jobs = StubJobs(FakeHTTPError(400, 'Client Error: Bad Request'), the_max_ids=50)
+    job_ids = [f'job-{i}' for i in range(200)]
+    jobs_by_id, errors_by_id = get_jobs_by_id(StubControlHub(jobs), job_ids, ControlHubCaller(retries=0))
+    assert sorted(jobs_by_id) == sorted(job_ids)
+    assert errors_by_id == {}
+    assert jobs.search_count == 7
+
+
+def test_a_transient_error_is_not_split():
+    error = FakeHTTPError(429, 'Client Error: Too Many Requests')
+    jobs = StubJobs(error)
+    job_ids = [f'job-{i}' for i in range(200)]
+    jobs_by_id, errors_by_id = get_jobs_by_id(StubControlHub(jobs), job_ids, ControlHubCaller(retries=0))
+    assert jobs_by_id == {}
+    assert errors_by_id == {job_id: error for job_id in job_ids}
+    assert jobs.search_count == 1
+
+
+# A stub sch.jobs of the_job_count Jobs that returns the first page of the_len Jobs whatever the
+# offset, like a version of the SDK that ignores it
+class StubJobsIgnoringOffset:
+    def __init__(self, the_job_count):
+        self.all_jobs = [StubJob(f'job-{i}') for i in range(the_job_count)]
+
+    def get_all(self, search=None, offset=None, len=None):
+        return self.all_jobs[:len] if len is not None else list(self.all_jobs)
+
+
+def test_an_ignored_offset_lists_the_rest_of_the_jobs():
+    jobs = StubJobsIgnoringOffset(25)
+    pages = list(get_candidate_jobs(StubControlHub(jobs), 0, the_page_size=10))
+    assert [len(page) for page in pages] == [10, 15]
+    assert [job.job_id for page in pages for job in page] == [job.job_id for job in jobs.all_jobs]